@@ -6,586 +6,5710 @@ import time
 import json
 import logging
 import sys
-from collections import defaultdict
-from typing import Dict, Set
+import stat
+import struct
+import select
+import selectors
+import ctypes
+import ctypes.util
+import zlib
+import queue
+import errno
+import asyncio
+import random
+import heapq
+import fnmatch
+import itertools
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+HASH_CACHE_VERSION = 2  # Versione del formato della cache degli hash
+UINT64 = struct.Struct("!Q")  # Interi nei payload (numeri di blocco, dimensioni)
+# Voce della lista dei file: lunghezza del nome, dimensione e SHA256, poi il nome
+LIST_RECORD = struct.Struct("!HQ32s")
+LIST_PAGE_SIZE = 64 * 1024  # Dimensione massima di una pagina della lista
+MANIFEST_BLOCK_BYTES = 80  # Byte per blocco (hash e separatori) di un manifest JSON
+LIST_DELETED = 0xFFFFFFFFFFFFFFFF  # Dimensione di una voce cancellata in LIST_SINCE
+LIST_CURSOR = struct.Struct("!QQ")  # Epoca del registro e generazione
+LIST_SINCE_REPLY = struct.Struct("!QQ?")  # Epoca, generazione, lista completa
+REGISTRY_TOMBSTONES = 100000  # Cancellazioni ricordate per le liste incrementali
+# Albero di Merkle del registro: le foglie raggruppano i file per i primi
+# MERKLE_DEPTH caratteri esadecimali dello SHA256 del nome, e ogni nodo contiene
+# il numero di file e la somma (mod 2^256) dei digest delle voci sottostanti
+MERKLE_DEPTH = 4
+MERKLE_NODE = struct.Struct("!Q32s")  # Numero di file e digest di un nodo
+MERKLE_MAX_PREFIXES = 256  # Rami diversi oltre cui conviene la lista completa
+HEX_DIGITS = "0123456789abcdef"
+BLOOM_BITS_PER_ENTRY = 10  # Bit del filtro di Bloom per voce (~1% di falsi positivi)
+BLOOM_HASHES = 7  # Funzioni hash del filtro di Bloom
+MAX_MESSAGE_SIZE = 1 << 30  # Limite di sicurezza per un singolo frame
+REQUEST_MAX_SIZE = 64 * 1024  # Limite delle richieste ricevute dal server
+DATA_MAX_SLACK = 64 * 1024  # Margine oltre block_size per i DATA ricevuti dal server
+BLOOM_MAX_SIZE = 2 * 1024 * 1024  # Filtro di Bloom più grande accettato dal server
+
+# Protocollo binario: ogni frame ha un'intestazione con magic, versione, tipo,
+# id dello stream e lunghezza del payload, seguita dal payload
+FRAME_MAGIC = b"P2"
+PROTOCOL_VERSION = 3  # 2: lista dei file a pagine binarie; 3: manifest a pagine
+FRAME_HEADER = struct.Struct("!2sBBII")
+FRAME_LIST = 0x01  # Richiesta della lista dei file, inviata a pagine (LIST_RECORD)
+FRAME_PREPARE = 0x02  # Invio di un file: dimensione (UINT64) + nome
+FRAME_CHUNK = 0x03  # Richiesta di un blocco: numero (UINT64) + nome
+FRAME_BLOCKS = 0x04  # Richiesta del manifest dei blocchi: nome
+FRAME_DELTA = 0x05  # Richiesta del delta di un file: nome
+FRAME_CHUNKS = 0x06  # Richiesta della lista dei chunk content-defined: nome
+FRAME_GETCHUNK = 0x07  # Richiesta di un chunk dello store: hash
+FRAME_LIST_SINCE = 0x08  # Richiesta dei file cambiati dopo una generazione
+FRAME_MERKLE = 0x09  # Richiesta della radice o dei figli di nodi dell'albero
+FRAME_LIST_BUCKETS = 0x0A  # Richiesta delle voci sotto alcuni nodi dell'albero
+FRAME_BLOOM = 0x0B  # Riconciliazione: filtro di Bloom delle voci di chi chiede
+FRAME_DATA = 0x10  # Risposta o messaggio successivo di uno scambio
+FRAME_ERROR = 0x11  # Errore della richiesta: messaggio in utf-8
+FRAME_BUSY = 0x12  # Nodo saturo: riprovare dopo i millisecondi indicati (UINT64)
+# Intestazione e payload di un frame nello stesso segmento TCP (solo Linux)
+MSG_MORE = getattr(socket, "MSG_MORE", 0)
+SPLICE_MIN_SIZE = 64 * 1024  # Payload più piccoli si ricevono in userspace
+SPLICE_PIPE_SIZE = 1024 * 1024  # Capacità richiesta per la pipe di splice
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)  # Vedi fcntl(2), solo Linux
+END_OF_BLOCKS = 0xFFFFFFFFFFFFFFFF  # Fine delle richieste di blocchi in un PREPARE
+ADLER_MOD = 65521  # Modulo del checksum Adler-32 usato come checksum debole
+DELTA_LITERAL = b"L"  # Istruzione DELTA: dati letterali
+DELTA_BLOCK = b"B"  # Istruzione DELTA: copia un blocco dalla copia del ricevente
+DELTA_END = b"E"  # Istruzione DELTA: fine, seguita da hash e dimensione del file
+DELTA_FALLBACK = b"F"  # Istruzione DELTA: delta non conveniente, usare i blocchi
+DELTA_MAX_UNMATCHED = 8  # Blocchi scorsi senza corrispondenze: poi si rinuncia
+DELTA_MAX_ROLLED = 32 * 1024 * 1024  # Byte scorsi al massimo con il checksum rotolante
+DELTA_MAX_BLOCKS = 8192  # Blocchi al massimo nella firma di una richiesta DELTA
+CHUNK_STORE_DIR = ".chunks"  # Store dei chunk deduplicati, dentro shared_dir
+CHUNK_STORE_TTL = 7 * 24 * 3600  # Chunk non più referenziati tenuti per 7 giorni
+CDC_AVG_SIZE = 65536  # Dimensione media dei chunk content-defined
+RESUME_PREFIX = ".part."  # Mappa dei blocchi ricevuti di un download interrotto
+RESUME_SAVE_INTERVAL = 2  # Secondi tra un salvataggio e l'altro della mappa
+TEMP_FILE_TTL = 24 * 3600  # File temporanei abbandonati rimossi dopo un giorno
+TEMP_CLEAN_INTERVAL = 3600  # Secondi tra due pulizie di temporanei e chunk
+POOL_IDLE_TIMEOUT = 30  # Secondi dopo cui una connessione inattiva del pool si chiude
+ENGINES = ("threads", "asyncio")  # Motori di rete disponibili
+ASYNC_EXECUTOR_WORKERS = 32  # Thread per disco e trasferimenti nel motore asyncio
+SERVER_WORKERS = 64  # Richieste servite in parallelo dal motore a thread
+SERVER_QUEUE_LIMIT = 128  # Richieste in attesa di un thread prima di rispondere BUSY
+BUSY_RETRY_AFTER = 1.0  # Secondi suggeriti ai peer respinti prima di riprovare
+BUSY_MAX_RETRIES = 3  # Tentativi di un client verso un peer che risponde BUSY
+PEER_SYNC_WORKERS = 8  # Peer sincronizzati in parallelo
+PEER_SYNC_TICK = 1.0  # Secondi tra due controlli delle scadenze dei peer
+PEER_EXPIRY = 30  # Secondi senza annunci dopo cui un peer viene dimenticato
+PEER_BACKOFF_MAX = 300  # Attesa massima dopo sincronizzazioni fallite (s)
+TRANSFER_WORKERS = 4  # Trasferimenti di file eseguiti in parallelo
+TRANSFER_SIZE_RATE = 10 * 1024 * 1024  # Byte che valgono un secondo di scadenza
+TRANSFER_DEFAULT_DEADLINE = 60.0  # Scadenza dei file fuori da ogni classe (s)
+THROUGHPUT_SMOOTHING = 0.2  # Peso dei nuovi campioni nella media del throughput
+SERVER_IDLE_TIMEOUT = (
+    60  # Secondi di inattività dopo cui il server chiude la connessione
+)
+
+# Costanti inotify (vedi <sys/inotify.h>)
+IN_ATTRIB = 0x00000004  # Metadati cambiati (es. touch)
+IN_CLOSE_WRITE = 0x00000008  # File aperto in scrittura e chiuso
+IN_MOVED_FROM = 0x00000040  # File spostato fuori dalla cartella
+IN_MOVED_TO = 0x00000080  # File spostato dentro la cartella
+IN_CREATE = 0x00000100  # File o cartella creati
+IN_DELETE = 0x00000200  # File cancellato
+IN_DELETE_SELF = 0x00000400  # Cartella osservata cancellata
+IN_MOVE_SELF = 0x00000800  # Cartella osservata spostata
+IN_Q_OVERFLOW = 0x00004000  # Coda eventi del kernel piena, eventi persi
+IN_IGNORED = 0x00008000  # Watch rimosso
+IN_ONLYDIR = 0x01000000  # Osserva il percorso solo se è una cartella
+IN_ISDIR = 0x40000000  # L'evento riguarda una cartella
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class BlockHasher:
+    """Calcola in streaming l'hash SHA256 di un file e di ogni suo blocco."""
+
+    def __init__(self, block_size: int) -> None:
+        """
+        Args:
+            block_size (int): Dimensione dei blocchi.
+        """
+        self.block_size = block_size
+        self.file_hasher = hashlib.sha256()
+        self.block_hasher = hashlib.sha256()
+        self.block_fill = 0  # Byte già accumulati nel blocco corrente
+        self.block_hashes: List[str] = []
+
+    def update(self, data: bytes) -> None:
+        """
+        Aggiunge dati al file, in qualunque suddivisione.
+
+        Args:
+            data (bytes): Dati successivi del file.
+        """
+        self.file_hasher.update(data)
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.block_size - self.block_fill)
+            self.block_hasher.update(view[:take])
+            self.block_fill += take
+            view = view[take:]
+            if self.block_fill == self.block_size:
+                self.block_hashes.append(self.block_hasher.hexdigest())
+                self.block_hasher = hashlib.sha256()
+                self.block_fill = 0
+
+    def result(self) -> Tuple[str, List[str]]:
+        """
+        Returns:
+            Tuple[str, List[str]]: Hash del file e hash dei blocchi.
+        """
+        block_hashes = list(self.block_hashes)
+        if self.block_fill:
+            block_hashes.append(self.block_hasher.hexdigest())  # Ultimo blocco parziale
+        return self.file_hasher.hexdigest(), block_hashes
+
+
+class FastCDC:
+    """
+    Chunking content-defined con l'algoritmo FastCDC.
+
+    I punti di taglio dipendono solo dal contenuto (gear hash sugli ultimi 32
+    byte), quindi regioni uguali producono gli stessi chunk anche se spostate.
+    La normalizzazione usa una maschera più severa prima della dimensione media
+    e una più permissiva dopo, per concentrare le dimensioni attorno alla media.
+    """
+
+    # Tabella gear: deve essere identica su tutti i peer, quindi è deterministica
+    GEAR = [
+        int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "big")
+        for i in range(256)
+    ]
+
+    def __init__(self, avg_size: int = CDC_AVG_SIZE) -> None:
+        """
+        Args:
+            avg_size (int): Dimensione media dei chunk (potenza di 2).
+        """
+        bits = avg_size.bit_length() - 1
+        self.min_size = avg_size // 4
+        self.avg_size = avg_size
+        self.max_size = avg_size * 8
+        self.mask_small = ((1 << (bits + 2)) - 1) << (32 - bits - 2)  # Bit alti
+        self.mask_large = ((1 << (bits - 2)) - 1) << (32 - bits + 2)
+
+    def cut_point(self, data: bytearray, start: int, end: int) -> int:
+        """
+        Trova la lunghezza del chunk che inizia in data[start].
+
+        Args:
+            data (bytearray): Buffer dei dati.
+            start (int): Inizio del chunk.
+            end (int): Fine dei dati disponibili.
+
+        Returns:
+            int: Lunghezza del chunk.
+        """
+        available = end - start
+        if available <= self.min_size:
+            return available
+        gear = self.GEAR
+        normal_end = start + min(available, self.avg_size)
+        hard_end = start + min(available, self.max_size)
+        h = 0
+        i = start + self.min_size  # I primi min_size byte non possono essere un taglio
+        for byte in data[i:normal_end]:
+            i += 1
+            h = ((h << 1) + gear[byte]) & 0xFFFFFFFF
+            if not h & self.mask_small:
+                return i - start
+        for byte in data[normal_end:hard_end]:
+            i += 1
+            h = ((h << 1) + gear[byte]) & 0xFFFFFFFF
+            if not h & self.mask_large:
+                return i - start
+        return hard_end - start
+
+    def split(self, f) -> Iterator[bytes]:
+        """
+        Divide un file in chunk content-defined.
+
+        Args:
+            f: File aperto in lettura binaria.
+
+        Yields:
+            bytes: Chunk successivi del file.
+        """
+        buf = bytearray()
+        pos = 0
+        eof = False
+        while True:
+            if not eof and len(buf) - pos < self.max_size:
+                del buf[:pos]
+                pos = 0
+                data = f.read(max(self.max_size, 4 * 1024 * 1024))
+                eof = not data
+                buf += data
+                continue
+            if pos == len(buf):
+                return
+            length = self.cut_point(buf, pos, len(buf))
+            yield bytes(buf[pos : pos + length])
+            pos += length
+
+
+class BloomFilter:
+    """
+    Filtro di Bloom sui digest delle voci del registro (vedi _merkle_leaf).
+
+    I digest sono già SHA256 uniformi, quindi le posizioni dei bit sono prese
+    da gruppi di 32 bit del digest senza ricalcolare altri hash.
+    """
+
+    def __init__(self, capacity: int, hashes: int = BLOOM_HASHES) -> None:
+        """
+        Args:
+            capacity (int): Numero di voci previste.
+            hashes (int): Numero di funzioni hash (al massimo 8).
+        """
+        self.hashes = hashes
+        self.bits = bytearray((max(capacity, 1) * BLOOM_BITS_PER_ENTRY + 7) // 8)
+        self.size = len(self.bits) * 8
+
+    @classmethod
+    def from_bytes(cls, payload: memoryview) -> "BloomFilter":
+        """
+        Ricostruisce un filtro codificato con to_bytes.
+
+        Args:
+            payload (memoryview): Numero di funzioni hash (un byte) e bit.
+
+        Returns:
+            BloomFilter: Filtro ricevuto.
+
+        Raises:
+            ValueError: Se il filtro non è valido.
+        """
+        if len(payload) < 2 or not 1 <= payload[0] <= 8:
+            raise ValueError("Filtro di Bloom non valido")
+        bloom = cls(0, payload[0])
+        bloom.bits = bytearray(payload[1:])
+        bloom.size = len(bloom.bits) * 8
+        return bloom
+
+    def to_bytes(self) -> bytes:
+        """
+        Returns:
+            bytes: Numero di funzioni hash (un byte) seguito dai bit del filtro.
+        """
+        return bytes([self.hashes]) + self.bits
+
+    def add(self, digest: int) -> None:
+        """
+        Args:
+            digest (int): Digest della voce da aggiungere.
+        """
+        for i in range(self.hashes):
+            bit = (digest >> (32 * i) & 0xFFFFFFFF) % self.size
+            self.bits[bit >> 3] |= 1 << (bit & 7)
+
+    def __contains__(self, digest: int) -> bool:
+        """
+        Args:
+            digest (int): Digest della voce da cercare.
+
+        Returns:
+            bool: False se la voce non è certamente nel filtro.
+        """
+        for i in range(self.hashes):
+            bit = (digest >> (32 * i) & 0xFFFFFFFF) % self.size
+            if not self.bits[bit >> 3] & 1 << (bit & 7):
+                return False
+        return True
+
+
+class ProtocolError(Exception):
+    """Frame non valido o risposta di errore ricevuta da un peer."""
+
+
+class FrameTooLargeError(ProtocolError):
+    """Frame con un payload annunciato oltre il limite del suo tipo."""
+
+    def __init__(self, stream_id: int, length: int) -> None:
+        """
+        Args:
+            stream_id (int): Id dello stream del frame.
+            length (int): Lunghezza annunciata del payload.
+        """
+        super().__init__(f"Frame troppo grande: {length} bytes")
+        self.stream_id = stream_id
+
+
+class PeerBusyError(ProtocolError):
+    """Il peer è saturo e ha chiesto di riprovare più tardi (frame BUSY)."""
+
+    def __init__(self, payload: memoryview) -> None:
+        """
+        Args:
+            payload (memoryview): Payload del frame BUSY: millisecondi di attesa.
+        """
+        if len(payload) == UINT64.size:
+            self.retry_after = UINT64.unpack(payload)[0] / 1000
+        else:
+            self.retry_after = BUSY_RETRY_AFTER
+        # Un peer non può far attendere il client indefinitamente
+        self.retry_after = min(self.retry_after, 30.0)
+        super().__init__(f"Peer occupato, riprovare tra {self.retry_after:.1f}s")
+
+
+class TokenBucket:
+    """
+    Token bucket che limita una velocità in byte al secondo.
+
+    Il consumo può andare in debito: chi chiede più token di quelli disponibili
+    riceve il tempo da attendere per ripagarli, così anche un blocco più grande
+    della capacità passa, e più thread che condividono il bucket si dividono la
+    banda nell'ordine in cui la chiedono.
+    """
+
+    def __init__(self, rate: int = 0) -> None:
+        """
+        Args:
+            rate (int): Velocità massima in byte al secondo; 0 per nessun limite.
+        """
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: int) -> None:
+        """
+        Cambia la velocità massima; la capacità è pari a un secondo di traffico.
+
+        Args:
+            rate (int): Velocità massima in byte al secondo; 0 per nessun limite.
+        """
+        with self.lock:
+            self.rate = max(0, rate)
+            self.tokens = min(self.tokens, float(self.rate))
+
+    def reserve(self, amount: int) -> float:
+        """
+        Preleva dei token.
+
+        Args:
+            amount (int): Byte da trasferire.
+
+        Returns:
+            float: Secondi da attendere prima di trasferirli (0 se subito).
+        """
+        with self.lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(
+                float(self.rate), self.tokens + (now - self.last) * self.rate
+            )
+            self.last = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class BufferPool:
+    """
+    Pool di buffer di ricezione preallocati, condivisi tra le connessioni.
+
+    Ogni connessione prende un buffer quando viene aperta e lo restituisce
+    quando viene chiusa, così i buffer grandi (almeno un blocco più
+    l'intestazione) non vengono riallocati per ogni connessione.
+    """
+
+    def __init__(self, buffer_size: int, max_buffers: int = 32) -> None:
+        """
+        Args:
+            buffer_size (int): Dimensione minima dei buffer.
+            max_buffers (int): Buffer liberi tenuti nel pool.
+        """
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self.free: List[bytearray] = []
+        self.lock = threading.Lock()
+
+    def acquire(self, size: int = 0) -> bytearray:
+        """
+        Preleva un buffer libero di almeno size byte, o ne alloca uno nuovo.
+
+        Args:
+            size (int): Dimensione minima richiesta. Default: buffer_size.
+
+        Returns:
+            bytearray: Buffer da usare con recv_into.
+        """
+        size = max(size, self.buffer_size)
+        with self.lock:
+            for i, buffer in enumerate(self.free):
+                if len(buffer) >= size:
+                    return self.free.pop(i)
+        return bytearray(size)
+
+    def release(self, buffer: bytearray) -> None:
+        """
+        Restituisce un buffer al pool; quelli in eccesso o troppo grandi vengono
+        lasciati al garbage collector.
+
+        Args:
+            buffer (bytearray): Buffer non più usato.
+        """
+        with self.lock:
+            if (
+                len(self.free) < self.max_buffers
+                and len(buffer) <= 4 * self.buffer_size
+            ):
+                self.free.append(buffer)
+
+
+class BaseFrameConnection:
+    """
+    Interfaccia comune delle connessioni che scambiano frame binari.
+
+    Le sottoclassi implementano la ricezione e l'invio dei singoli frame; qui ci
+    sono gli id degli stream, i limiti sulla dimensione dei frame e gli scambi
+    di richiesta e risposta costruiti sopra.
+    """
+
+    def __init__(
+        self, peer_ip: str, frame_limits: Optional[Dict[int, int]] = None
+    ) -> None:
+        """
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+            frame_limits (Optional[Dict[int, int]]): Payload massimo per tipo di
+                frame, REQUEST_MAX_SIZE per i tipi non indicati; se None vale
+                MAX_MESSAGE_SIZE per tutti.
+        """
+        self.peer_ip = peer_ip
+        self.frame_limits = frame_limits
+        self.next_stream = 1
+        self.can_splice = False  # Solo le connessioni su socket (receive_to_file)
+
+    def receive_header(self, exact: bool = False) -> Tuple[int, int, int]:
+        """
+        Riceve l'intestazione di un frame; il payload va letto subito dopo con
+        receive_payload.
+
+        Args:
+            exact (bool): Se True non legge oltre l'intestazione, dove possibile.
+
+        Returns:
+            Tuple[int, int, int]: Tipo, id dello stream e lunghezza del payload.
+        """
+        raise NotImplementedError
+
+    def receive_payload(self, length: int) -> memoryview:
+        """
+        Riceve il payload del frame di cui è stata letta l'intestazione.
+
+        Args:
+            length (int): Lunghezza del payload.
+
+        Returns:
+            memoryview: Payload, valido solo fino alla prossima ricezione.
+        """
+        raise NotImplementedError
+
+    def receive_to_file(self, length: int, fd: int, offset: int) -> None:
+        """
+        Riceve il payload del frame corrente scrivendolo in un file; disponibile
+        solo se can_splice è True.
+
+        Args:
+            length (int): Lunghezza del payload.
+            fd (int): Descrittore del file di destinazione.
+            offset (int): Posizione nel file.
+        """
+        raise NotImplementedError(f"{type(self).__name__} non riceve su file")
+
+    def send(self, frame_type: int, stream_id: int, payload: bytes = b"") -> None:
+        """
+        Invia un frame.
+
+        Args:
+            frame_type (int): Tipo del frame (FRAME_*).
+            stream_id (int): Id dello stream.
+            payload (bytes): Contenuto del frame.
+        """
+        raise NotImplementedError
+
+    def send_file(
+        self, frame_type: int, stream_id: int, f, offset: int, count: int
+    ) -> int:
+        """
+        Invia come payload di un frame una porzione di file.
+
+        Args:
+            frame_type (int): Tipo del frame (FRAME_*).
+            stream_id (int): Id dello stream.
+            f: File aperto in lettura binaria.
+            offset (int): Posizione iniziale nel file.
+            count (int): Byte da inviare, limitati alla fine del file.
+
+        Returns:
+            int: Byte inviati come payload.
+        """
+        raise NotImplementedError
+
+    def has_buffered_data(self) -> bool:
+        """
+        Returns:
+            bool: True se ci sono dati ricevuti ma non ancora consumati.
+        """
+        raise NotImplementedError
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        """
+        Args:
+            timeout (Optional[float]): Timeout delle operazioni.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Chiude la connessione."""
+        raise NotImplementedError
+
+    def receive(self) -> Tuple[int, int, memoryview]:
+        """
+        Riceve un frame.
+
+        Returns:
+            Tuple[int, int, memoryview]: Tipo, id dello stream e payload; il
+            payload è valido solo fino alla prossima chiamata.
+
+        Raises:
+            ProtocolError: Se l'intestazione non è valida.
+        """
+        frame_type, stream_id, length = self.receive_header()
+        return frame_type, stream_id, self.receive_payload(length)
+
+    def frame_limit(self, frame_type: int) -> int:
+        """
+        Args:
+            frame_type (int): Tipo del frame (FRAME_*).
+
+        Returns:
+            int: Lunghezza massima accettata per il payload.
+        """
+        if self.frame_limits is None:
+            return MAX_MESSAGE_SIZE
+        return self.frame_limits.get(frame_type, REQUEST_MAX_SIZE)
+
+    def send_error(self, stream_id: int, message: str) -> None:
+        """
+        Risponde a una richiesta con un frame di errore.
+
+        Args:
+            stream_id (int): Id dello stream della richiesta.
+            message (str): Descrizione dell'errore.
+        """
+        self.send(FRAME_ERROR, stream_id, message.encode())
+
+    def new_stream(self) -> int:
+        """
+        Restituisce un nuovo id di stream per una richiesta.
+
+        Returns:
+            int: Id dello stream.
+        """
+        stream_id = self.next_stream
+        self.next_stream = stream_id % 0xFFFFFFFF + 1
+        return stream_id
+
+    def receive_data(self, stream_id: int) -> memoryview:
+        """
+        Riceve il frame DATA successivo di uno stream.
+
+        Args:
+            stream_id (int): Id dello stream atteso.
+
+        Returns:
+            memoryview: Payload, valido fino alla prossima ricezione.
+
+        Raises:
+            PeerBusyError: Se il peer è saturo e chiede di riprovare.
+            ProtocolError: Se il peer risponde con un errore o con un frame inatteso.
+        """
+        frame_type, received_stream, payload = self.receive()
+        if frame_type == FRAME_BUSY:
+            raise PeerBusyError(payload)  # Anche sullo stream 0, prima della richiesta
+        if received_stream != stream_id:
+            raise ProtocolError(f"Frame dello stream {received_stream} inatteso")
+        if frame_type == FRAME_ERROR:
+            raise ProtocolError(str(payload, "utf-8", "replace"))
+        if frame_type != FRAME_DATA:
+            raise ProtocolError(f"Frame di tipo {frame_type:#x} inatteso")
+        return payload
+
+    def request(self, frame_type: int, payload: bytes = b"") -> Tuple[int, memoryview]:
+        """
+        Invia una richiesta su un nuovo stream e ne riceve la risposta.
+
+        Args:
+            frame_type (int): Tipo della richiesta (FRAME_*).
+            payload (bytes): Contenuto della richiesta.
+
+        Returns:
+            Tuple[int, memoryview]: Id dello stream, per eventuali messaggi
+            successivi dello scambio, e payload della risposta.
+        """
+        stream_id = self.new_stream()
+        self.send(frame_type, stream_id, payload)
+        return stream_id, self.receive_data(stream_id)
+
+
+
+class FrameConnection(BaseFrameConnection):
+    """
+    Connessione TCP che scambia frame binari con intestazione a lunghezza fissa.
+
+    I dati ricevuti vengono letti con recv_into in un buffer preallocato, con
+    letture grandi quanto lo spazio libero nel buffer, e i payload sono
+    restituiti come memoryview sul buffer, senza copie: restano validi solo fino
+    alla ricezione successiva. Ogni richiesta ha un id di stream, ripetuto nei
+    frame di risposta, così più richieste condividono la stessa connessione.
+    """
 
-class P2PFileSync:
     def __init__(
         self,
-        shared_dir: str = "shared",  # Cartella condivisa per i file
-        block_size: int = 1048576,  # 1MB
-        multicast_group: str = "239.255.255.250",  # Indirizzo multicast per il discovery
-        multicast_port: int = 5007,  # Porta multicast per il discovery
-        peer_port: int = 5005,  # Porta TCP per le connessioni peer-to-peer
-        sync_interval: int = 10,  # Intervallo di sincronizzazione in secondi
+        sock: socket.socket,
+        peer_ip: str,
+        buffers: Optional[BufferPool] = None,
+        buffer_size: int = 256 * 1024,
+        frame_limits: Optional[Dict[int, int]] = None,
+    ) -> None:
+        """
+        Args:
+            sock (socket.socket): Socket connesso.
+            peer_ip (str): Indirizzo IP del peer.
+            buffers (Optional[BufferPool]): Pool da cui prendere il buffer di
+                ricezione; se None il buffer viene allocato dalla connessione.
+            buffer_size (int): Dimensione iniziale del buffer senza pool.
+            frame_limits (Optional[Dict[int, int]]): Payload massimo per tipo di
+                frame, REQUEST_MAX_SIZE per i tipi non indicati; se None vale
+                MAX_MESSAGE_SIZE per tutti.
+        """
+        super().__init__(peer_ip, frame_limits)
+        self.sock = sock
+        self.buffers = buffers
+        self.buffer = buffers.acquire() if buffers else bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Inizio dei dati non ancora consumati nel buffer
+        self.end = 0  # Fine dei dati ricevuti nel buffer
+        self.can_splice = hasattr(os, "splice")  # Solo Linux
+        self.pipe: Optional[Tuple[int, int]] = (
+            None  # Pipe per splice, creata al bisogno
+        )
+        self.pipe_size = 65536
+
+    def _fill(self, size: int, exact: bool = False) -> None:
+        """
+        Riceve dati finché il buffer contiene almeno size byte non consumati.
+
+        Args:
+            size (int): Byte richiesti a partire da start.
+            exact (bool): Se True non legge oltre i size byte richiesti, così i
+                dati successivi restano nel socket (per splice).
+
+        Raises:
+            ConnectionError: Se la connessione si chiude prima del previsto.
+        """
+        if self.end - self.start >= size:
+            return
+        pending = self.end - self.start
+        if size > len(self.buffer) - self.start and self.start:
+            # Sposta i dati residui all'inizio per fare spazio
+            if pending <= self.start:
+                self.buffer[:pending] = self.view[self.start : self.end]
+            else:
+                # Le due zone si sovrappongono: serve una copia intermedia
+                self.buffer[:pending] = self.buffer[self.start : self.end]
+            self.start, self.end = 0, pending
+        while self.end - self.start < size:
+            if self.end == len(self.buffer):
+                # Buffer pieno: cresce man mano che i dati arrivano, non in base
+                # alla lunghezza annunciata dal peer
+                self._grow(min(size, 2 * len(self.buffer)))
+            limit = self.start + size if exact else len(self.buffer)
+            received = self.sock.recv_into(self.view[self.end : limit])
+            if not received:
+                raise ConnectionError("Connessione chiusa dal peer")
+            self.end += received
+
+    def _grow(self, size: int) -> None:
+        """
+        Sostituisce il buffer con uno di almeno size byte, che inizia con i
+        dati non ancora consumati.
+
+        Args:
+            size (int): Dimensione minima del nuovo buffer.
+        """
+        pending = self.end - self.start
+        buffer = self.buffers.acquire(size) if self.buffers else bytearray(size)
+        buffer[:pending] = self.view[self.start : self.end]
+        if self.buffers:
+            self.buffers.release(self.buffer)
+        self.buffer, self.view = buffer, memoryview(buffer)
+        self.start, self.end = 0, pending
+
+    def receive_header(self, exact: bool = False) -> Tuple[int, int, int]:
+        """
+        Riceve l'intestazione di un frame; il payload va letto subito dopo con
+        receive_payload o receive_to_file.
+
+        Args:
+            exact (bool): Se True non legge dal socket oltre l'intestazione.
+
+        Returns:
+            Tuple[int, int, int]: Tipo, id dello stream e lunghezza del payload.
+
+        Raises:
+            ProtocolError: Se l'intestazione non è valida.
+            FrameTooLargeError: Se il payload supera il limite del suo tipo; il
+                payload resta da leggere e la connessione va chiusa.
+        """
+        self._fill(FRAME_HEADER.size, exact)
+        magic, version, frame_type, stream_id, length = FRAME_HEADER.unpack_from(
+            self.buffer, self.start
+        )
+        if magic != FRAME_MAGIC or version != PROTOCOL_VERSION:
+            raise ProtocolError(f"Frame non valido (versione {version})")
+        self._consume(FRAME_HEADER.size)
+        if length > self.frame_limit(frame_type):
+            raise FrameTooLargeError(stream_id, length)
+        return frame_type, stream_id, length
+
+    def receive_payload(self, length: int) -> memoryview:
+        """
+        Riceve il payload del frame di cui è stata letta l'intestazione.
+
+        Args:
+            length (int): Lunghezza del payload.
+
+        Returns:
+            memoryview: Payload, valido solo fino alla prossima ricezione.
+        """
+        self._fill(length)
+        payload = self.view[self.start : self.start + length]
+        self._consume(length)
+        return payload
+
+    def receive_to_file(self, length: int, fd: int, offset: int) -> None:
+        """
+        Riceve il payload del frame corrente scrivendolo in un file.
+
+        Con splice(2) i byte passano dal socket al file attraverso una pipe
+        senza entrare in userspace; i byte già letti nel buffer vengono scritti
+        con pwrite. Se splice non è supportato (piattaforma, file system) si
+        ripiega automaticamente su recv_into e pwrite.
+
+        Args:
+            length (int): Lunghezza del payload.
+            fd (int): Descrittore del file di destinazione.
+            offset (int): Posizione nel file.
+        """
+        buffered = min(length, self.end - self.start)
+        if buffered:
+            self._pwrite(fd, self.view[self.start : self.start + buffered], offset)
+            self._consume(buffered)
+        remaining = length - buffered
+        offset += buffered
+        while remaining:
+            if self.can_splice:
+                try:
+                    moved = self._splice(remaining, fd, offset)
+                except OSError as e:
+                    if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                        raise
+                    self.can_splice = False  # Non supportato: si ripiega su pwrite
+                    continue
+            else:
+                moved = min(remaining, len(self.buffer))
+                self._fill(moved)
+                self._pwrite(fd, self.view[self.start : self.start + moved], offset)
+                self._consume(moved)
+            remaining -= moved
+            offset += moved
+
+    def _splice(self, count: int, fd: int, offset: int) -> int:
+        """
+        Sposta fino a count byte dal socket al file con due chiamate a splice.
+
+        Args:
+            count (int): Byte ancora da ricevere.
+            fd (int): Descrittore del file di destinazione.
+            offset (int): Posizione nel file.
+
+        Returns:
+            int: Byte scritti nel file.
+
+        Raises:
+            ConnectionError: Se la connessione si chiude prima del previsto.
+            socket.timeout: Se il peer non invia dati entro il timeout.
+        """
+        if self.pipe is None:
+            self.pipe = os.pipe()
+            if fcntl is not None:
+                try:
+                    self.pipe_size = fcntl.fcntl(
+                        self.pipe[1], F_SETPIPE_SZ, SPLICE_PIPE_SIZE
+                    )
+                except OSError:
+                    pass  # Resta la capacità predefinita
+        read_fd, write_fd = self.pipe
+        while True:
+            try:
+                moved = os.splice(
+                    self.sock.fileno(), write_fd, min(count, self.pipe_size)
+                )
+                break
+            except BlockingIOError:
+                # Socket con timeout (non bloccante): attende i dati con poll,
+                # che a differenza di select accetta qualsiasi descrittore
+                timeout = self.sock.gettimeout()
+                poller = select.poll()
+                poller.register(self.sock, select.POLLIN)
+                if not poller.poll(None if timeout is None else timeout * 1000):
+                    raise socket.timeout("timed out")
+        if not moved:
+            raise ConnectionError("Connessione chiusa dal peer")
+        written = 0
+        try:
+            while written < moved:
+                written += os.splice(
+                    read_fd, fd, moved - written, offset_dst=offset + written
+                )
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+            # Il file system non supporta splice: svuota la pipe con read e pwrite
+            self.can_splice = False
+            while written < moved:
+                data = os.read(read_fd, moved - written)
+                self._pwrite(fd, data, offset + written)
+                written += len(data)
+        return moved
+
+    @staticmethod
+    def _pwrite(fd: int, data: memoryview, offset: int) -> None:
+        """
+        Scrive tutti i dati in una posizione del file.
+
+        Args:
+            fd (int): Descrittore del file.
+            data (memoryview): Dati da scrivere.
+            offset (int): Posizione nel file.
+        """
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view, offset = view[written:], offset + written
+
+    def _consume(self, size: int) -> None:
+        """
+        Segna come consumati size byte del buffer.
+
+        Args:
+            size (int): Byte consumati.
+        """
+        self.start += size
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def send(self, frame_type: int, stream_id: int, payload: bytes = b"") -> None:
+        """
+        Invia un frame.
+
+        Args:
+            frame_type (int): Tipo del frame (FRAME_*).
+            stream_id (int): Id dello stream.
+            payload (bytes): Contenuto del frame.
+        """
+        header = FRAME_HEADER.pack(
+            FRAME_MAGIC, PROTOCOL_VERSION, frame_type, stream_id, len(payload)
+        )
+        if len(payload) <= 65536:
+            self.sock.sendall(header + payload)  # Un solo segmento per i frame piccoli
+        else:
+            self.sock.sendall(header)
+            self.sock.sendall(payload)
+
+    def send_file(
+        self, frame_type: int, stream_id: int, f, offset: int, count: int
+    ) -> int:
+        """
+        Invia come payload di un frame una porzione di file, senza copiarla in
+        memoria: con socket.sendfile il kernel trasferisce i dati direttamente
+        dalla page cache al socket (sendfile(2)); dove non è disponibile,
+        socket.sendfile ripiega da solo su letture e send.
+
+        Args:
+            frame_type (int): Tipo del frame (FRAME_*).
+            stream_id (int): Id dello stream.
+            f: File aperto in lettura binaria.
+            offset (int): Posizione iniziale nel file.
+            count (int): Byte da inviare, limitati alla fine del file.
+
+        Returns:
+            int: Byte inviati come payload.
+
+        Raises:
+            ConnectionError: Se il file si accorcia durante l'invio; il frame
+            resterebbe incompleto e la connessione va chiusa.
+        """
+        count = max(0, min(count, os.fstat(f.fileno()).st_size - offset))
+        header = FRAME_HEADER.pack(
+            FRAME_MAGIC, PROTOCOL_VERSION, frame_type, stream_id, count
+        )
+        self.sock.sendall(header, MSG_MORE if count else 0)
+        if count and self.sock.sendfile(f, offset, count) != count:
+            raise ConnectionError("File accorciato durante l'invio")
+        return count
+
+    def has_buffered_data(self) -> bool:
+        """
+        Returns:
+            bool: True se nel buffer ci sono dati ricevuti ma non consumati.
+        """
+        return self.end > self.start
+
+    def socket_readable(self) -> bool:
+        """
+        Controlla senza attendere se il socket ha dati da leggere. Usa recv con
+        MSG_PEEK invece di select(), che non accetta descrittori oltre FD_SETSIZE
+        (1024) e fallirebbe in un processo con molte connessioni aperte.
+
+        Returns:
+            bool: True se ci sono dati da leggere o se il peer ha chiuso la
+            connessione.
+        """
+        timeout = self.sock.gettimeout()
+        self.sock.setblocking(False)
+        try:
+            self.sock.recv(1, socket.MSG_PEEK)
+            return True  # Dati in arrivo, o b"" se il peer ha chiuso
+        except BlockingIOError:
+            return False
+        finally:
+            self.sock.settimeout(timeout)
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        """
+        Args:
+            timeout (Optional[float]): Timeout delle operazioni sul socket.
+        """
+        self.sock.settimeout(timeout)
+
+    def detach(self) -> socket.socket:
+        """
+        Libera buffer e pipe senza chiudere il socket, che resta utilizzabile per
+        una nuova FrameConnection. Da usare solo senza dati non consumati nel buffer.
+
+        Returns:
+            socket.socket: Socket della connessione.
+        """
+        if self.pipe is not None:
+            os.close(self.pipe[0])
+            os.close(self.pipe[1])
+            self.pipe = None
+        if self.buffers and self.buffer is not None:
+            self.buffers.release(self.buffer)
+        self.buffer = self.view = None
+        return self.sock
+
+    def close(self) -> None:
+        """Chiude la connessione e restituisce il buffer di ricezione al pool."""
+        self.detach().close()
+
+
+class AsyncFrameConnection(BaseFrameConnection):
+    """
+    Connessione a frame servita dal motore asyncio.
+
+    Nel loop i frame si leggono con read_frame, senza occupare thread mentre la
+    connessione è inattiva. I gestori delle richieste girano nel pool di thread
+    e usano la stessa interfaccia bloccante di FrameConnection, che qui inoltra
+    ogni operazione al loop e ne attende il risultato. I dati passano dal
+    trasporto asyncio: niente splice né receive_to_file.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        peer_ip: str,
+        loop: asyncio.AbstractEventLoop,
+        frame_limits: Optional[Dict[int, int]] = None,
+    ) -> None:
+        """
+        Args:
+            reader (asyncio.StreamReader): Flusso in lettura della connessione.
+            writer (asyncio.StreamWriter): Flusso in scrittura della connessione.
+            peer_ip (str): Indirizzo IP del peer.
+            loop (asyncio.AbstractEventLoop): Loop che gestisce la connessione.
+            frame_limits (Optional[Dict[int, int]]): Vedi BaseFrameConnection.
+        """
+        super().__init__(peer_ip, frame_limits)
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.timeout: Optional[float] = SERVER_IDLE_TIMEOUT
+
+    async def read_header(self) -> Tuple[int, int, int]:
+        """
+        Legge l'intestazione di un frame.
+
+        Returns:
+            Tuple[int, int, int]: Tipo, id dello stream e lunghezza del payload.
+
+        Raises:
+            ProtocolError: Se l'intestazione non è valida.
+            FrameTooLargeError: Se il payload supera il limite del suo tipo.
+        """
+        header = await self.reader.readexactly(FRAME_HEADER.size)
+        magic, version, frame_type, stream_id, length = FRAME_HEADER.unpack(header)
+        if magic != FRAME_MAGIC or version != PROTOCOL_VERSION:
+            raise ProtocolError(f"Frame non valido (versione {version})")
+        if length > self.frame_limit(frame_type):
+            raise FrameTooLargeError(stream_id, length)
+        return frame_type, stream_id, length
+
+    async def read_frame(self) -> Tuple[int, int, bytes]:
+        """
+        Legge un frame completo.
+
+        Returns:
+            Tuple[int, int, bytes]: Tipo, id dello stream e payload.
+        """
+        frame_type, stream_id, length = await self.read_header()
+        return frame_type, stream_id, await self.reader.readexactly(length)
+
+    async def write_frame(
+        self, frame_type: int, stream_id: int, payload: bytes = b""
+    ) -> None:
+        """
+        Scrive un frame e attende che il trasporto lo accetti.
+
+        Args:
+            frame_type (int): Tipo del frame (FRAME_*).
+            stream_id (int): Id dello stream.
+            payload (bytes): Contenuto del frame.
+        """
+        self.writer.write(
+            FRAME_HEADER.pack(
+                FRAME_MAGIC, PROTOCOL_VERSION, frame_type, stream_id, len(payload)
+            )
+        )
+        if payload:
+            self.writer.write(payload)
+        await self.writer.drain()
+
+    async def write_file(
+        self, frame_type: int, stream_id: int, f, offset: int, count: int
+    ) -> None:
+        """
+        Scrive un frame con una porzione di file come payload, con sendfile(2)
+        dove il trasporto lo supporta.
+
+        Args:
+            frame_type (int): Tipo del frame (FRAME_*).
+            stream_id (int): Id dello stream.
+            f: File aperto in lettura binaria.
+            offset (int): Posizione iniziale nel file.
+            count (int): Byte da inviare, già limitati alla fine del file.
+        """
+        self.writer.write(
+            FRAME_HEADER.pack(
+                FRAME_MAGIC, PROTOCOL_VERSION, frame_type, stream_id, count
+            )
+        )
+        await self.writer.drain()
+        if (
+            count
+            and await self.loop.sendfile(self.writer.transport, f, offset, count)
+            != count
+        ):
+            raise ConnectionError("File accorciato durante l'invio")
+
+    def _run(self, coroutine):
+        """
+        Esegue una coroutine nel loop della connessione e ne attende il risultato.
+
+        Args:
+            coroutine: Operazione da eseguire.
+
+        Returns:
+            Il risultato della coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(coroutine, self.timeout), self.loop
+        ).result()
+
+    def receive_header(self, exact: bool = False) -> Tuple[int, int, int]:
+        """Vedi BaseFrameConnection.receive_header."""
+        return self._run(self.read_header())
+
+    def receive_payload(self, length: int) -> memoryview:
+        """Vedi BaseFrameConnection.receive_payload."""
+        return memoryview(self._run(self.reader.readexactly(length)))
+
+    def send(self, frame_type: int, stream_id: int, payload: bytes = b"") -> None:
+        """Vedi BaseFrameConnection.send."""
+        self._run(self.write_frame(frame_type, stream_id, payload))
+
+    def send_file(
+        self, frame_type: int, stream_id: int, f, offset: int, count: int
+    ) -> int:
+        """Vedi BaseFrameConnection.send_file."""
+        count = max(0, min(count, os.fstat(f.fileno()).st_size - offset))
+        self._run(self.write_file(frame_type, stream_id, f, offset, count))
+        return count
+
+    def has_buffered_data(self) -> bool:
+        """Vedi BaseFrameConnection.has_buffered_data."""
+        return False
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        """Vedi BaseFrameConnection.settimeout."""
+        self.timeout = timeout
+
+    def close(self) -> None:
+        """Chiude la connessione dal loop."""
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Riceve gli annunci multicast dei peer per il motore asyncio."""
+
+    def __init__(self, node: "P2PFileSync") -> None:
+        """
+        Args:
+            node (P2PFileSync): Nodo che riceve gli annunci.
+        """
+        self.node = node
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        """
+        Gestisce un pacchetto di discovery.
+
+        Args:
+            data (bytes): Contenuto del pacchetto.
+            addr (tuple): Indirizzo del mittente (IP, porta).
+        """
+        self.node.logger.debug(f"📩 Ricevuto pacchetto da {addr}: {data!r}")
+        if data == b"DISCOVER" and addr[0] != self.node.local_ip:
+            self.node._touch_peer(addr[0])  # La sincronizzazione va nel suo pool
+
+
+class ConnectionPool:
+    """
+    Pool di connessioni TCP persistenti verso i peer.
+
+    Le connessioni restituite al pool restano aperte per POOL_IDLE_TIMEOUT secondi
+    e prima di essere riusate viene verificato che il peer non le abbia chiuse.
+    """
+
+    def __init__(
+        self,
+        port: int,
+        on_event: Callable[[str], None],
+        connect_timeout: float = 5,
+        io_timeout: float = 15,
+        idle_timeout: float = POOL_IDLE_TIMEOUT,
+        max_idle_per_peer: int = 4,
+        buffers: Optional[BufferPool] = None,
+    ) -> None:
+        """
+        Args:
+            port (int): Porta TCP dei peer.
+            on_event (Callable[[str], None]): Chiamata con il nome della metrica
+                ('pool_hits', 'pool_misses', 'pool_stale', 'connect_failures') a
+                ogni evento del pool: ogni pool_miss è un tentativo di connessione.
+            connect_timeout (float): Timeout di connessione in secondi.
+            io_timeout (float): Timeout delle operazioni sul socket in secondi.
+            idle_timeout (float): Inattività massima di una connessione nel pool.
+            max_idle_per_peer (int): Connessioni inattive tenute per ogni peer.
+            buffers (Optional[BufferPool]): Pool dei buffer di ricezione.
+        """
+        self.port = port
+        self.on_event = on_event
+        self.connect_timeout = connect_timeout
+        self.io_timeout = io_timeout
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_peer = max_idle_per_peer
+        self.buffers = buffers
+        self.idle: Dict[str, List[Tuple[FrameConnection, float]]] = defaultdict(list)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    @contextmanager
+    def connection(self, peer_ip: str) -> Iterator[FrameConnection]:
+        """
+        Fornisce una connessione verso un peer, riusandone una inattiva se possibile.
+
+        Se il blocco termina con un'eccezione la connessione viene chiusa, perché
+        il suo stato nel protocollo non è più noto; altrimenti torna nel pool.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+
+        Yields:
+            FrameConnection: Connessione pronta all'uso.
+        """
+        conn = self._acquire(peer_ip)
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+        self._release(peer_ip, conn)
+
+    def _acquire(self, peer_ip: str) -> FrameConnection:
+        """
+        Preleva una connessione sana dal pool o ne apre una nuova.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+
+        Returns:
+            FrameConnection: Connessione verso il peer.
+        """
+        while True:
+            with self.lock:
+                idle = self.idle.get(peer_ip)
+                if not idle:
+                    break
+                conn, since = idle.pop()
+            if time.monotonic() - since > self.idle_timeout or not self._is_healthy(
+                conn
+            ):
+                conn.close()
+                self.on_event("pool_stale")
+                continue
+            conn.settimeout(self.io_timeout)
+            self.on_event("pool_hits")
+            return conn
+
+        self.on_event("pool_misses")
+        try:
+            sock = socket.create_connection(
+                (peer_ip, self.port), timeout=self.connect_timeout
+            )
+        except OSError:
+            self.on_event("connect_failures")
+            raise
+        sock.settimeout(self.io_timeout)
+        return FrameConnection(sock, peer_ip, self.buffers)
+
+    def _release(self, peer_ip: str, conn: FrameConnection) -> None:
+        """
+        Restituisce una connessione al pool, o la chiude se il pool è pieno.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+            conn (FrameConnection): Connessione da restituire.
+        """
+        with self.lock:
+            idle = self.idle[peer_ip]
+            if not self.closed and len(idle) < self.max_idle_per_peer:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    @staticmethod
+    def _is_healthy(conn: FrameConnection) -> bool:
+        """
+        Verifica che una connessione inattiva sia ancora aperta.
+
+        Una connessione inattiva non deve avere dati da leggere, né nel buffer né
+        sul socket: se risulta leggibile il peer l'ha chiusa (EOF) o il protocollo
+        è fuori sincrono.
+
+        Args:
+            conn (FrameConnection): Connessione da verificare.
+
+        Returns:
+            bool: True se la connessione è riutilizzabile.
+        """
+        if conn.has_buffered_data():
+            return False
+        try:
+            return not conn.socket_readable()
+        except OSError:
+            return False
+
+    def prune(self) -> None:
+        """Chiude le connessioni rimaste inattive oltre idle_timeout."""
+        expiry = time.monotonic() - self.idle_timeout
+        with self.lock:
+            expired = []
+            for peer_ip, idle in self.idle.items():
+                expired += [conn for conn, since in idle if since < expiry]
+                idle[:] = [(conn, since) for conn, since in idle if since >= expiry]
+        for conn in expired:
+            conn.close()
+
+    def forget(self, peer_ip: str) -> None:
+        """
+        Chiude le connessioni inattive verso un peer che ha lasciato la rete.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+        """
+        with self.lock:
+            idle = self.idle.pop(peer_ip, [])
+        for conn, _ in idle:
+            conn.close()
+
+    def close_all(self) -> None:
+        """Chiude tutte le connessioni inattive e non accetta più restituzioni."""
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, defaultdict(list)
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+
+
+class SwarmDownload:
+    """
+    Stato condiviso di un download da più peer (swarm, in stile BitTorrent).
+
+    I blocchi da scaricare stanno in una coda comune: ogni peer ne prende di
+    nuovi appena ha spazio nella sua finestra, quindi i peer più veloci ne
+    ricevono di più. Quando la coda è vuota (endgame) un peer può chiedere anche
+    i blocchi ancora in volo verso altri peer, così un peer lento non rallenta
+    la fine del download; i duplicati vengono scartati.
+    """
+
+    def __init__(
+        self, sources: List[str], block_nums: List[int], block_hashes: List[str]
+    ) -> None:
+        """
+        Args:
+            sources (List[str]): Peer che hanno il file.
+            block_nums (List[int]): Numeri dei blocchi da scaricare.
+            block_hashes (List[str]): Hash SHA256 di tutti i blocchi del file.
+        """
+        self.sources = sources
+        self.block_hashes = block_hashes
+        self.pending = deque(block_nums)  # Blocchi non ancora richiesti
+        self.remaining = set(block_nums)  # Blocchi non ancora ricevuti
+        self.owners: Dict[int, Set[str]] = defaultdict(set)  # Blocco -> peer
+        self.results: "queue.Queue[Tuple[Optional[int], Optional[bytes]]]" = (
+            queue.Queue()
+        )
+        self.condition = threading.Condition()
+        self.stopped = False
+
+    def claim(self, peer_ip: str) -> Optional[int]:
+        """
+        Assegna a un peer il prossimo blocco da richiedere.
+
+        Args:
+            peer_ip (str): Peer che ha spazio nella sua finestra.
+
+        Returns:
+            Optional[int]: Numero del blocco, o None se per ora non c'è nulla da
+            chiedere a questo peer.
+        """
+        with self.condition:
+            if self.stopped:
+                return None
+            while self.pending:
+                block_num = self.pending.popleft()
+                if block_num in self.remaining:
+                    self.owners[block_num].add(peer_ip)
+                    return block_num
+            # Endgame: chiede anche a questo peer un blocco in volo verso altri
+            for block_num in self.remaining:
+                if peer_ip not in self.owners[block_num]:
+                    self.owners[block_num].add(peer_ip)
+                    return block_num
+            return None
+
+    def complete(self, peer_ip: str, block_num: int, data: memoryview) -> bool:
+        """
+        Consegna un blocco ricevuto (già verificato) al consumatore.
+
+        Args:
+            peer_ip (str): Peer da cui è arrivato il blocco.
+            block_num (int): Numero del blocco.
+            data (memoryview): Dati del blocco, copiati se il blocco è nuovo.
+
+        Returns:
+            bool: False se il blocco era già arrivato da un altro peer.
+        """
+        with self.condition:
+            self.owners[block_num].discard(peer_ip)
+            if block_num not in self.remaining:
+                return False
+            self.remaining.discard(block_num)
+            if not self.remaining:
+                self.condition.notify_all()
+        self.results.put((block_num, bytes(data)))
+        return True
+
+    def release(self, peer_ip: str) -> None:
+        """
+        Rimette in coda i blocchi chiesti a un peer che non risponde più.
+
+        Args:
+            peer_ip (str): Peer da escludere.
+        """
+        with self.condition:
+            for block_num in sorted(self.remaining):
+                owners = self.owners[block_num]
+                if peer_ip in owners:
+                    owners.discard(peer_ip)
+                    if not owners:
+                        self.pending.append(block_num)
+            self.condition.notify_all()
+
+    def wait_for_work(self, timeout: float = 0.5) -> None:
+        """
+        Attende che ci siano blocchi da richiedere o che il download finisca.
+
+        Args:
+            timeout (float): Attesa massima in secondi.
+        """
+        with self.condition:
+            if not self.finished():
+                self.condition.wait(timeout)
+
+    def finished(self) -> bool:
+        """
+        Returns:
+            bool: True se tutti i blocchi sono arrivati o il download è annullato.
+        """
+        return self.stopped or not self.remaining
+
+    def stop(self) -> None:
+        """Annulla il download: i peer smettono di chiedere nuovi blocchi."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+
+class Inotify:
+    """Wrapper minimale di inotify(7) tramite ctypes, disponibile solo su Linux."""
+
+    EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self) -> None:
+        """
+        Crea l'istanza inotify.
+
+        Raises:
+            OSError: Se inotify non è disponibile su questa piattaforma.
+        """
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify disponibile solo su Linux")
+        self.libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        # poll invece di select, che non accetta descrittori oltre FD_SETSIZE
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """
+        Aggiunge una cartella da osservare.
+
+        Args:
+            path (str): Percorso da osservare.
+            mask (int): Maschera degli eventi IN_*.
+
+        Returns:
+            int: Descrittore del watch.
+        """
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), ctypes.c_uint32(mask)
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read_events(self, timeout: float) -> Iterator[Tuple[int, int, int, str]]:
+        """
+        Legge gli eventi disponibili, attendendo al massimo timeout secondi.
+
+        Args:
+            timeout (float): Attesa massima in secondi.
+
+        Yields:
+            Tuple[int, int, int, str]: (wd, mask, cookie, nome del file).
+        """
+        if not self.poller.poll(timeout * 1000):
+            return
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(buf, offset)
+            offset += self.EVENT_HEADER.size
+            name = buf[offset : offset + length].rstrip(b"\0")
+            offset += length
+            yield wd, mask, cookie, os.fsdecode(name)
+
+    def close(self) -> None:
+        """Chiude il descrittore inotify."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class P2PFileSync:
+    def __init__(
+        self,
+        shared_dir: str = "shared",  # Cartella condivisa per i file
+        block_size: int = 1048576,  # 1MB
+        multicast_group: str = "239.255.255.250",  # Indirizzo multicast per il discovery
+        multicast_port: int = 5007,  # Porta multicast per il discovery
+        peer_port: int = 5005,  # Porta TCP per le connessioni peer-to-peer
+        sync_interval: int = 10,  # Intervallo di sincronizzazione in secondi
+        hash_cache_file: str = ".p2p_hashcache.json",  # File di cache degli hash
+        chunk_store: bool = False,  # Store di chunk deduplicati in shared_dir/.chunks
+        request_window: int = 8,  # Richieste di blocchi in volo per connessione
+        engine: str = "threads",  # Motore di rete: "threads" o "asyncio"
+        upload_limit: int = 0,  # Byte/s inviati a tutti i peer (0: nessun limite)
+        download_limit: int = 0,  # Byte/s ricevuti da tutti i peer (0: nessun limite)
+        peer_upload_limit: int = 0,  # Byte/s inviati a ciascun peer
+        peer_download_limit: int = 0,  # Byte/s ricevuti da ciascun peer
+        max_transfers: int = TRANSFER_WORKERS,  # Trasferimenti di file in parallelo
+        transfer_classes: Optional[Dict[str, float]] = None,  # Pattern -> scadenza
+        max_peer_syncs: int = PEER_SYNC_WORKERS,  # Peer sincronizzati in parallelo
+    ) -> None:
+        """
+        Inizializza il nodo P2P per la sincronizzazione dei file.
+
+        Args:
+            shared_dir (str): Cartella condivisa per i file. Default: "arcade_shared".
+            block_size (int): Dimensione dei blocchi per il trasferimento file. Default: 1MB.
+            multicast_group (str): Indirizzo multicast per il discovery. Default: '239.255.255.250'.
+            multicast_port (int): Porta multicast per il discovery. Default: 5007.
+            peer_port (int): Porta TCP per le connessioni peer-to-peer. Default: 5005.
+            sync_interval (int): Intervallo di sincronizzazione in secondi. Default: 10.
+            hash_cache_file (str): Nome del file (dentro shared_dir) in cui viene
+                salvata la cache degli hash. Default: '.p2p_hashcache.json'.
+            chunk_store (bool): Se True i file vengono divisi in chunk content-defined
+                (FastCDC) salvati una sola volta in shared_dir/.chunks, e i download
+                trasferiscono solo i chunk che non sono già nello store. Raddoppia
+                lo spazio occupato e rallenta la prima indicizzazione. Default: False.
+            request_window (int): Numero massimo di richieste di blocchi inviate
+                su una connessione senza attendere la risposta. Finestre più ampie
+                sfruttano meglio i collegamenti ad alta latenza. Default: 8.
+            engine (str): Motore di rete. "threads" serve ogni connessione in
+                entrata con un thread di un pool limitato; "asyncio" gestisce server, discovery e
+                loop di sincronizzazione in un event loop, così le connessioni
+                inattive non occupano thread, e usa un pool limitato di thread
+                solo per disco e trasferimenti. Default: "threads".
+            upload_limit (int): Limite globale in byte al secondo per i dati
+                inviati ai peer; 0 per nessun limite. Default: 0.
+            download_limit (int): Limite globale in byte al secondo per i dati
+                ricevuti dai peer; 0 per nessun limite. Default: 0.
+            peer_upload_limit (int): Limite in byte al secondo per i dati inviati
+                a ogni singolo peer; 0 per nessun limite. Default: 0.
+            peer_download_limit (int): Limite in byte al secondo per i dati
+                ricevuti da ogni singolo peer; 0 per nessun limite. Default: 0.
+            I limiti si possono cambiare a runtime con set_rate_limits.
+            max_transfers (int): Numero massimo di file scaricati o inviati in
+                parallelo; gli altri attendono in una coda con priorità. Default: 4.
+            transfer_classes (Optional[Dict[str, float]]): Classi di percorsi:
+                pattern glob (es. "*.conf", "archivio/*") -> scadenza in secondi
+                entro cui un file della classe dovrebbe partire. Vale il primo
+                pattern che corrisponde; gli altri file hanno una scadenza di 60s.
+                Ogni file riceve anche un secondo di scadenza ogni 10MB, così i
+                file piccoli passano davanti ai grandi, e chi attende da più tempo
+                scade prima dei nuovi arrivati. Default: None.
+            max_peer_syncs (int): Numero massimo di peer con cui scambiare le
+                liste dei file in parallelo. Ogni peer viene risincronizzato
+                sync_interval secondi dopo la fine della sua ultima
+                sincronizzazione, indipendentemente dagli altri. Default: 8.
+
+        Raises:
+            ValueError: Se il motore richiesto non esiste.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Motore sconosciuto: {engine!r} (validi: {ENGINES})")
+
+        # Inizializza il logger
+        self.logger = self._setup_logger()  # Configura il logger
+
+        # Configurazione directory e parametri
+        self.shared_dir = self._setup_shared_dir(
+            shared_dir
+        )  # Configura la cartella condivisa
+        self.block_size = block_size  # Dimensione dei blocchi per il trasferimento file
+        self.multicast_group = multicast_group  # Indirizzo multicast per il discovery
+        self.multicast_port = multicast_port  # Porta multicast per il discovery
+        self.peer_port = peer_port  # Porta TCP per le connessioni peer-to-peer
+        self.sync_interval = sync_interval  # Intervallo di sincronizzazione in secondi
+        self.request_window = max(1, request_window)  # Richieste di blocchi in volo
+        self.engine = engine  # Motore di rete
+        self.loop: Optional[asyncio.AbstractEventLoop] = None  # Solo motore asyncio
+        self.loop_thread: Optional[threading.Thread] = None
+        self.loop_stopped: Optional[asyncio.Event] = None
+        self.server_executor: Optional[ThreadPoolExecutor] = None  # Motore a thread
+        # Connessioni inattive restituite dai thread del pool al selettore del
+        # server, che viene svegliato scrivendo su server_wakeup
+        self.server_returns: deque = deque()
+        self.server_wakeup: Optional[socket.socket] = None
+        # Richieste accettate e non ancora concluse (in entrambi i motori):
+        # oltre il limite i peer ricevono BUSY
+        self.server_slots = threading.BoundedSemaphore(
+            (SERVER_WORKERS if engine == "threads" else ASYNC_EXECUTOR_WORKERS)
+            + SERVER_QUEUE_LIMIT
+        )
+
+        # Stato interno
+        self.peers: Set[str] = set()  # Insieme di peer connessi
+        self.file_registry: Dict[str, Dict] = defaultdict(
+            dict
+        )  # Registro dei file locali
+        self.active = True  # Flag per l'attività del nodo
+        self.local_ip = self._get_reliable_local_ip()  # Indirizzo IP locale
+        # (peer, file) -> hash del contenuto sincronizzato con il peer: se il
+        # file cambia su uno dei due lati l'hash non corrisponde più. Protetto
+        # da peer_lists_lock, come le altre informazioni sui peer
+        self.synced_files: Dict[Tuple[str, str], str] = {}
+        self.registry_lock = threading.Lock()  # Protegge file_registry
+        # Ogni modifica del registro incrementa la generazione e la salva nella
+        # voce ("gen"), o tra le cancellazioni: i peer chiedono con LIST_SINCE
+        # solo le voci cambiate dopo l'ultima generazione ricevuta. L'epoca
+        # cambia a ogni avvio, perché le generazioni ripartono da zero.
+        self.registry_epoch = random.getrandbits(63) + 1
+        self.registry_generation = 0
+        self.registry_tombstones: Dict[str, int] = {}  # nome -> generazione
+        # Indice di voci e cancellazioni per generazione, in ordine crescente: una
+        # risposta incrementale lo percorre dalla fine e costa O(modifiche)
+        self.registry_changes: Dict[int, str] = {}  # generazione -> nome
+        self.tombstone_floor = 0  # Cancellazioni più vecchie già dimenticate
+        # Nodi non vuoti dell'albero di Merkle: prefisso -> [numero di file, somma]
+        self.merkle_tree: Dict[str, List[int]] = {}
+        # Nomi dei file di ogni foglia dell'albero, per servire LIST_BUCKETS
+        # senza scorrere tutto il registro
+        self.merkle_buckets: Dict[str, Set[str]] = {}
+        # Ultima copia di registro e albero (generazione, registro, albero),
+        # condivisa finché il registro non cambia
+        self.merkle_snapshot_cache: Optional[Tuple[int, Dict, Dict]] = None
+        self.registry_ready = threading.Event()  # Prima scansione completata
+        self.last_scan_time = 0  # Ultimo tempo di scansione (solo senza inotify)
+        self.last_temp_clean = 0  # Ultima pulizia di temporanei e chunk scaduti
+        self.scan_interval = (
+            5  # Intervallo di scansione in secondi (solo senza inotify)
+        )
+
+        # Store dei chunk content-defined (opzionale)
+        self.chunker = FastCDC() if chunk_store else None
+        self.chunk_store_dir = os.path.join(self.shared_dir, CHUNK_STORE_DIR)
+        if chunk_store:
+            os.makedirs(self.chunk_store_dir, exist_ok=True)
+
+        # Cache persistente degli hash: nome -> {inode, size, mtime_ns, hash}
+        self.hash_cache_file = hash_cache_file
+        self.hash_cache_path = os.path.join(self.shared_dir, hash_cache_file)
+        self.cache_lock = threading.Lock()  # Protegge la cache tra i thread
+        self.hash_cache: Dict[str, Dict] = self._load_hash_cache()
+        self.hash_cache_dirty = False  # True se la cache va riscritta su disco
+
+        # Metriche del nodo (contatori)
+        self.metrics: Dict[str, int] = defaultdict(int)
+        self.metrics_lock = threading.Lock()
+
+        # Limiti di banda: un token bucket globale e uno per peer in ogni direzione
+        self.rate_lock = threading.Lock()
+        self.rate_buckets: Dict[str, TokenBucket] = {
+            "upload": TokenBucket(),
+            "download": TokenBucket(),
+        }
+        self.peer_rate_limits: Dict[str, int] = {"upload": 0, "download": 0}
+        self.peer_rate_overrides: Dict[Tuple[str, str], int] = {}
+        self.peer_rate_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self.set_rate_limits(
+            upload_limit, download_limit, peer_upload_limit, peer_download_limit
+        )
+
+        # Coda dei trasferimenti ordinata per scadenza (scadenza, sequenza, chiave,
+        # operazione, argomenti); le chiavi in coda o in corso non si ripetono
+        self.max_transfers = max(1, max_transfers)
+        self.transfer_classes = dict(transfer_classes or {})
+        self.transfer_queue: List[Tuple[float, int, Tuple, Callable, Tuple]] = []
+        self.transfer_pending: Set[Tuple] = set()
+        self.transfer_sequence = itertools.count()
+        self.transfer_condition = threading.Condition()
+
+        # Sincronizzazione dei peer: ogni peer ha la sua scadenza e viene servito
+        # da un pool limitato, così un peer lento non ritarda gli altri
+        self.peer_sync_executor = ThreadPoolExecutor(
+            max_workers=max(1, max_peer_syncs), thread_name_prefix="p2p-sync"
+        )
+        self.peer_next_sync: Dict[str, float] = {}  # peer -> time.monotonic()
+        self.peer_syncing: Set[str] = set()  # Peer in coda o in sincronizzazione
+        # Tabella dei peer: ultimo annuncio ricevuto e sincronizzazioni fallite di
+        # fila; i peer silenziosi per PEER_EXPIRY secondi vengono dimenticati, e
+        # dopo ogni fallimento l'attesa prima del tentativo successivo raddoppia
+        self.peer_last_seen: Dict[str, float] = {}  # peer -> time.monotonic()
+        self.peer_failures: Dict[str, int] = {}
+        self.peer_sync_lock = threading.Lock()  # Protegge scadenze e tabella
+        self.last_round = 0.0  # Ultima manutenzione periodica (time.monotonic)
+        self.round_hashes_start = 0  # hashes_computed all'ultima manutenzione
+
+        # Pool di connessioni persistenti verso i peer
+        # Un buffer contiene un blocco intero con la sua intestazione e un margine
+        self.buffer_pool = BufferPool(block_size + FRAME_HEADER.size + 64 * 1024)
+        # Payload massimo dei frame ricevuti dal server, controllato prima di
+        # allocare qualsiasi cosa: le richieste sono piccole, i DATA portano al
+        # più un blocco (o un manifest), gli altri tipi REQUEST_MAX_SIZE
+        self.frame_limits = {
+            FRAME_DATA: block_size + DATA_MAX_SLACK,
+            FRAME_BLOOM: BLOOM_MAX_SIZE,
+        }
+        self.connection_pool = ConnectionPool(
+            self.peer_port, self._inc_metric, buffers=self.buffer_pool
+        )
+
+        # Ultima lista dei file di ogni peer e throughput misurato (byte/s), usati
+        # per scaricare un file da tutti i peer che lo hanno (swarm)
+        self.peer_lists: Dict[str, Dict[str, Dict]] = {}
+        self.peer_cursors: Dict[str, Tuple[int, int]] = {}  # Epoca e generazione
+        self.peer_throughput: Dict[str, float] = {}
+        self.peer_lists_lock = threading.Lock()
+
+        # Watcher inotify: se non disponibile si torna alla scansione periodica
+        self.watch_dirs: Dict[int, str] = {}  # wd -> cartella relativa osservata
+        # Cartelle che non è stato possibile osservare (es. max_user_watches
+        # esaurito): vengono riscandite ogni scan_interval
+        self.unwatched_dirs: Set[str] = set()
+        self.inotify = self._create_inotify()
+
+        # Avvio servizi
+        self._start_services()  # Avvia i servizi di rete
+        self.logger.info(f"🚀 Nodo P2P avviato su {self.local_ip}")
+
+    def _setup_logger(self) -> logging.Logger:
+        """
+        Configura e restituisce un logger per il nodo.
+
+        Returns:
+            logging.Logger: Istanza del logger configurato.
+        """
+        logger = logging.getLogger("P2PFileSync")
+        logger.setLevel(
+            logging.INFO
+        )  # Livello di log, cambiare INFO in DEBUG per più dettagli.
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+        logger.addHandler(ch)
+        return logger
+
+    def _setup_shared_dir(self, path: str) -> str:
+        """
+        Crea la cartella condivisa se non esiste e restituisce il percorso assoluto.
+
+        Args:
+            path (str): Percorso della cartella condivisa.
+
+        Returns:
+            str: Percorso assoluto della cartella condivisa.
+        """
+        os.makedirs(path, exist_ok=True)
+        abs_path = os.path.abspath(path)
+        self.logger.info(f"📁 Cartella condivisa: {abs_path}")
+
+        # Verifica il contenuto della cartella
+        files = os.listdir(abs_path)
+        if not files:
+            self.logger.warning("⚠️ La cartella condivisa è vuota!")
+        else:
+            self.logger.info(f"📂 Contenuto della cartella: {files}")
+
+        return abs_path
+
+    def _get_reliable_local_ip(self) -> str:
+        """
+        Ottiene l'IP locale in modo affidabile per LINUX e WINDOWS.
+
+        Returns:
+            str: Indirizzo IP locale.
+        """
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.connect(
+                    ("10.255.255.255", 1)
+                )  # Indirizzo non instradabile su Internet
+                return s.getsockname()[0]
+        except:
+            try:
+                return socket.gethostbyname(socket.gethostname())
+            except:
+                return "127.0.0.1"
+
+    def _start_services(self) -> None:
+        """Avvia tutti i servizi di rete in thread separati (o nell'event loop)."""
+        if self.engine == "asyncio":
+            services = []
+            self.loop_thread = threading.Thread(
+                target=self._run_event_loop, daemon=True
+            )
+            self.loop_thread.start()  # Server, discovery e sync nell'event loop
+        else:
+            services = [
+                self._listen_for_peers,  # Ascolta i peer
+                self._start_tcp_server,  # Avvia il server TCP
+                self._broadcast_presence,  # Annuncia la propria presenza
+                self._sync_loop,  # Loop di sincronizzazione
+            ]
+        if self.inotify is not None:
+            services.append(self._watch_shared_dir)  # Osserva la cartella condivisa
+        services += [self._transfer_worker] * self.max_transfers  # Trasferimenti
+        for service in services:
+            threading.Thread(
+                target=service, daemon=True
+            ).start()  # Avvia il servizio in un thread
+
+    def _listen_for_peers(self) -> None:
+        """Ascolta i pacchetti multicast per rilevare nuovi peer."""
+        sock = self._create_discovery_socket()
+        self.logger.debug("🎧 In ascolto per nuovi peer...")
+
+        while self.active:
+            try:
+                data, addr = sock.recvfrom(1024)
+                self.logger.debug(f"📩 Ricevuto pacchetto da {addr}: {data.decode()}")
+                if data.decode() == "DISCOVER" and addr[0] != self.local_ip:
+                    self._touch_peer(addr[0])  # Aggiungi il peer o rinnovalo
+            except Exception as e:
+                if self.active:
+                    self.logger.error(f"❌ Errore multicast: {str(e)}")
+
+    def _create_discovery_socket(self) -> socket.socket:
+        """
+        Crea il socket UDP iscritto al gruppo multicast del discovery.
+
+        Returns:
+            socket.socket: Socket pronto a ricevere gli annunci dei peer.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
+        sock.setsockopt(
+            socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
+        )  # Riutilizzo indirizzo
+
+        # Configurazione specifica per OS
+        if sys.platform.startswith("linux"):
+            sock.bind((self.multicast_group, self.multicast_port))  # Linux
+        else:
+            sock.bind(("", self.multicast_port))  # Windows
+
+        # Configurazione gruppo multicast
+        mreq = socket.inet_aton(self.multicast_group) + socket.inet_aton(
+            self.local_ip
+        )  # Indirizzo
+        sock.setsockopt(
+            socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq
+        )  # Aggiungi gruppo
+        return sock
+
+    def _touch_peer(self, peer_ip: str) -> None:
+        """
+        Registra un annuncio di un peer, aggiungendolo se è nuovo.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+        """
+        with self.peer_sync_lock:
+            self.peer_last_seen[peer_ip] = time.monotonic()
+        self._add_peer(peer_ip)
+
+    def _add_peer(self, peer_ip: str) -> None:
+        """
+        Aggiunge un nuovo peer alla lista e avvia la sincronizzazione.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer da aggiungere.
+        """
+        with self.peer_sync_lock:
+            if peer_ip in self.peers:
+                return
+            self.peers.add(peer_ip)  # Aggiungi il peer
+            self.peer_last_seen.setdefault(peer_ip, time.monotonic())
+        self.logger.info(f"🆕 Nuovo peer rilevato: {peer_ip}")
+        self._start_peer_sync(peer_ip)  # Sincronizza i file con il peer
+
+    def _expire_peers(self) -> None:
+        """Dimentica i peer che non si annunciano da più di PEER_EXPIRY secondi."""
+        expiry = time.monotonic() - PEER_EXPIRY
+        with self.peer_sync_lock:
+            expired = [
+                peer
+                for peer in self.peers
+                if self.peer_last_seen.get(peer, 0.0) < expiry
+            ]
+            for peer in expired:
+                self.peers.discard(peer)
+                self.peer_last_seen.pop(peer, None)
+                self.peer_failures.pop(peer, None)
+                self.peer_next_sync.pop(peer, None)
+            known = set(self.peers)
+        with self.rate_lock:
+            # Bucket di banda dei peer scaduti e degli indirizzi che non si sono
+            # mai annunciati (hanno solo aperto connessioni) e sono inattivi
+            stale = [
+                key
+                for key, bucket in self.peer_rate_buckets.items()
+                if key[1] in expired or (key[1] not in known and bucket.last < expiry)
+            ]
+            for key in stale:
+                del self.peer_rate_buckets[key]
+        if not expired:
+            return
+        with self.peer_lists_lock:
+            for peer in expired:
+                self.peer_lists.pop(peer, None)
+                self.peer_cursors.pop(peer, None)
+                self.peer_throughput.pop(peer, None)
+            for key in [key for key in self.synced_files if key[0] in expired]:
+                del self.synced_files[key]  # Se il peer torna, si riconfrontano
+        for peer in expired:
+            self.connection_pool.forget(peer)
+            self.logger.info(f"👋 Peer {peer} non si annuncia più, rimosso")
+        self._inc_metric("peers_expired", len(expired))
+
+    def get_peers(self) -> Dict[str, Dict]:
+        """
+        Restituisce la tabella dei peer conosciuti.
+
+        Returns:
+            Dict[str, Dict]: Per ogni peer, 'last_seen' (secondi dall'ultimo
+            annuncio), 'failures' (sincronizzazioni fallite di fila) e
+            'next_sync' (secondi alla prossima sincronizzazione, 0 se dovuta).
+        """
+        now = time.monotonic()
+        with self.peer_sync_lock:
+            return {
+                peer: {
+                    "last_seen": now - self.peer_last_seen.get(peer, now),
+                    "failures": self.peer_failures.get(peer, 0),
+                    "next_sync": max(0.0, self.peer_next_sync.get(peer, now) - now),
+                }
+                for peer in self.peers
+            }
+
+    def _start_tcp_server(self) -> None:
+        """
+        Avvia il server TCP per gestire le connessioni in entrata.
+
+        Un solo thread attende con selectors le nuove connessioni e le richieste
+        sulle connessioni inattive. Ogni richiesta arrivata viene eseguita da un
+        pool di SERVER_WORKERS thread, che restituisce la connessione al
+        selettore appena non ci sono altre richieste pronte: le connessioni
+        aperte ma inattive non occupano thread. Fino a SERVER_QUEUE_LIMIT
+        richieste attendono un thread libero, le successive ricevono subito un
+        frame BUSY, così un picco di richieste non può creare migliaia di thread.
+        """
+        self.server_executor = ThreadPoolExecutor(
+            max_workers=SERVER_WORKERS, thread_name_prefix="p2p-server"
+        )
+        wakeup, self.server_wakeup = socket.socketpair()
+        wakeup.setblocking(False)
+        self.server_wakeup.setblocking(False)
+        with socket.socket(
+            socket.AF_INET, socket.SOCK_STREAM
+        ) as sock, selectors.DefaultSelector() as selector, wakeup:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(("0.0.0.0", self.peer_port))
+            sock.listen(128)
+            sock.setblocking(False)
+            selector.register(sock, selectors.EVENT_READ)
+            selector.register(wakeup, selectors.EVENT_READ)
+            self.logger.debug(f"🔌 Server TCP in ascolto sulla porta {self.peer_port}")
+
+            while self.active:
+                try:
+                    for key, _ in selector.select(timeout=1.0):
+                        if key.fileobj is sock:
+                            self._accept_connection(sock, selector)
+                        elif key.fileobj is wakeup:
+                            self._resume_connections(wakeup, selector)
+                        else:
+                            # Richiesta su una connessione inattiva
+                            selector.unregister(key.fileobj)
+                            self._admit_request(key.fileobj, key.data[0])
+                    self._close_idle_connections(selector)
+                except Exception as e:
+                    if self.active:
+                        self.logger.error(f"❌ Errore server TCP: {str(e)}")
+
+            for key in list(selector.get_map().values()):
+                if key.data is not None:
+                    key.fileobj.close()  # Connessioni inattive
+        self.server_wakeup.close()
+
+    def _accept_connection(
+        self, sock: socket.socket, selector: selectors.BaseSelector
+    ) -> None:
+        """
+        Accetta una nuova connessione e la affida al selettore fino alla prima
+        richiesta.
+
+        Args:
+            sock (socket.socket): Socket in ascolto.
+            selector (selectors.BaseSelector): Selettore del server.
+        """
+        try:
+            conn, addr = sock.accept()
+        except BlockingIOError:
+            return  # Connessione già accettata o annullata dal peer
+        self.logger.debug(f"🔗 Connessione TCP da {addr}")
+        conn.settimeout(SERVER_IDLE_TIMEOUT)
+        selector.register(conn, selectors.EVENT_READ, (addr, time.monotonic()))
+
+    def _resume_connections(
+        self, wakeup: socket.socket, selector: selectors.BaseSelector
+    ) -> None:
+        """
+        Riprende nel selettore le connessioni restituite dai thread del pool.
+
+        Args:
+            wakeup (socket.socket): Socket di risveglio da svuotare.
+            selector (selectors.BaseSelector): Selettore del server.
+        """
+        try:
+            while wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.server_returns:
+            conn, addr = self.server_returns.popleft()
+            selector.register(conn, selectors.EVENT_READ, (addr, time.monotonic()))
+
+    def _close_idle_connections(self, selector: selectors.BaseSelector) -> None:
+        """
+        Chiude le connessioni inattive da più di SERVER_IDLE_TIMEOUT secondi.
+
+        Args:
+            selector (selectors.BaseSelector): Selettore del server.
+        """
+        expiry = time.monotonic() - SERVER_IDLE_TIMEOUT
+        for key in list(selector.get_map().values()):
+            if key.data is not None and key.data[1] < expiry:
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+
+    def _admit_request(self, conn: socket.socket, addr: tuple) -> None:
+        """
+        Affida una richiesta in arrivo al pool di thread, o la respinge con BUSY
+        se pool e coda sono pieni.
+
+        Args:
+            conn (socket.socket): Socket con una richiesta da leggere.
+            addr (tuple): Indirizzo del peer (IP, porta).
+        """
+        if not self.server_slots.acquire(blocking=False):
+            self._reject_request(conn, addr)  # Pool e coda pieni
+            return
+        try:
+            self.server_executor.submit(self._serve_connection, conn, addr)
+        except RuntimeError:
+            self.server_slots.release()  # Executor già arrestato
+            conn.close()
+
+    def _serve_connection(self, conn: socket.socket, addr: tuple) -> None:
+        """
+        Serve le richieste pronte su una connessione in un thread del pool.
+
+        Ogni richiesta è un frame binario (vedi FrameConnection). Quando non ci
+        sono altre richieste da leggere la connessione torna al selettore del
+        server e il thread si libera; resta aperta per le richieste successive
+        (pool di connessioni del peer) finché il peer non la chiude o resta
+        inattiva per SERVER_IDLE_TIMEOUT.
+
+        Args:
+            conn (socket.socket): Socket della connessione.
+            addr (tuple): Indirizzo del peer (IP, porta).
+        """
+        frames = FrameConnection(
+            conn, addr[0], self.buffer_pool, frame_limits=self.frame_limits
+        )
+        idle = False
+        try:
+            while self.active:
+                frame_type, stream_id, payload = frames.receive()
+                self.logger.debug(
+                    f"📨 Richiesta {frame_type:#x} da {addr} (stream {stream_id})"
+                )
+                self._dispatch_request(frames, addr, frame_type, stream_id, payload)
+                if not frames.has_buffered_data() and not frames.socket_readable():
+                    idle = True  # Nessuna altra richiesta pronta
+                    break
+        except (ConnectionError, socket.timeout):
+            pass  # Connessione chiusa dal peer o bloccata a metà richiesta
+        except FrameTooLargeError as e:
+            # Il payload non viene letto: si risponde con un errore e si chiude
+            self.logger.warning(f"🚫 Frame respinto da {addr[0]}: {str(e)}")
+            try:
+                frames.send_error(e.stream_id, str(e))
+            except OSError:
+                pass
+        except Exception as e:
+            self.logger.debug(f"🔌 Connessione con {addr[0]} chiusa: {str(e)}")
+        finally:
+            self.server_slots.release()
+            if idle and self.active:
+                self.server_returns.append((frames.detach(), addr))
+                try:
+                    self.server_wakeup.send(b"\0")
+                except OSError:
+                    pass  # Selettore già svegliato (buffer pieno) o server chiuso
+            else:
+                frames.close()
+
+    def _reject_request(self, conn: socket.socket, addr: tuple) -> None:
+        """
+        Respinge una richiesta con BUSY sul suo stream, senza eseguirla.
+
+        Viene chiamata dal thread del selettore, che non deve mai attendere un
+        peer: il socket diventa non bloccante, della richiesta si leggono solo i
+        byte già arrivati e l'id dello stream si ricava dall'intestazione, se
+        c'è tutta.
+
+        Args:
+            conn (socket.socket): Socket con una richiesta da leggere.
+            addr (tuple): Indirizzo del peer (IP, porta).
+        """
+        stream_id = 0
+        conn.setblocking(False)
+        try:
+            request = conn.recv(65536)
+            if len(request) >= FRAME_HEADER.size:
+                magic, version, _, stream_id, _ = FRAME_HEADER.unpack_from(request)
+                if magic != FRAME_MAGIC or version != PROTOCOL_VERSION:
+                    stream_id = 0
+        except OSError:
+            pass  # Richiesta illeggibile: BUSY senza stream
+        self._reject_connection(conn, addr, stream_id)
+
+    def _reject_connection(
+        self, conn: socket.socket, addr: tuple, stream_id: int = 0
+    ) -> None:
+        """
+        Respinge una connessione con un frame BUSY che indica quando riprovare.
+
+        Il socket deve essere non bloccante: il frame è piccolo e entra nel
+        buffer di invio, e se non entra la connessione viene chiusa comunque.
+
+        Args:
+            conn (socket.socket): Socket della connessione, non bloccante.
+            addr (tuple): Indirizzo del peer (IP, porta).
+            stream_id (int): Stream della richiesta respinta (0 se nessuna).
+        """
+        self._inc_metric("server_busy")
+        self.logger.warning(f"🚦 Nodo saturo, connessione da {addr[0]} respinta")
+        try:
+            conn.send(self._busy_frame(stream_id))
+            # Scarta la richiesta già arrivata: chiudere un socket con dati non
+            # letti invia un RST, che può far perdere al peer il frame BUSY
+            conn.shutdown(socket.SHUT_WR)
+            while conn.recv(65536):
+                pass
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _busy_frame(stream_id: int) -> bytes:
+        """
+        Costruisce un frame BUSY con il tempo di attesa suggerito.
+
+        Args:
+            stream_id (int): Id dello stream respinto (0 se nessuna richiesta).
+
+        Returns:
+            bytes: Frame completo, con un po' di variazione casuale sul tempo di
+            attesa perché i peer respinti insieme non riprovino tutti insieme.
+        """
+        retry_after = int(BUSY_RETRY_AFTER * 1000 * random.uniform(1, 1.5))
+        payload = UINT64.pack(retry_after)
+        return (
+            FRAME_HEADER.pack(
+                FRAME_MAGIC, PROTOCOL_VERSION, FRAME_BUSY, stream_id, len(payload)
+            )
+            + payload
+        )
+
+    @staticmethod
+    def _error_frame(stream_id: int, message: str) -> bytes:
+        """
+        Costruisce un frame ERROR da scrivere direttamente su un socket o trasporto.
+
+        Args:
+            stream_id (int): Id dello stream della richiesta.
+            message (str): Descrizione dell'errore.
+
+        Returns:
+            bytes: Frame completo.
+        """
+        payload = message.encode()
+        return (
+            FRAME_HEADER.pack(
+                FRAME_MAGIC, PROTOCOL_VERSION, FRAME_ERROR, stream_id, len(payload)
+            )
+            + payload
+        )
+
+    def _dispatch_request(
+        self,
+        conn: BaseFrameConnection,
+        addr: tuple,
+        frame_type: int,
+        stream_id: int,
+        payload: memoryview,
+    ) -> None:
+        """
+        Esegue una singola richiesta ricevuta su una connessione.
+
+        Le richieste non valide ricevono un frame di errore e la connessione resta
+        utilizzabile; i gestori che falliscono a metà di uno scambio rilanciano
+        l'eccezione, così la connessione viene chiusa invece di restare fuori
+        sincrono.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            addr (tuple): Indirizzo del peer (IP, porta).
+            frame_type (int): Tipo della richiesta (FRAME_*).
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Contenuto della richiesta.
+        """
+        if frame_type == FRAME_LIST:
+            self._send_file_list(conn, addr, stream_id)  # Invia la lista dei file
+        elif frame_type == FRAME_PREPARE:
+            self._handle_prepare(conn, stream_id, payload)  # Riceve un file
+        elif frame_type == FRAME_CHUNK:
+            self._handle_chunk(conn, stream_id, payload)  # Invia un blocco
+        elif frame_type == FRAME_BLOCKS:
+            self._handle_blocks(conn, stream_id, payload)  # Invia gli hash dei blocchi
+        elif frame_type == FRAME_DELTA:
+            self._handle_delta(
+                conn, stream_id, payload
+            )  # Invia il delta rispetto alla copia del peer
+        elif frame_type == FRAME_CHUNKS:
+            self._handle_chunk_list(
+                conn, stream_id, payload
+            )  # Invia la lista dei chunk di un file
+        elif frame_type == FRAME_GETCHUNK:
+            self._handle_get_chunk(conn, stream_id, payload)  # Invia un chunk
+        elif frame_type == FRAME_LIST_SINCE:
+            self._send_file_list_since(
+                conn, addr, stream_id, payload
+            )  # Invia i file cambiati dopo una generazione
+        elif frame_type == FRAME_MERKLE:
+            self._handle_merkle(conn, stream_id, payload)  # Invia nodi dell'albero
+        elif frame_type == FRAME_LIST_BUCKETS:
+            self._send_bucket_list(
+                conn, addr, stream_id, payload
+            )  # Invia le voci sotto alcuni nodi
+        elif frame_type == FRAME_BLOOM:
+            self._handle_bloom(
+                conn, addr, stream_id, payload
+            )  # Invia le voci che il peer probabilmente non ha
+        else:
+            conn.send_error(stream_id, f"Richiesta sconosciuta: {frame_type:#x}")
+
+    def _parse_name(self, payload: memoryview) -> str:
+        """
+        Decodifica e verifica il nome di file contenuto in una richiesta.
+
+        Args:
+            payload (memoryview): Payload della richiesta.
+
+        Returns:
+            str: Percorso relativo del file.
+
+        Raises:
+            ValueError: Se il nome non è valido o indica un file di servizio.
+        """
+        filename = str(payload, "utf-8")
+        self._check_peer_path(filename)
+        return filename
+
+    def _parse_numbered_name(self, payload: memoryview) -> Tuple[int, str]:
+        """
+        Decodifica e verifica un intero (UINT64) seguito da un nome di file.
+
+        Args:
+            payload (memoryview): Payload della richiesta.
+
+        Returns:
+            Tuple[int, str]: Intero e percorso relativo del file.
+
+        Raises:
+            ValueError: Se il payload è troppo corto o il nome non è valido o
+            indica un file di servizio.
+        """
+        try:
+            (number,) = UINT64.unpack_from(payload)
+        except struct.error:
+            raise ValueError("Richiesta troncata")
+        return number, self._parse_name(payload[UINT64.size :])
+
+    def _check_peer_path(self, relpath: str) -> None:
+        """
+        Verifica un percorso ricevuto da un peer: deve indicare un file dentro
+        shared_dir (vedi _local_path) che non sia di servizio, perché i peer non
+        devono leggere né sovrascrivere cache, temporanei e store dei chunk.
+
+        Args:
+            relpath (str): Percorso relativo ricevuto.
+
+        Raises:
+            ValueError: Se il percorso non è valido o è di servizio.
+        """
+        if not relpath:
+            raise ValueError("Percorso vuoto")
+        self._local_path(relpath)
+        if self._is_internal_path(relpath):
+            raise ValueError(f"Percorso riservato: {relpath!r}")
+
+    def _send_file_list(
+        self, conn: BaseFrameConnection, addr: tuple, stream_id: int
+    ) -> None:
+        """
+        Invia la lista dei file disponibili al peer, a pagine.
+
+        La lista è una sequenza di frame DATA di al più LIST_PAGE_SIZE byte, ognuno
+        con voci complete (LIST_RECORD seguito dal nome in utf-8), chiusa da un
+        frame DATA vuoto: la lista serializzata non viene mai costruita per
+        intero, qualunque sia il numero di file.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            addr (tuple): Indirizzo del peer (IP, porta).
+            stream_id (int): Id dello stream della richiesta.
+        """
+        try:
+            self._refresh_registry()
+            with self.registry_lock:
+                names = list(self.file_registry)  # Solo i nomi, le voci dopo
+            # Gli hash dei blocchi si chiedono con BLOCKS, solo per i file diversi
+            count = self._send_list_records(
+                conn, stream_id, self._iter_registry_records(names)
+            )
+            self.logger.info(f"📄 Inviata lista file a {addr[0]}: {count} file")
+        except Exception as e:
+            self.logger.error(f"❌ Errore invio file list: {str(e)}")
+            raise
+
+    def _send_file_list_since(
+        self,
+        conn: BaseFrameConnection,
+        addr: tuple,
+        stream_id: int,
+        payload: memoryview,
+    ) -> None:
+        """
+        Invia al peer solo i file cambiati o cancellati dopo una generazione.
+
+        La risposta inizia con un frame LIST_SINCE_REPLY (epoca, generazione
+        corrente e se la lista è completa) seguito dalle pagine di voci come per
+        LIST; le voci cancellate hanno dimensione LIST_DELETED. Se l'epoca non
+        corrisponde o le cancellazioni richieste sono già state dimenticate viene
+        inviata la lista completa.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            addr (tuple): Indirizzo del peer (IP, porta).
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Epoca e generazione già note al peer (LIST_CURSOR).
+        """
+        if len(payload) != LIST_CURSOR.size:
+            conn.send_error(stream_id, "Richiesta LIST_SINCE non valida")
+            return
+        epoch, since = LIST_CURSOR.unpack(payload)
+        self._refresh_registry()
+        with self.registry_lock:
+            generation = self.registry_generation
+            full = (
+                epoch != self.registry_epoch
+                or since < self.tombstone_floor
+                or since > generation
+            )
+            if full:
+                names = list(self.file_registry)  # Solo i nomi, le voci dopo
+            else:
+                names = []
+                for gen in reversed(self.registry_changes):
+                    if gen <= since:
+                        break
+                    names.append(self.registry_changes[gen])
+        conn.send(
+            FRAME_DATA,
+            stream_id,
+            LIST_SINCE_REPLY.pack(self.registry_epoch, generation, full),
+        )
+        count = self._send_list_records(
+            conn, stream_id, self._iter_registry_records(names, deleted=not full)
+        )
+        self.logger.debug(
+            f"📄 Inviata lista {'completa' if full else 'incrementale'} a "
+            f"{addr[0]}: {count} voci (generazione {generation})"
+        )
+
+    def _iter_registry_records(
+        self, names: List[str], deleted: bool = False
+    ) -> Iterator[Tuple[str, int, Optional[str]]]:
+        """
+        Legge le voci del registro una alla volta mentre vengono inviate.
+
+        Non serve registry_lock: le voci non vengono modificate dopo
+        l'inserimento, e leggere una chiave del dict è atomico. Una voce
+        cambiata nel frattempo viene inviata nella versione più recente, e il
+        peer la riceverà di nuovo alla prossima lista incrementale.
+
+        Args:
+            names (List[str]): Nomi dei file da inviare.
+            deleted (bool): Se True i nomi non più nel registro vengono inviati
+                come cancellati (LIST_DELETED), altrimenti vengono saltati.
+
+        Yields:
+            Tuple[str, int, Optional[str]]: Nome, dimensione e hash della voce.
+        """
+        for name in names:
+            entry = self.file_registry.get(name)
+            if entry is not None:
+                yield name, entry["size"], entry["hash"]
+            elif deleted:
+                yield name, LIST_DELETED, None
+
+    def _handle_merkle(
+        self, conn: BaseFrameConnection, stream_id: int, payload: memoryview
+    ) -> None:
+        """
+        Invia nodi dell'albero di Merkle del registro.
+
+        Con payload vuoto la risposta è LIST_CURSOR (epoca e generazione) seguito
+        dal MERKLE_NODE della radice; altrimenti, per ogni prefisso richiesto,
+        i MERKLE_NODE dei suoi 16 figli.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Prefissi dei nodi (vedi _pack_prefixes).
+        """
+        try:
+            prefixes = self._parse_prefixes(payload, MERKLE_DEPTH - 1)
+        except ValueError as e:
+            conn.send_error(stream_id, str(e))
+            return
+        self._refresh_registry()
+        with self.registry_lock:
+            if not prefixes:
+                reply = LIST_CURSOR.pack(
+                    self.registry_epoch, self.registry_generation
+                ) + self._merkle_node(self.merkle_tree, "")
+            else:
+                reply = b"".join(
+                    self._merkle_node(self.merkle_tree, prefix + digit)
+                    for prefix in prefixes
+                    for digit in HEX_DIGITS
+                )
+        conn.send(FRAME_DATA, stream_id, reply)
+
+    def _send_bucket_list(
+        self,
+        conn: BaseFrameConnection,
+        addr: tuple,
+        stream_id: int,
+        payload: memoryview,
+    ) -> None:
+        """
+        Invia le voci dei file sotto alcuni nodi dell'albero di Merkle, a pagine
+        come per LIST.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            addr (tuple): Indirizzo del peer (IP, porta).
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Prefissi dei nodi (vedi _pack_prefixes).
+        """
+        try:
+            prefixes = set(self._parse_prefixes(payload, MERKLE_DEPTH))
+        except ValueError as e:
+            conn.send_error(stream_id, str(e))
+            return
+        self._refresh_registry()
+        with self.registry_lock:
+            names = set()
+            for prefix in prefixes:
+                names.update(self._bucket_names(prefix))
+            entries = [(name, self.file_registry[name]) for name in names]
+        records = [(name, entry["size"], entry["hash"]) for name, entry in entries]
+        count = self._send_list_records(conn, stream_id, records)
+        self.logger.debug(
+            f"📄 Inviate a {addr[0]} {count} voci di {len(prefixes)} rami dell'albero"
+        )
+
+    def _handle_bloom(
+        self,
+        conn: BaseFrameConnection,
+        addr: tuple,
+        stream_id: int,
+        payload: memoryview,
+    ) -> None:
+        """
+        Riconcilia il registro con quello di un peer a partire dal suo filtro di
+        Bloom, senza inviare la lista completa.
+
+        La risposta è un frame con LIST_CURSOR (epoca e generazione) e il filtro
+        di Bloom delle voci locali, seguito dalle pagine (come per LIST) con le
+        voci locali che non sono nel filtro del peer, cioè quelle che il peer
+        certamente non ha.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            addr (tuple): Indirizzo del peer (IP, porta).
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Filtro di Bloom delle voci del peer.
+        """
+        try:
+            peer_bloom = BloomFilter.from_bytes(payload)
+        except ValueError as e:
+            conn.send_error(stream_id, str(e))
+            return
+        self._refresh_registry()
+        with self.registry_lock:
+            cursor = LIST_CURSOR.pack(self.registry_epoch, self.registry_generation)
+            local_files = dict(self.file_registry)
+        bloom = BloomFilter(len(local_files))
+        missing = []
+        for name, entry in local_files.items():
+            digest = entry["leaf"][1]
+            bloom.add(digest)
+            if digest not in peer_bloom:
+                missing.append((name, entry["size"], entry["hash"]))
+        conn.send(FRAME_DATA, stream_id, cursor + bloom.to_bytes())
+        count = self._send_list_records(conn, stream_id, missing)
+        self.logger.debug(
+            f"📄 Riconciliazione con {addr[0]}: {count} voci su {len(local_files)}"
+        )
+
+    @staticmethod
+    def _pack_prefixes(prefixes: List[str]) -> bytes:
+        """
+        Codifica dei prefissi dell'albero di Merkle, ognuno preceduto dalla sua
+        lunghezza in un byte (la radice è il prefisso vuoto).
+
+        Args:
+            prefixes (List[str]): Prefissi esadecimali.
+
+        Returns:
+            bytes: Payload della richiesta.
+        """
+        return b"".join(bytes([len(prefix)]) + prefix.encode() for prefix in prefixes)
+
+    @staticmethod
+    def _parse_prefixes(payload: memoryview, max_length: int) -> List[str]:
+        """
+        Decodifica i prefissi codificati con _pack_prefixes.
+
+        Args:
+            payload (memoryview): Payload della richiesta.
+            max_length (int): Lunghezza massima accettata per un prefisso.
+
+        Returns:
+            List[str]: Prefissi esadecimali.
+
+        Raises:
+            ValueError: Se un prefisso è troncato, troppo lungo o non esadecimale.
+        """
+        prefixes = []
+        pos = 0
+        while pos < len(payload):
+            length = payload[pos]
+            prefix = str(payload[pos + 1 : pos + 1 + length], "ascii", "replace")
+            pos += 1 + length
+            if pos > len(payload) or length > max_length or prefix.strip(HEX_DIGITS):
+                raise ValueError("Prefisso dell'albero non valido")
+            prefixes.append(prefix)
+        return prefixes
+
+    @staticmethod
+    def _merkle_node(tree: Dict[str, List[int]], prefix: str) -> bytes:
+        """
+        Codifica un nodo dell'albero di Merkle.
+
+        Args:
+            tree (Dict[str, List[int]]): Nodi non vuoti dell'albero.
+            prefix (str): Prefisso del nodo.
+
+        Returns:
+            bytes: MERKLE_NODE con numero di file e digest (zero se vuoto).
+        """
+        count, total = tree.get(prefix, (0, 0))
+        return MERKLE_NODE.pack(count, total.to_bytes(32, "big"))
+
+    @staticmethod
+    def _merkle_leaf(filename: str, entry: Dict) -> Tuple[str, int]:
+        """
+        Calcola foglia e digest di una voce del registro.
+
+        Args:
+            filename (str): Percorso relativo del file.
+            entry (Dict): Voce del file.
+
+        Returns:
+            Tuple[str, int]: Prefisso della foglia e digest di nome, hash e
+            dimensione come intero.
+        """
+        bucket = hashlib.sha256(filename.encode()).hexdigest()[:MERKLE_DEPTH]
+        digest = hashlib.sha256(
+            f"{filename}\0{entry['hash']}\0{entry['size']}".encode()
+        ).digest()
+        return bucket, int.from_bytes(digest, "big")
+
+    def _bucket_names(self, prefix: str) -> Iterator[str]:
+        """
+        Restituisce i nomi dei file sotto un nodo dell'albero di Merkle,
+        scendendo solo nei nodi non vuoti (con registry_lock acquisito).
+
+        Args:
+            prefix (str): Prefisso del nodo.
+
+        Yields:
+            str: Percorso relativo di ogni file sotto il nodo.
+        """
+        if prefix not in self.merkle_tree:
+            return
+        if len(prefix) == MERKLE_DEPTH:
+            yield from self.merkle_buckets.get(prefix, ())
+            return
+        for digit in HEX_DIGITS:
+            yield from self._bucket_names(prefix + digit)
+
+    @staticmethod
+    def _merkle_update(
+        tree: Dict[str, List[int]], leaf: Tuple[str, int], sign: int
+    ) -> None:
+        """
+        Aggiunge (sign=1) o toglie (sign=-1) una voce dai nodi di un albero lungo
+        il percorso dalla radice alla sua foglia.
+
+        Args:
+            tree (Dict[str, List[int]]): Nodi non vuoti dell'albero.
+            leaf (Tuple[str, int]): Foglia e digest della voce (_merkle_leaf).
+            sign (int): 1 per aggiungere, -1 per togliere.
+        """
+        bucket, digest = leaf
+        for depth in range(MERKLE_DEPTH + 1):
+            node = tree.setdefault(bucket[:depth], [0, 0])
+            node[0] += sign
+            node[1] = (node[1] + sign * digest) % (1 << 256)
+            if not node[0]:
+                del tree[bucket[:depth]]
+
+    @staticmethod
+    def _send_list_records(
+        conn: BaseFrameConnection,
+        stream_id: int,
+        records: Iterable[Tuple[str, int, Optional[str]]],
+    ) -> int:
+        """
+        Invia delle voci della lista dei file a pagine, chiuse da un frame vuoto.
+
+        Ogni pagina è un frame DATA di al più LIST_PAGE_SIZE byte con voci
+        complete (LIST_RECORD seguito dal nome in utf-8).
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream della richiesta.
+            records (Iterable[Tuple[str, int, Optional[str]]]): Nome, dimensione e
+                hash di ogni voce (None per le voci cancellate).
+
+        Returns:
+            int: Numero di voci inviate.
+        """
+        count = 0
+        page = bytearray()
+        for name, size, file_hash in records:
+            encoded = name.encode()
+            record = LIST_RECORD.pack(
+                len(encoded), size, bytes.fromhex(file_hash) if file_hash else b""
+            )
+            if len(page) + len(record) + len(encoded) > LIST_PAGE_SIZE:
+                conn.send(FRAME_DATA, stream_id, page)
+                page.clear()
+            page += record
+            page += encoded
+            count += 1
+        if page:
+            conn.send(FRAME_DATA, stream_id, page)
+        conn.send(FRAME_DATA, stream_id)  # Fine della lista
+        return count
+
+    @staticmethod
+    def _send_json_pages(conn: BaseFrameConnection, stream_id: int, value) -> None:
+        """
+        Invia un valore in JSON a pagine, chiuse da un frame vuoto, così anche i
+        manifest dei file più grandi restano nel limite dei frame DATA.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream dello scambio.
+            value: Valore da inviare.
+        """
+        encoded = json.dumps(value).encode()
+        for start in range(0, len(encoded), LIST_PAGE_SIZE):
+            conn.send(FRAME_DATA, stream_id, encoded[start : start + LIST_PAGE_SIZE])
+        conn.send(FRAME_DATA, stream_id)  # Fine del valore
+
+    @staticmethod
+    def _receive_json_pages(conn: BaseFrameConnection, stream_id: int, max_size: int):
+        """
+        Riceve un valore inviato con _send_json_pages.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream dello scambio.
+            max_size (int): Byte massimi accettati in tutto.
+
+        Returns:
+            Il valore ricevuto.
+
+        Raises:
+            ProtocolError: Se il valore supera max_size byte.
+        """
+        data = bytearray()
+        while True:
+            page = conn.receive_data(stream_id)
+            if not page:
+                return json.loads(data)
+            data += page
+            if len(data) > max_size:
+                raise ProtocolError(f"Valore JSON oltre {max_size} bytes")
+
+    def _get_local_file_list(self) -> Dict[str, Dict]:
+        """
+        Restituisce la lista dei file locali con hash e dimensione.
+
+        Con inotify il registro è tenuto aggiornato dal watcher e non serve
+        riscandire la cartella; senza inotify viene riscandita ogni scan_interval.
+
+        Returns:
+            Dict[str, Dict]: Copia del registro dei file locali.
+        """
+        self._refresh_registry()
+        with self.registry_lock:
+            return dict(self.file_registry)
+
+    def _refresh_registry(self) -> None:
+        """Assicura che il registro sia aggiornato prima di leggerlo."""
+        if self.inotify is not None:
+            self.registry_ready.wait()  # Attende la scansione iniziale del watcher
+        else:
+            current_time = time.time()
+            if current_time - self.last_scan_time >= self.scan_interval:
+                self.last_scan_time = current_time
+                self._scan_shared_dir()
+
+    def _scan_shared_dir(self) -> None:
+        """Scansiona ricorsivamente la cartella condivisa e ricostruisce il registro."""
+        file_list = {}
+        try:
+            self.logger.debug(f"🔍 Scansione della cartella: {self.shared_dir}")
+            for relpath, entry in self._walk_shared_dir():
+                st = entry.stat()  # Stat già in cache nel DirEntry dopo is_file()
+                file_list[relpath] = self._get_file_entry(
+                    relpath, entry.path, st
+                )  # Hash (dalla cache se il file non è cambiato) e dimensione
+            self.logger.info(f"📄 Lista file locali: {len(file_list)} file")
+        except Exception as e:
+            self.logger.error(f"❌ Errore lettura cartella condivisa: {str(e)}")
+        else:
+            self._evict_hash_cache(file_list)  # Rimuove i file cancellati
+        self._save_hash_cache()
+        with self.registry_lock:  # aggiorna il registro.
+            for relpath in [p for p in self.file_registry if p not in file_list]:
+                self._drop_registry_entry(relpath)
+            for relpath, entry in file_list.items():
+                self._put_registry_entry(relpath, entry)
+
+    def _walk_shared_dir(self, rel_dir: str = "") -> Iterator[Tuple[str, os.DirEntry]]:
+        """
+        Percorre ricorsivamente una cartella con os.scandir, senza ricorsione Python.
+
+        Ogni DirEntry riusa il tipo letto da scandir e la propria stat in cache, così
+        per ogni file serve al massimo una stat. Le cartelle visitate vengono
+        aggiunte al watcher inotify, se attivo.
+
+        Args:
+            rel_dir (str): Cartella di partenza, relativa a shared_dir. Default: radice.
+
+        Yields:
+            Tuple[str, os.DirEntry]: Percorso relativo (separato da '/') e DirEntry
+            di ogni file regolare da sincronizzare.
+        """
+        pending = [rel_dir]
+        while pending:
+            current = pending.pop()
+            self._add_dir_watch(current)  # Prima del listing: nessun evento perso
+            try:
+                with os.scandir(self._local_path(current)) as it:
+                    for entry in it:
+                        if self._is_internal_file(entry.name):
+                            continue
+                        relpath = f"{current}/{entry.name}" if current else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(relpath)
+                        elif entry.is_file():
+                            yield relpath, entry
+            except (FileNotFoundError, NotADirectoryError):
+                continue  # Cartella rimossa durante la scansione
+
+    def _local_path(self, relpath: str) -> str:
+        """
+        Converte un percorso relativo ('/' come separatore) in un percorso locale.
+
+        Args:
+            relpath (str): Percorso relativo a shared_dir, anche ricevuto da un peer.
+
+        Returns:
+            str: Percorso assoluto dentro shared_dir.
+
+        Raises:
+            ValueError: Se il percorso è assoluto o esce da shared_dir.
+        """
+        if not relpath:
+            return self.shared_dir
+        parts = relpath.split("/")
+        for part in parts:
+            if (
+                part in ("", ".", "..")
+                or "\0" in part
+                or os.sep in part
+                or (os.altsep and os.altsep in part)
+                or (sys.platform.startswith("win") and ":" in part)
+            ):
+                raise ValueError(f"Percorso non valido: {relpath!r}")
+        return os.path.join(self.shared_dir, *parts)
+
+    def _temp_path(self, relpath: str) -> str:
+        """
+        Restituisce il percorso del file temporaneo usato per ricevere un file.
+
+        Il file temporaneo sta nella stessa cartella del file finale, così il
+        rename finale resta atomico.
+
+        Args:
+            relpath (str): Percorso relativo del file.
+
+        Returns:
+            str: Percorso locale del file '.tmp.<nome>'.
+        """
+        final_path = self._local_path(relpath)
+        directory, name = os.path.split(final_path)
+        return os.path.join(directory, f".tmp.{name}")
+
+    def _resume_path(self, relpath: str) -> str:
+        """
+        Restituisce il percorso della mappa dei blocchi già ricevuti nel file
+        temporaneo di un download.
+
+        Args:
+            relpath (str): Percorso relativo del file.
+
+        Returns:
+            str: Percorso locale del file '.part.<nome>'.
+        """
+        final_path = self._local_path(relpath)
+        directory, name = os.path.split(final_path)
+        return os.path.join(directory, f"{RESUME_PREFIX}{name}")
+
+    def _load_resume_state(self, filename: str, manifest: Dict) -> Set[int]:
+        """
+        Legge i blocchi già scritti nel file temporaneo da un download interrotto.
+
+        La mappa vale solo per la stessa versione del file (hash, dimensione e
+        block_size); i blocchi indicati vanno comunque verificati rileggendoli.
+
+        Args:
+            filename (str): Percorso relativo del file.
+            manifest (Dict): Manifest del peer con 'hash', 'size' e 'blocks'.
+
+        Returns:
+            Set[int]: Numeri dei blocchi già ricevuti (vuoto se non si può riprendere).
+        """
+        if not os.path.exists(self._temp_path(filename)):
+            return set()
+        try:
+            with open(self._resume_path(filename), "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if (
+                state["hash"] != manifest["hash"]
+                or state["size"] != manifest["size"]
+                or state["block_size"] != self.block_size
+            ):
+                return set()
+            bitmap = bytes.fromhex(state["blocks"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return set()  # Nessuna mappa, o mappa illeggibile
+        return {
+            block_num
+            for block_num in range(min(len(manifest["blocks"]), len(bitmap) * 8))
+            if bitmap[block_num >> 3] & 1 << (block_num & 7)
+        }
+
+    def _save_resume_state(self, filename: str, manifest: Dict, done: Set[int]) -> None:
+        """
+        Salva la mappa dei blocchi già scritti nel file temporaneo.
+
+        Args:
+            filename (str): Percorso relativo del file.
+            manifest (Dict): Manifest del peer con 'hash', 'size' e 'blocks'.
+            done (Set[int]): Numeri dei blocchi scritti.
+        """
+        bitmap = bytearray((len(manifest["blocks"]) + 7) // 8)
+        for block_num in done:
+            bitmap[block_num >> 3] |= 1 << (block_num & 7)
+        state = {
+            "hash": manifest["hash"],
+            "size": manifest["size"],
+            "block_size": self.block_size,
+            "blocks": bitmap.hex(),
+        }
+        try:
+            with open(self._resume_path(filename), "w", encoding="utf-8") as f:
+                json.dump(state, f)
+        except OSError as e:
+            self.logger.warning(f"⚠️ Mappa dei blocchi di {filename} non salvata: {e}")
+
+    def _discard_resume_state(self, filename: str) -> None:
+        """
+        Rimuove la mappa dei blocchi di un download concluso o non riprendibile.
+
+        Args:
+            filename (str): Percorso relativo del file.
+        """
+        try:
+            os.remove(self._resume_path(filename))
+        except FileNotFoundError:
+            pass
+
+    def _clean_temp_files(self) -> None:
+        """
+        Rimuove i file temporanei e le mappe dei blocchi non modificati da oltre
+        TEMP_FILE_TTL, cioè i download abbandonati che nessuno riprenderà.
+        """
+        expiry = time.time() - TEMP_FILE_TTL
+        removed = 0
+        for root, dirs, names in os.walk(self.shared_dir):
+            if root == self.shared_dir and CHUNK_STORE_DIR in dirs:
+                dirs.remove(CHUNK_STORE_DIR)
+            for name in names:
+                if not name.startswith((".tmp.", RESUME_PREFIX)):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_mtime < expiry:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        if removed:
+            self.logger.info(f"🧹 Rimossi {removed} file temporanei abbandonati")
+
+    def _create_inotify(self) -> Optional[Inotify]:
+        """
+        Prepara il watcher inotify sulla cartella condivisa.
+
+        I watch sulle cartelle vengono registrati durante la scansione iniziale,
+        prima di leggerne il contenuto, così nessuna modifica va persa.
+
+        Returns:
+            Optional[Inotify]: Istanza inotify, o None se non disponibile.
+        """
+        try:
+            return Inotify()
+        except (OSError, AttributeError) as e:
+            self.logger.info(
+                f"ℹ️ inotify non disponibile, uso la scansione periodica: {e}"
+            )
+            return None
+
+    def _add_dir_watch(self, rel_dir: str) -> None:
+        """
+        Aggiunge una cartella al watcher inotify, se attivo.
+
+        Args:
+            rel_dir (str): Cartella relativa a shared_dir.
+        """
+        inotify = self.inotify
+        if inotify is None:
+            return
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_ATTRIB
+        mask |= IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+        try:
+            wd = inotify.add_watch(self._local_path(rel_dir), mask | IN_ONLYDIR)
+        except OSError as e:
+            if not rel_dir:
+                raise  # Senza la radice il watcher non ha senso
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return  # Cartella già rimossa: ci pensa l'evento nella cartella padre
+            if rel_dir not in self.unwatched_dirs:
+                self.logger.warning(
+                    f"⚠️ Impossibile osservare {rel_dir}, la riscandisco "
+                    f"ogni {self.scan_interval}s: {e}"
+                )
+                self.unwatched_dirs.add(rel_dir)
+            return
+        self.unwatched_dirs.discard(rel_dir)
+        self.watch_dirs[wd] = rel_dir  # Una cartella spostata mantiene lo stesso wd
+
+    def _watch_shared_dir(self) -> None:
+        """Aggiorna il registro dei file in base agli eventi inotify."""
+        try:
+            self._scan_shared_dir()  # Scansione iniziale, registra anche i watch
+            self.registry_ready.set()
+            self.logger.debug(
+                f"👀 Watcher inotify attivo su {len(self.watch_dirs)} cartelle"
+            )
+
+            while self.active:
+                self._rescan_unwatched_dirs()
+                events = list(self.inotify.read_events(timeout=1.0))
+                if not events:
+                    self._save_hash_cache()  # Salva la cache nei momenti di quiete
+                    continue
+                for wd, mask, _, name in events:
+                    self._handle_inotify_event(wd, mask, name)
+        except Exception as e:
+            if self.active:
+                self.logger.error(
+                    f"❌ Errore watcher, torno alla scansione periodica: {e}"
+                )
+        finally:
+            inotify, self.inotify = self.inotify, None  # Attiva la scansione periodica
+            self.registry_ready.set()
+            inotify.close()
+
+    def _rescan_unwatched_dirs(self) -> None:
+        """
+        Riscandisce ogni scan_interval le cartelle senza watch inotify, riprovando
+        anche a osservarle, così le loro modifiche non vanno perse.
+        """
+        current_time = time.time()
+        if (
+            not self.unwatched_dirs
+            or current_time - self.last_scan_time < self.scan_interval
+        ):
+            return
+        self.last_scan_time = current_time
+        dirs = sorted(self.unwatched_dirs)
+        for rel_dir in dirs:
+            if any(rel_dir.startswith(f"{parent}/") for parent in dirs):
+                continue  # Già coperta dalla scansione di una cartella padre
+            seen = set()
+            for relpath, _ in self._walk_shared_dir(rel_dir):
+                self._update_registry_entry(relpath)
+                seen.add(relpath)
+            prefix = f"{rel_dir}/"
+            with self.registry_lock:
+                for relpath in [p for p in self.file_registry if p.startswith(prefix)]:
+                    if relpath not in seen:
+                        self._drop_registry_entry(relpath)
+            if not os.path.isdir(self._local_path(rel_dir)):
+                self.unwatched_dirs.discard(rel_dir)  # Cartella rimossa
+
+    def _handle_inotify_event(self, wd: int, mask: int, name: str) -> None:
+        """
+        Applica al registro un singolo evento inotify.
+
+        Args:
+            wd (int): Descrittore del watch che ha generato l'evento.
+            mask (int): Maschera IN_* dell'evento.
+            name (str): Nome del file dentro la cartella osservata.
+        """
+        if mask & IN_Q_OVERFLOW:
+            self.logger.warning("⚠️ Coda inotify piena, riscansiono la cartella")
+            self._scan_shared_dir()
+            return
+
+        rel_dir = self.watch_dirs.get(wd)
+        if mask & IN_IGNORED:
+            self.watch_dirs.pop(
+                wd, None
+            )  # Cartella rimossa, il kernel ha tolto il watch
+        if rel_dir is None:
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+            if not rel_dir:
+                raise OSError("cartella condivisa rimossa o spostata")
+            return  # Per le sottocartelle basta l'evento nella cartella padre
+        if not name or self._is_internal_file(name):
+            return
+
+        relpath = f"{rel_dir}/{name}" if rel_dir else name
+        self.logger.debug(f"👀 Evento inotify {mask:#x} su {relpath}")
+        if not mask & IN_ISDIR:
+            if not mask & IN_CREATE:  # Per i file si attende la chiusura in scrittura
+                self._update_registry_entry(relpath)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self._remove_registry_tree(relpath)
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            for file_relpath, _ in self._walk_shared_dir(relpath):
+                self._update_registry_entry(file_relpath)
+
+    def _remove_registry_tree(self, rel_dir: str) -> None:
+        """
+        Rimuove dal registro e dalla cache tutti i file sotto una cartella.
+
+        Args:
+            rel_dir (str): Cartella relativa rimossa o spostata fuori.
+        """
+        prefix = f"{rel_dir}/"
+        with self.registry_lock:
+            for relpath in [p for p in self.file_registry if p.startswith(prefix)]:
+                self._drop_registry_entry(relpath)
+        with self.cache_lock:
+            stale = [p for p in self.hash_cache if p.startswith(prefix)]
+            for relpath in stale:
+                del self.hash_cache[relpath]
+            if stale:
+                self.hash_cache_dirty = True
+
+    def _update_registry_entry(self, filename: str) -> None:
+        """
+        Aggiorna nel registro la voce di un singolo file.
+
+        Usato dal watcher inotify e dopo ogni file ricevuto, così il registro non
+        resta indietro fino alla prossima scansione. Se il file non esiste più la
+        voce viene rimossa dal registro e dalla cache degli hash.
+
+        Args:
+            filename (str): Percorso relativo del file.
+        """
+        filepath = self._local_path(filename)
+        try:
+            st = os.stat(filepath)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            with self.registry_lock:
+                self._drop_registry_entry(filename)
+            with self.cache_lock:
+                if self.hash_cache.pop(filename, None) is not None:
+                    self.hash_cache_dirty = True
+            return
+
+        entry = self._get_file_entry(filename, filepath, st)
+        with self.registry_lock:
+            self._put_registry_entry(filename, entry)
+
+    def _put_registry_entry(self, filename: str, entry: Dict) -> None:
+        """
+        Inserisce o aggiorna una voce del registro (con registry_lock acquisito).
+
+        La voce riceve una nuova generazione solo se hash o dimensione sono
+        cambiati, altrimenti conserva quella precedente.
+
+        Args:
+            filename (str): Percorso relativo del file.
+            entry (Dict): Nuova voce del file.
+        """
+        previous = self.file_registry.get(filename)
+        if (
+            previous is not None
+            and previous["hash"] == entry["hash"]
+            and previous["size"] == entry["size"]
+        ):
+            entry["gen"] = previous["gen"]
+            entry["leaf"] = previous["leaf"]
+        else:
+            self.registry_generation += 1
+            entry["gen"] = self.registry_generation
+            entry["leaf"] = self._merkle_leaf(filename, entry)
+            deleted_gen = self.registry_tombstones.pop(filename, None)
+            if deleted_gen is not None:
+                del self.registry_changes[deleted_gen]
+            if previous is not None:
+                del self.registry_changes[previous["gen"]]
+                self._merkle_update(self.merkle_tree, previous["leaf"], -1)
+            self.registry_changes[entry["gen"]] = filename
+            self._merkle_update(self.merkle_tree, entry["leaf"], 1)
+            if previous is None:
+                self.merkle_buckets.setdefault(entry["leaf"][0], set()).add(filename)
+        self.file_registry[filename] = entry
+
+    def _drop_registry_entry(self, filename: str) -> None:
+        """
+        Rimuove una voce dal registro (con registry_lock acquisito) e ne ricorda
+        la cancellazione per le liste incrementali.
+
+        Args:
+            filename (str): Percorso relativo del file.
+        """
+        previous = self.file_registry.pop(filename, None)
+        if previous is None:
+            return
+        self._merkle_update(self.merkle_tree, previous["leaf"], -1)
+        bucket = self.merkle_buckets[previous["leaf"][0]]
+        bucket.discard(filename)
+        if not bucket:
+            del self.merkle_buckets[previous["leaf"][0]]
+        del self.registry_changes[previous["gen"]]
+        self.registry_generation += 1
+        self.registry_tombstones[filename] = self.registry_generation
+        self.registry_changes[self.registry_generation] = filename
+        if len(self.registry_tombstones) > REGISTRY_TOMBSTONES:
+            # Le cancellazioni sono in ordine di generazione: si dimentica la più
+            # vecchia, e i peer rimasti più indietro riceveranno la lista completa
+            oldest = next(iter(self.registry_tombstones))
+            self.tombstone_floor = self.registry_tombstones.pop(oldest)
+            del self.registry_changes[self.tombstone_floor]
+
+    def _is_internal_path(self, relpath: str) -> bool:
+        """
+        Indica se un percorso relativo contiene un file o una cartella di servizio.
+
+        Args:
+            relpath (str): Percorso relativo ('/' come separatore).
+
+        Returns:
+            bool: True se una delle parti del percorso è di servizio.
+        """
+        return any(self._is_internal_file(part) for part in relpath.split("/"))
+
+    def _get_registry_entry(self, filename: str) -> Optional[Dict]:
+        """
+        Restituisce la voce di registro di un file senza copiare l'intero registro.
+
+        Args:
+            filename (str): Percorso relativo del file.
+
+        Returns:
+            Optional[Dict]: Voce del file, o None se non è presente.
+        """
+        self._refresh_registry()
+        with self.registry_lock:
+            return self.file_registry.get(filename)
+
+    def _is_internal_file(self, filename: str) -> bool:
+        """
+        Indica se un file è di servizio e non va sincronizzato.
+
+        Args:
+            filename (str): Nome del file (senza cartella).
+
+        Returns:
+            bool: True per i file temporanei e le loro mappe dei blocchi, la cache
+            degli hash e lo store dei chunk.
+        """
+        return (
+            filename.startswith(".tmp.")
+            or filename.startswith(RESUME_PREFIX)
+            or filename.startswith(self.hash_cache_file)
+            or filename == CHUNK_STORE_DIR
+        )
+
+    def _load_hash_cache(self) -> Dict[str, Dict]:
+        """
+        Carica da disco la cache degli hash salvata nelle esecuzioni precedenti.
+
+        Returns:
+            Dict[str, Dict]: Voci della cache (vuota se il file manca o è corrotto).
+        """
+        try:
+            with open(self.hash_cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if (
+                cache.get("version") != HASH_CACHE_VERSION
+                or cache.get("block_size") != self.block_size
+            ):
+                self.logger.info("🗃️ Cache hash di un formato diverso, verrà ricreata")
+                return {}
+            entries = cache.get("entries", {})
+            self.logger.info(f"🗃️ Cache hash caricata: {len(entries)} voci")
+            return entries
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.warning(f"⚠️ Cache hash illeggibile, verrà ricreata: {str(e)}")
+            return {}
+
+    def _save_hash_cache(self) -> None:
+        """Salva la cache degli hash su disco, solo se è cambiata."""
+        with self.cache_lock:
+            if not self.hash_cache_dirty:
+                return
+            snapshot = {
+                "version": HASH_CACHE_VERSION,
+                "block_size": self.block_size,
+                "entries": dict(self.hash_cache),
+            }
+            self.hash_cache_dirty = False
+        temp_path = f"{self.hash_cache_path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(temp_path, self.hash_cache_path)  # Scrittura atomica
+        except Exception as e:
+            self.logger.error(f"❌ Errore salvataggio cache hash: {str(e)}")
+            with self.cache_lock:
+                self.hash_cache_dirty = True  # Riprova al prossimo salvataggio
+
+    def _chunk_path(self, chunk_hash: str) -> str:
+        """
+        Restituisce il percorso di un chunk nello store.
+
+        Args:
+            chunk_hash (str): Hash SHA256 del chunk.
+
+        Returns:
+            str: Percorso del chunk (sottocartella con i primi due caratteri dell'hash).
+
+        Raises:
+            ValueError: Se l'hash non è un SHA256 esadecimale.
+        """
+        if len(chunk_hash) != 64 or chunk_hash.strip("0123456789abcdef"):
+            raise ValueError(f"Hash di chunk non valido: {chunk_hash!r}")
+        return os.path.join(self.chunk_store_dir, chunk_hash[:2], chunk_hash)
+
+    def _store_chunk(self, chunk: bytes) -> str:
+        """
+        Salva un chunk nello store, se non è già presente.
+
+        Args:
+            chunk (bytes): Dati del chunk.
+
+        Returns:
+            str: Hash SHA256 del chunk.
+        """
+        chunk_hash = hashlib.sha256(chunk).hexdigest()
+        path = self._chunk_path(chunk_hash)
+        try:
+            os.utime(path)  # Già presente: aggiorna solo la data per la pulizia
+            return chunk_hash
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp.{threading.get_ident()}"
+        with open(temp_path, "wb") as f:
+            f.write(chunk)
+        os.replace(temp_path, path)
+        return chunk_hash
+
+    def _load_chunk(self, chunk_hash: str) -> Optional[bytes]:
+        """
+        Legge un chunk dallo store.
+
+        Args:
+            chunk_hash (str): Hash SHA256 del chunk.
+
+        Returns:
+            Optional[bytes]: Dati del chunk, o None se non è nello store.
+        """
+        if self.chunker is None:
+            return None
+        try:
+            with open(self._chunk_path(chunk_hash), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _collect_chunk_garbage(self, file_list: Dict[str, Dict]) -> None:
+        """
+        Rimuove dallo store i chunk non più usati da nessun file da oltre CHUNK_STORE_TTL.
+
+        I chunk delle versioni precedenti restano disponibili per la deduplica
+        finché non scadono. Viene eseguita dalla manutenzione periodica del loop
+        di sincronizzazione, ogni TEMP_CLEAN_INTERVAL secondi.
+
+        Args:
+            file_list (Dict[str, Dict]): Copia del registro dei file locali.
+        """
+        referenced = {
+            c[0] for entry in file_list.values() for c in entry.get("chunks", ())
+        }
+        expiry = time.time() - CHUNK_STORE_TTL
+        removed = 0
+        for root, _, names in os.walk(self.chunk_store_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    if name not in referenced and os.stat(path).st_mtime < expiry:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        if removed:
+            self.logger.info(f"🧹 Rimossi {removed} chunk inutilizzati dallo store")
+
+    def _get_file_entry(self, filename: str, filepath: str, st: os.stat_result) -> Dict:
+        """
+        Restituisce la voce di registro di un file, ricalcolando gli hash solo se è cambiato.
+
+        La voce in cache è valida finché inode, dimensione e mtime_ns coincidono
+        con quelli attuali del file.
+
+        Args:
+            filename (str): Percorso relativo del file (chiave della cache).
+            filepath (str): Percorso locale del file.
+            st (os.stat_result): Stat corrente del file.
+
+        Returns:
+            Dict: Voce con 'hash', 'size' e, per i file di più blocchi, 'blocks';
+            con lo store dei chunk attivo anche 'chunks' ([hash, lunghezza]).
+        """
+        with self.cache_lock:
+            cached = self.hash_cache.get(filename)
+        if (
+            cached
+            and cached["inode"] == st.st_ino
+            and cached["size"] == st.st_size
+            and cached["mtime_ns"] == st.st_mtime_ns
+            and (self.chunker is None or "chunks" in cached)
+        ):
+            file_hash, block_hashes = cached["hash"], cached.get("blocks")
+            chunks = cached.get("chunks")
+        else:
+            file_hash, block_hashes, chunks = self._calculate_hashes(filepath)
+            self._store_cached_hashes(filename, st, file_hash, block_hashes, chunks)
+        entry = {"hash": file_hash, "size": st.st_size}
+        if len(block_hashes or []) > 1:
+            entry["blocks"] = block_hashes
+        if self.chunker is not None and chunks is not None:
+            entry["chunks"] = chunks
+        return entry
+
+    def _store_cached_hashes(
+        self,
+        filename: str,
+        st: os.stat_result,
+        file_hash: str,
+        block_hashes: List[str],
+        chunks: Optional[List[List]] = None,
+    ) -> None:
+        """
+        Salva nella cache gli hash di un file.
+
+        Args:
+            filename (str): Percorso relativo del file.
+            st (os.stat_result): Stat del file a cui si riferiscono gli hash.
+            file_hash (str): Hash SHA256 dell'intero file.
+            block_hashes (List[str]): Hash SHA256 dei singoli blocchi.
+            chunks (Optional[List[List]]): Chunk content-defined ([hash, lunghezza]),
+                se noti.
+        """
+        cached = {
+            "inode": st.st_ino,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "hash": file_hash,
+        }
+        if len(block_hashes) > 1:  # Per un solo blocco coincide con l'hash del file
+            cached["blocks"] = block_hashes
+        if chunks is not None:
+            cached["chunks"] = chunks
+        with self.cache_lock:
+            self.hash_cache[filename] = cached
+            self.hash_cache_dirty = True
+
+    def _block_hashes(self, entry: Dict) -> List[str]:
+        """
+        Restituisce gli hash dei blocchi di una voce di registro.
+
+        Args:
+            entry (Dict): Voce di registro o manifest di un file.
+
+        Returns:
+            List[str]: Un hash per ogni blocco di block_size byte.
+        """
+        if "blocks" in entry:
+            return entry["blocks"]
+        return [entry["hash"]] if entry["size"] > 0 else []
+
+    def _evict_hash_cache(self, file_list: Dict[str, Dict]) -> None:
+        """
+        Rimuove dalla cache le voci dei file che non esistono più.
+
+        Args:
+            file_list (Dict[str, Dict]): Lista dei file presenti nella cartella.
+        """
+        with self.cache_lock:
+            stale = [name for name in self.hash_cache if name not in file_list]
+            for name in stale:
+                del self.hash_cache[name]
+            if stale:
+                self.hash_cache_dirty = True
+                self.logger.debug(f"🧹 Rimosse {len(stale)} voci dalla cache hash")
+
+    def _handle_prepare(
+        self, conn: BaseFrameConnection, stream_id: int, payload: memoryview
+    ) -> None:
+        """
+        Gestisce la ricezione di un file inviato da un peer.
+
+        Dopo il READY il mittente invia il manifest dei blocchi; il ricevente
+        chiede sullo stesso stream solo i blocchi che non ha già in locale. Se
+        lo stesso file è già in coda o in download dal nodo, il ricevente
+        risponde PULLING invece di READY: due scritture sullo stesso file
+        temporaneo si rovinerebbero a vicenda.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Dimensione (UINT64) e nome del file.
+        """
+        try:
+            try:
+                file_size, filename = self._parse_numbered_name(payload)
+            except ValueError as e:
+                conn.send_error(stream_id, str(e))  # Percorso non valido o riservato
+                return
+
+            # La ricezione occupa la stessa chiave dei download della coda
+            key = ("download", filename)
+            with self.transfer_condition:
+                pulling = key in self.transfer_pending
+                self.transfer_pending.add(key)
+            if pulling:
+                conn.send(FRAME_DATA, stream_id, b"PULLING")
+                self.logger.debug(f"⏭️ {filename} è già in download, invio rifiutato")
+                return
+            try:
+                self._receive_pushed_file(conn, stream_id, filename, file_size)
+            finally:
+                with self.transfer_condition:
+                    self.transfer_pending.discard(key)
+
+        except Exception as e:
+            self.logger.error(f"❌ Errore ricezione file: {str(e)}")
+            raise
+
+    def _receive_pushed_file(
+        self, conn: BaseFrameConnection, stream_id: int, filename: str, file_size: int
+    ) -> None:
+        """
+        Riceve un file dopo una richiesta PREPARE accettata.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream della richiesta.
+            filename (str): Percorso relativo del file.
+            file_size (int): Dimensione annunciata dal mittente.
+
+        Raises:
+            ProtocolError: Se la ricezione si interrompe con blocchi in volo.
+        """
+        # Conferma al mittente che siamo pronti e riceve il manifest dei blocchi,
+        # a pagine e non più grande di quanto serve per file_size
+        conn.send(FRAME_DATA, stream_id, b"READY")
+        blocks = -(-file_size // self.block_size)
+        manifest = self._receive_json_pages(
+            conn, stream_id, MANIFEST_BLOCK_BYTES * blocks + LIST_PAGE_SIZE
+        )
+        if manifest["size"] != file_size:
+            raise ProtocolError(f"Manifest di {filename} diverso dal PREPARE")
+        self.logger.info(f"🛠️ Pronto a ricevere {filename} ({file_size} bytes)")
+
+        def fetch_blocks(
+            block_nums: List[int], out_fd: int
+        ) -> Iterator[Tuple[int, Optional[memoryview]]]:
+            def send_request(block_num: int) -> int:
+                conn.send(FRAME_DATA, stream_id, UINT64.pack(block_num))
+                return stream_id
+
+            return self._pipeline_blocks(conn, block_nums, send_request, out_fd=out_fd)
+
+        try:
+            ok = self._assemble_file(filename, manifest, fetch_blocks)
+        finally:
+            conn.send(FRAME_DATA, stream_id, UINT64.pack(END_OF_BLOCKS))
+        conn.send(FRAME_DATA, stream_id, b"OK" if ok else b"KO")
+        if not ok:
+            # Possono esserci blocchi ancora in volo: la connessione va chiusa
+            raise ProtocolError(f"Ricezione di {filename} interrotta")
+        self.logger.info(f"🎉 File {filename} ricevuto correttamente")
+
+    def _handle_chunk(
+        self, conn: BaseFrameConnection, stream_id: int, payload: memoryview
+    ) -> None:
+        """
+        Gestisce l'invio di un blocco.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Numero del blocco (UINT64) e nome del file.
+        """
+        try:
+            try:
+                block_num, filename = self._parse_numbered_name(payload)
+            except ValueError as e:
+                conn.send_error(stream_id, str(e))
+                return
+            try:
+                f = open(self._local_path(filename), "rb")
+            except OSError:
+                conn.send_error(stream_id, f"File non disponibile: {filename}")
+                return
+            with f:
+                length = self._block_length(f, block_num)
+                self._throttle("upload", conn.peer_ip, length)
+                conn.send_file(
+                    FRAME_DATA,
+                    stream_id,
+                    f,
+                    block_num * self.block_size,
+                    length,
+                )  # Invia i dati binari senza copiarli in memoria
+            self.logger.debug(f"📤 Inviato blocco {block_num} di {filename}")
+        except Exception as e:
+            self.logger.error(f"❌ Errore invio blocco: {str(e)}")
+            raise
+
+    def _block_length(self, f, block_num: int) -> int:
+        """
+        Restituisce i byte effettivi di un blocco, più corto se è l'ultimo.
+
+        Args:
+            f: File aperto in lettura binaria.
+            block_num (int): Numero del blocco.
+
+        Returns:
+            int: Lunghezza del blocco (0 se oltre la fine del file).
+        """
+        size = os.fstat(f.fileno()).st_size
+        return max(0, min(self.block_size, size - block_num * self.block_size))
+
+    def _handle_blocks(
+        self, conn: BaseFrameConnection, stream_id: int, payload: memoryview
+    ) -> None:
+        """
+        Invia il manifest dei blocchi di un file (hash, dimensione, hash dei blocchi).
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Nome del file.
+        """
+        try:
+            try:
+                filename = self._parse_name(payload)
+            except ValueError as e:
+                conn.send_error(stream_id, str(e))
+                return
+            entry = self._get_registry_entry(filename)
+            manifest = None
+            if entry is not None:
+                manifest = {
+                    "hash": entry["hash"],
+                    "size": entry["size"],
+                    "blocks": self._block_hashes(entry),
+                }
+            conn.send(FRAME_DATA, stream_id, json.dumps(manifest).encode())
+            self.logger.debug(f"📤 Inviato manifest dei blocchi di {filename}")
+        except Exception as e:
+            self.logger.error(f"❌ Errore invio manifest blocchi: {str(e)}")
+            raise
+
+    def _handle_delta(
+        self, conn: BaseFrameConnection, stream_id: int, payload: memoryview
+    ) -> None:
+        """
+        Invia il delta di un file rispetto alla copia del peer, in stile rsync.
+
+        Il peer invia la firma della propria copia (checksum debole e hash forte di
+        ogni blocco); il file locale viene percorso con un checksum rotolante e
+        trasmesso come riferimenti ai blocchi del peer più dati letterali, così
+        anche il contenuto spostato di pochi byte viene riconosciuto.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Nome del file.
+        """
+        try:
+            try:
+                filename = self._parse_name(payload)
+            except ValueError as e:
+                conn.send_error(stream_id, str(e))
+                return
+            try:
+                f = open(self._local_path(filename), "rb")
+            except OSError:
+                conn.send_error(stream_id, f"File non disponibile: {filename}")
+                return
+            conn.send(FRAME_DATA, stream_id, b"READY")
+
+            with f:
+                try:
+                    signature = self._parse_signature(conn.receive_data(stream_id))
+                except ValueError as e:
+                    conn.send_error(stream_id, str(e))
+                    return
+                file_size = os.fstat(f.fileno()).st_size
+                hasher = hashlib.sha256()
+                literal_bytes = 0
+                for instruction, data in self._compute_delta(f, signature, hasher):
+                    if instruction == DELTA_LITERAL:
+                        literal_bytes += len(data)
+                    if instruction == DELTA_FALLBACK or literal_bytes > file_size // 2:
+                        # Il file è cambiato troppo: meglio il trasferimento a blocchi
+                        conn.send(FRAME_DATA, stream_id, DELTA_FALLBACK)
+                        self.logger.debug(f"↩️ Delta di {filename} non conveniente")
+                        return
+                    if instruction == DELTA_LITERAL:
+                        self._throttle("upload", conn.peer_ip, len(data))
+                    conn.send(FRAME_DATA, stream_id, instruction + data)
+
+            result = {"hash": hasher.hexdigest(), "size": file_size}
+            conn.send(FRAME_DATA, stream_id, DELTA_END + json.dumps(result).encode())
+            self.logger.debug(
+                f"📤 Inviato delta di {filename}: {literal_bytes} byte letterali"
+            )
+        except Exception as e:
+            self.logger.error(f"❌ Errore invio delta: {str(e)}")
+            raise
+
+    def _parse_signature(self, payload: memoryview) -> Dict:
+        """
+        Decodifica e verifica la firma inviata da un peer con una richiesta DELTA.
+
+        La firma decide quanto lavoro fa il nodo per il peer: il blocco deve
+        essere quello del nodo e i blocchi al più DELTA_MAX_BLOCKS, coerenti con
+        la dimensione dichiarata.
+
+        Args:
+            payload (memoryview): Firma in JSON.
+
+        Returns:
+            Dict: Firma con 'block_size', 'size' e 'blocks' ([debole, forte]).
+
+        Raises:
+            ValueError: Se la firma non è valida o troppo grande.
+        """
+        try:
+            signature = json.loads(str(payload, "utf-8"))
+            block_size, size, blocks = (
+                signature["block_size"],
+                signature["size"],
+                signature["blocks"],
+            )
+        except (ValueError, TypeError, KeyError):
+            raise ValueError("Firma del delta non valida")
+        if block_size != self.block_size:
+            raise ValueError(f"Blocchi della firma diversi da {self.block_size} byte")
+        if not isinstance(size, int) or not isinstance(blocks, list) or size < 0:
+            raise ValueError("Firma del delta non valida")
+        if len(blocks) > DELTA_MAX_BLOCKS:
+            raise ValueError(f"Firma del delta oltre {DELTA_MAX_BLOCKS} blocchi")
+        if len(blocks) != -(-size // block_size):
+            raise ValueError("Blocchi della firma non coerenti con la dimensione")
+        for block in blocks:
+            if not (
+                isinstance(block, list)
+                and len(block) == 2
+                and isinstance(block[0], int)
+                and isinstance(block[1], str)
+            ):
+                raise ValueError("Firma del delta non valida")
+        return signature
+
+    def _compute_delta(
+        self, f, signature: Dict, hasher
+    ) -> Iterator[Tuple[bytes, bytes]]:
+        """
+        Confronta un file con la firma della copia del peer (algoritmo di rsync).
+
+        Il checksum debole è Adler-32: viene calcolato da zero con zlib quando la
+        finestra riparte e aggiornato byte per byte mentre scorre sui dati nuovi.
+        Solo le finestre con checksum debole noto vengono verificate con SHA256.
+        Lo scorrimento byte per byte è lento in Python: dopo DELTA_MAX_UNMATCHED
+        blocchi senza corrispondenze, o DELTA_MAX_ROLLED byte scorsi in tutto,
+        si rinuncia con DELTA_FALLBACK.
+
+        Args:
+            f: File locale aperto in lettura binaria.
+            signature (Dict): Firma con 'block_size' e 'blocks' ([debole, forte]).
+            hasher: Hash SHA256 aggiornato con tutti i dati del file.
+
+        Yields:
+            Tuple[bytes, bytes]: (DELTA_LITERAL, dati), (DELTA_BLOCK, indice) o,
+            come ultimo elemento, (DELTA_FALLBACK, b"") se il delta non conviene.
+        """
+        block_size = signature["block_size"]
+        blocks = signature["blocks"]
+        tail_size = signature["size"] % block_size  # Ultimo blocco corto del peer
+        full_blocks = len(blocks) - 1 if tail_size else len(blocks)
+        table: Dict[int, List[Tuple[int, str]]] = defaultdict(list)
+        for index, (weak, strong) in enumerate(blocks[:full_blocks]):
+            table[weak].append((index, strong))
+
+        buf = bytearray()
+        eof = False
+        start = 0  # Inizio della finestra in buf
+        literal = 0  # Inizio dei dati letterali non ancora inviati in buf
+        weak = None  # Checksum della finestra corrente (None = da ricalcolare)
+        last_match = 0  # Fine dell'ultimo blocco riconosciuto in buf
+        rolled = 0  # Byte scorsi uno alla volta
+
+        while True:
+            # Mantiene nel buffer la finestra corrente più almeno un byte
+            while not eof and len(buf) - start <= block_size:
+                data = f.read(max(block_size, 4 * 1024 * 1024))
+                eof = not data
+                hasher.update(data)
+                buf += data
+            if len(buf) - start < block_size:
+                break  # Resta solo la coda del file
+
+            if weak is None:
+                weak = zlib.adler32(buf[start : start + block_size])
+            match = None
+            candidates = table.get(weak)
+            if candidates:
+                strong = hashlib.sha256(buf[start : start + block_size]).hexdigest()
+                match = next((i for i, h in candidates if h == strong), None)
+
+            if match is not None:
+                if literal < start:
+                    yield DELTA_LITERAL, bytes(buf[literal:start])
+                yield DELTA_BLOCK, UINT64.pack(match)
+                start += block_size
+                literal = last_match = start
+                weak = None
+            elif start + block_size == len(buf):
+                break  # Fine del file: nessun byte per far scorrere la finestra
+            else:
+                # Fa scorrere la finestra di un byte (Adler-32 rotolante)
+                out_byte, in_byte = buf[start], buf[start + block_size]
+                a = ((weak & 0xFFFF) - out_byte + in_byte) % ADLER_MOD
+                b = ((weak >> 16) + a - 1 - block_size * out_byte) % ADLER_MOD
+                weak = (b << 16) | a
+                start += 1
+                rolled += 1
+                if (
+                    start - last_match > DELTA_MAX_UNMATCHED * block_size
+                    or rolled > DELTA_MAX_ROLLED
+                ):
+                    yield DELTA_FALLBACK, b""
+                    return
+                if start - literal >= block_size:
+                    yield DELTA_LITERAL, bytes(buf[literal:start])
+                    literal = start
+
+            if literal >= 16 * block_size:
+                del buf[:literal]  # Scarta i dati già trasmessi
+                start -= literal
+                last_match -= literal
+                literal = 0
+
+        # La coda può coincidere solo con l'ultimo blocco, più corto, del peer
+        tail_start = len(buf) - tail_size
+        if tail_size and tail_start >= literal:
+            tail = buf[tail_start:]
+            if (
+                zlib.adler32(tail) == blocks[-1][0]
+                and hashlib.sha256(tail).hexdigest() == blocks[-1][1]
+            ):
+                if literal < tail_start:
+                    yield DELTA_LITERAL, bytes(buf[literal:tail_start])
+                yield DELTA_BLOCK, UINT64.pack(len(blocks) - 1)
+                return
+        if literal < len(buf):
+            yield DELTA_LITERAL, bytes(buf[literal:])
+
+    def _handle_chunk_list(
+        self, conn: BaseFrameConnection, stream_id: int, payload: memoryview
+    ) -> None:
+        """
+        Invia la lista dei chunk content-defined di un file (null se non disponibile).
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Nome del file.
+        """
+        try:
+            try:
+                filename = self._parse_name(payload)
+            except ValueError as e:
+                conn.send_error(stream_id, str(e))
+                return
+            entry = self._get_registry_entry(filename)
+            manifest = None
+            if entry is not None and "chunks" in entry:
+                manifest = {
+                    "hash": entry["hash"],
+                    "size": entry["size"],
+                    "chunks": entry["chunks"],
+                }
+            conn.send(FRAME_DATA, stream_id, json.dumps(manifest).encode())
+        except Exception as e:
+            self.logger.error(f"❌ Errore invio lista chunk: {str(e)}")
+            raise
+
+    def _handle_get_chunk(
+        self, conn: BaseFrameConnection, stream_id: int, payload: memoryview
+    ) -> None:
+        """
+        Invia un chunk dello store, identificato dal suo hash.
+
+        Args:
+            conn (BaseFrameConnection): Connessione del peer.
+            stream_id (int): Id dello stream della richiesta.
+            payload (memoryview): Hash del chunk.
+        """
+        try:
+            chunk_hash = str(payload, "ascii", "replace")
+            try:
+                chunk = self._load_chunk(chunk_hash)
+            except ValueError:
+                chunk = None  # Hash non valido
+            if chunk is None:
+                conn.send_error(stream_id, f"Chunk {chunk_hash[:12]} non disponibile")
+                return
+            self._throttle("upload", conn.peer_ip, len(chunk))
+            conn.send(FRAME_DATA, stream_id, chunk)
+        except Exception as e:
+            self.logger.error(f"❌ Errore invio chunk: {str(e)}")
+            raise
+
+    def _broadcast_presence(self) -> None:
+        """Annuncia la propria presenza agli altri peer."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+
+        self.logger.debug("📢 Annuncio la mia presenza...")
+
+        while self.active:
+            try:
+                sock.sendto(
+                    b"DISCOVER", (self.multicast_group, self.multicast_port)
+                )  # Invia il pacchetto multicast per il discovery
+                time.sleep(5)
+            except Exception as e:
+                if self.active:
+                    self.logger.error(f"❌ Errore discovery: {str(e)}")
+
+    def _sync_loop(self) -> None:
+        """Esegue la sincronizzazione periodica con tutti i peer."""
+        while self.active:
+            try:
+                self._sync_round()
+            except Exception as e:
+                self.logger.error(f"❌ Errore durante la sincronizzazione: {str(e)}")
+            time.sleep(min(self.sync_interval, PEER_SYNC_TICK))
+
+    def _sync_round(self) -> None:
+        """
+        Avvia la sincronizzazione dei peer la cui scadenza è arrivata e, ogni
+        sync_interval secondi, esegue la manutenzione periodica del nodo.
+        """
+        self._expire_peers()
+        now = time.monotonic()
+        for peer in list(self.peers):
+            if self.peer_next_sync.get(peer, 0.0) <= now:
+                self._start_peer_sync(peer)
+        if now - self.last_round < self.sync_interval:
+            return
+        self.last_round = now
+        with self.peer_sync_lock:
+            self._set_metric("peers", len(self.peers))
+            self._set_metric(
+                "peers_backing_off", sum(1 for n in self.peer_failures.values() if n)
+            )
+
+        hashes_computed = self.metrics.get("hashes_computed", 0)
+        round_hashes = hashes_computed - self.round_hashes_start
+        self.round_hashes_start = hashes_computed
+        self._set_metric("last_round_hashes", round_hashes)
+        self._inc_metric("sync_rounds")
+        self.connection_pool.prune()  # Chiude le connessioni inattive
+        if time.time() - self.last_temp_clean >= TEMP_CLEAN_INTERVAL:
+            self.last_temp_clean = time.time()
+            self._clean_temp_files()  # Download abbandonati
+            if self.chunker is not None:
+                self._collect_chunk_garbage(self._get_local_file_list())
+        self.logger.debug(f"🔢 Hash calcolati nel round: {round_hashes}")
+
+    def _start_peer_sync(self, peer_ip: str) -> None:
+        """
+        Mette in coda la sincronizzazione di un peer, se non è già in corso.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+        """
+        with self.peer_sync_lock:
+            if peer_ip in self.peer_syncing or not self.active:
+                return
+            self.peer_syncing.add(peer_ip)
+        try:
+            self.peer_sync_executor.submit(self._sync_peer_task, peer_ip)
+        except RuntimeError:  # Pool già chiuso da stop()
+            with self.peer_sync_lock:
+                self.peer_syncing.discard(peer_ip)
+
+    def _sync_peer_task(self, peer_ip: str) -> None:
+        """
+        Sincronizza un peer nel pool e fissa la sua prossima scadenza.
+
+        Dopo n fallimenti di fila la scadenza si allontana di sync_interval * 2^n
+        secondi (con un po' di casualità, fino a PEER_BACKOFF_MAX), così un peer
+        irraggiungibile non consuma un timeout di connessione a ogni round.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+        """
+        synced = False
+        try:
+            synced = self._sync_with_peer(peer_ip)
+            self._inc_metric("peer_syncs" if synced else "peer_sync_failures")
+        finally:
+            with self.peer_sync_lock:
+                self.peer_syncing.discard(peer_ip)
+                failures = 0 if synced else self.peer_failures.get(peer_ip, 0) + 1
+                delay = self.sync_interval
+                if failures:
+                    delay = min(
+                        PEER_BACKOFF_MAX,
+                        delay * 2 ** min(failures, 16) * random.uniform(1, 1.5),
+                    )
+                if peer_ip in self.peers:
+                    self.peer_failures[peer_ip] = failures
+                    self.peer_next_sync[peer_ip] = time.monotonic() + delay
+        if failures:
+            self.logger.debug(
+                f"⏳ Peer {peer_ip}: {failures} errori di fila, riprovo tra {delay:.0f}s"
+            )
+
+    def _run_event_loop(self) -> None:
+        """Esegue l'event loop del motore asyncio fino all'arresto del nodo."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        executor = ThreadPoolExecutor(
+            max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix="p2p-worker"
+        )
+        loop.set_default_executor(executor)  # Disco e trasferimenti bloccanti
+        try:
+            loop.run_until_complete(self._async_main())
+        except Exception as e:
+            self.logger.error(f"❌ Errore motore asyncio: {str(e)}")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            loop.close()
+
+    async def _async_main(self) -> None:
+        """Avvia server, discovery e sincronizzazione e attende l'arresto."""
+        self.loop = asyncio.get_running_loop()
+        self.loop_stopped = asyncio.Event()
+        if not self.active:
+            return  # stop() chiamato prima dell'avvio del loop
+
+        server = await asyncio.start_server(
+            self._handle_connection_async,
+            "0.0.0.0",
+            self.peer_port,
+            reuse_address=True,
+            backlog=1024,
+        )
+        self.logger.debug(f"🔌 Server asyncio in ascolto sulla porta {self.peer_port}")
+        for coroutine in (
+            self._listen_for_peers_async(),  # Ascolta i peer
+            self._broadcast_presence_async(),  # Annuncia la propria presenza
+            self._sync_loop_async(),  # Loop di sincronizzazione
+        ):
+            asyncio.create_task(coroutine)
+        try:
+            await self.loop_stopped.wait()
+        finally:
+            server.close()
+            # Annulla servizi e connessioni ancora aperte prima di chiudere il loop
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle_connection_async(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
     ) -> None:
         """
-        Inizializza il nodo P2P per la sincronizzazione dei file.
+        Gestisce una connessione in entrata nel motore asyncio.
+
+        L'attesa delle richieste avviene nel loop; ogni richiesta viene poi
+        eseguita nel pool di thread con gli stessi gestori del motore a thread.
 
         Args:
-            shared_dir (str): Cartella condivisa per i file. Default: "arcade_shared".
-            block_size (int): Dimensione dei blocchi per il trasferimento file. Default: 1MB.
-            multicast_group (str): Indirizzo multicast per il discovery. Default: '239.255.255.250'.
-            multicast_port (int): Porta multicast per il discovery. Default: 5007.
-            peer_port (int): Porta TCP per le connessioni peer-to-peer. Default: 5005.
-            sync_interval (int): Intervallo di sincronizzazione in secondi. Default: 10.
+            reader (asyncio.StreamReader): Flusso in lettura della connessione.
+            writer (asyncio.StreamWriter): Flusso in scrittura della connessione.
         """
-        # Inizializza il logger
-        self.logger = self._setup_logger()  # Configura il logger
+        addr = writer.get_extra_info("peername")
+        loop = asyncio.get_running_loop()
+        conn = AsyncFrameConnection(reader, writer, addr[0], loop, self.frame_limits)
+        try:
+            while self.active:
+                frame_type, stream_id, payload = await asyncio.wait_for(
+                    conn.read_frame(), SERVER_IDLE_TIMEOUT
+                )
+                self.logger.debug(
+                    f"📨 Richiesta {frame_type:#x} da {addr} (stream {stream_id})"
+                )
+                if not self.server_slots.acquire(blocking=False):
+                    # Pool e coda pieni: la connessione resta aperta
+                    self._inc_metric("server_busy")
+                    writer.write(self._busy_frame(stream_id))
+                    await writer.drain()
+                    continue
+                try:
+                    await loop.run_in_executor(
+                        None,
+                        self._dispatch_request,
+                        conn,
+                        addr,
+                        frame_type,
+                        stream_id,
+                        memoryview(payload),
+                    )
+                finally:
+                    self.server_slots.release()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+            pass  # Connessione chiusa dal peer o inattiva
+        except FrameTooLargeError as e:
+            self.logger.warning(f"🚫 Frame respinto da {addr[0]}: {str(e)}")
+            writer.write(self._error_frame(e.stream_id, str(e)))
+        except asyncio.CancelledError:
+            pass  # Arresto del nodo: il task termina qui
+        except Exception as e:
+            self.logger.debug(f"🔌 Connessione con {addr[0]} chiusa: {str(e)}")
+        finally:
+            writer.close()
 
-        # Configurazione directory e parametri
-        self.shared_dir = self._setup_shared_dir(
-            shared_dir
-        )  # Configura la cartella condivisa
-        self.block_size = block_size  # Dimensione dei blocchi per il trasferimento file
-        self.multicast_group = multicast_group  # Indirizzo multicast per il discovery
-        self.multicast_port = multicast_port  # Porta multicast per il discovery
-        self.peer_port = peer_port  # Porta TCP per le connessioni peer-to-peer
-        self.sync_interval = sync_interval  # Intervallo di sincronizzazione in secondi
+    async def _listen_for_peers_async(self) -> None:
+        """Ascolta gli annunci multicast dei peer nel motore asyncio."""
+        sock = self._create_discovery_socket()
+        sock.setblocking(False)
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: DiscoveryProtocol(self), sock=sock
+        )
+        self.logger.debug("🎧 In ascolto per nuovi peer...")
+        try:
+            await asyncio.Event().wait()  # Fino alla cancellazione del task
+        finally:
+            transport.close()
 
-        # Stato interno
-        self.peers: Set[str] = set()  # Insieme di peer connessi
-        self.file_registry: Dict[str, Dict] = defaultdict(
-            dict
-        )  # Registro dei file locali
-        self.active = True  # Flag per l'attività del nodo
-        self.local_ip = self._get_reliable_local_ip()  # Indirizzo IP locale
-        self.synced_files: Set[str] = set()  # Insieme di file sincronizzati
-        self.last_scan_time = 0  # Ultimo tempo di scansione
-        self.scan_interval = 5  # Intervallo di scansione in secondi
+    async def _broadcast_presence_async(self) -> None:
+        """Annuncia periodicamente la propria presenza nel motore asyncio."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        sock.setblocking(False)
+        self.logger.debug("📢 Annuncio la mia presenza...")
+        try:
+            while self.active:
+                try:
+                    sock.sendto(
+                        b"DISCOVER", (self.multicast_group, self.multicast_port)
+                    )
+                except OSError as e:
+                    self.logger.error(f"❌ Errore discovery: {str(e)}")
+                await asyncio.sleep(5)
+        finally:
+            sock.close()
 
-        # Avvio servizi
-        self._start_services()  # Avvia i servizi di rete
-        self.logger.info(f"🚀 Nodo P2P avviato su {self.local_ip}")
+    async def _sync_loop_async(self) -> None:
+        """Esegue la sincronizzazione periodica nel motore asyncio."""
+        loop = asyncio.get_running_loop()
+        while self.active:
+            try:
+                await loop.run_in_executor(None, self._sync_round)
+            except Exception as e:
+                self.logger.error(f"❌ Errore durante la sincronizzazione: {str(e)}")
+            await asyncio.sleep(min(self.sync_interval, PEER_SYNC_TICK))
 
-    def _setup_logger(self) -> logging.Logger:
+    def _retry_when_busy(self, operation: Callable, *args):
         """
-        Configura e restituisce un logger per il nodo.
+        Esegue un'operazione verso un peer, ripetendola se il peer risponde BUSY.
+
+        Tra un tentativo e l'altro attende il tempo suggerito dal peer; dopo
+        BUSY_MAX_RETRIES tentativi l'errore viene propagato.
+
+        Args:
+            operation (Callable): Operazione da eseguire.
+            *args: Argomenti dell'operazione.
 
         Returns:
-            logging.Logger: Istanza del logger configurato.
+            Il risultato dell'operazione.
+
+        Raises:
+            PeerBusyError: Se il peer è ancora saturo all'ultimo tentativo.
         """
-        logger = logging.getLogger("P2PFileSync")
-        logger.setLevel(
-            logging.INFO
-        )  # Livello di log, cambiare INFO in DEBUG per più dettagli.
-        ch = logging.StreamHandler()
-        ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
-        logger.addHandler(ch)
-        return logger
+        for attempt in range(1, BUSY_MAX_RETRIES + 1):
+            try:
+                return operation(*args)
+            except PeerBusyError as e:
+                if attempt == BUSY_MAX_RETRIES or not self.active:
+                    raise
+                self._inc_metric("busy_retries")
+                self.logger.info(
+                    f"🚦 Peer occupato, nuovo tentativo tra {e.retry_after:.1f}s"
+                )
+                time.sleep(e.retry_after)
 
-    def _setup_shared_dir(self, path: str) -> str:
+    def _fetch_peer_files(self, peer_ip: str) -> Optional[Dict[str, Dict]]:
         """
-        Crea la cartella condivisa se non esiste e restituisce il percorso assoluto.
+        Aggiorna la lista dei file di un peer in peer_lists e la restituisce.
+
+        Prima si confrontano le radici degli alberi di Merkle dei due registri:
+        se coincidono il peer ha esattamente i file del nodo e il round con il
+        peer si salta, senza copiare il registro né toccare peer_lists.
+        Altrimenti, se è nota una lista precedente, vengono chieste con
+        LIST_SINCE solo le voci cambiate dall'ultima generazione ricevuta; al
+        primo contatto (o dopo un riavvio del peer) si scende nell'albero fino ai
+        rami diversi e si chiedono solo le loro voci. A regime il traffico è
+        proporzionale alle modifiche e non al numero di file.
 
         Args:
-            path (str): Percorso della cartella condivisa.
+            peer_ip (str): Indirizzo IP del peer.
 
         Returns:
-            str: Percorso assoluto della cartella condivisa.
+            Optional[Dict[str, Dict]]: Lista dei file del peer (nome -> hash e
+            dimensione), o None se il peer ha esattamente i file del nodo.
         """
-        os.makedirs(path, exist_ok=True)
-        abs_path = os.path.abspath(path)
-        self.logger.info(f"📁 Cartella condivisa: {abs_path}")
+        with self.peer_lists_lock:
+            previous = self.peer_lists.get(peer_ip)
+            epoch, since = self.peer_cursors.get(peer_ip, (0, 0))
 
-        # Verifica il contenuto della cartella
-        files = os.listdir(abs_path)
-        if not files:
-            self.logger.warning("⚠️ La cartella condivisa è vuota!")
-        else:
-            self.logger.info(f"📂 Contenuto della cartella: {files}")
+        with self.connection_pool.connection(peer_ip) as conn:
+            _, reply = conn.request(FRAME_MERKLE)
+            peer_epoch, generation = LIST_CURSOR.unpack_from(reply)
+            peer_root = bytes(reply[LIST_CURSOR.size :])
+            self._refresh_registry()
+            with self.registry_lock:
+                local_root = self._merkle_node(self.merkle_tree, "")
+            if peer_root == local_root:
+                self._inc_metric("merkle_root_matches")
+                return None  # Stessi file: niente da sincronizzare
+            if previous is not None and epoch == peer_epoch:
+                return self._fetch_changes(peer_ip, conn, previous, epoch, since)
+            local_files, local_tree = self._merkle_snapshot()
+            peer_files = None
+            if "" in local_tree:  # Registro locale non vuoto
+                peer_files = self._merkle_diff(conn, local_files, local_tree)
+                if peer_files is None:
+                    # Troppi rami diversi: riconciliazione con filtri di Bloom
+                    return self._bloom_reconcile(peer_ip, conn, local_files)
+            if peer_files is None:
+                return self._fetch_changes(peer_ip, conn, None, 0, 0)
+        with self.peer_lists_lock:
+            self.peer_lists[peer_ip] = peer_files
+            self.peer_cursors[peer_ip] = (peer_epoch, generation)
+        return peer_files
 
-        return abs_path
+    def _fetch_changes(
+        self,
+        peer_ip: str,
+        conn: FrameConnection,
+        previous: Optional[Dict[str, Dict]],
+        epoch: int,
+        since: int,
+    ) -> Dict[str, Dict]:
+        """
+        Chiede a un peer con LIST_SINCE le voci cambiate dopo una generazione e
+        aggiorna peer_lists.
 
-    def _get_reliable_local_ip(self) -> str:
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+            conn (FrameConnection): Connessione verso il peer.
+            previous (Optional[Dict[str, Dict]]): Ultima lista ricevuta, o None
+                per chiedere la lista completa.
+            epoch (int): Epoca del registro del peer a cui si riferisce since.
+            since (int): Ultima generazione ricevuta.
+
+        Returns:
+            Dict[str, Dict]: Lista dei file del peer (nome -> hash e dimensione).
         """
-        Ottiene l'IP locale in modo affidabile per LINUX e WINDOWS.
+        stream_id = conn.new_stream()
+        conn.send(FRAME_LIST_SINCE, stream_id, LIST_CURSOR.pack(epoch, since))
+        epoch, generation, full = LIST_SINCE_REPLY.unpack(conn.receive_data(stream_id))
+        peer_files = {} if full or previous is None else dict(previous)
+        changes = 0
+        for name, info in self._iter_list_records(conn, stream_id):
+            if info is None:
+                peer_files.pop(name, None)  # Cancellato sul peer
+            else:
+                peer_files[name] = info
+            changes += 1
+        self._inc_metric("lists_full" if full else "lists_incremental")
+        self._inc_metric("list_entries_received", changes)
+        with self.peer_lists_lock:
+            self.peer_lists[peer_ip] = peer_files
+            self.peer_cursors[peer_ip] = (epoch, generation)
+        return peer_files
+
+    def _merkle_diff(
+        self,
+        conn: FrameConnection,
+        local_files: Dict[str, Dict],
+        local_tree: Dict[str, Tuple[int, int]],
+    ) -> Optional[Dict[str, Dict]]:
+        """
+        Ricostruisce la lista dei file di un peer confrontando gli alberi di Merkle.
+
+        Si scende un livello per round trip solo nei rami con digest diverso; le
+        voci dei rami uguali sono quelle locali, quelle dei rami diversi vengono
+        chieste al peer con LIST_BUCKETS.
+
+        Args:
+            conn (FrameConnection): Connessione verso il peer.
+            local_files (Dict[str, Dict]): Registro locale.
+            local_tree (Dict[str, Tuple[int, int]]): Albero locale, coerente con
+                local_files.
 
         Returns:
-            str: Indirizzo IP locale.
+            Optional[Dict[str, Dict]]: Lista dei file del peer, o None se i rami
+            diversi sono più di MERKLE_MAX_PREFIXES e conviene la lista completa.
+        """
+        prefixes = [""]  # Nodi diversi da espandere
+        differing = []  # Rami diversi di cui chiedere le voci
+        while prefixes:
+            if len(prefixes) > MERKLE_MAX_PREFIXES:
+                return None
+            _, reply = conn.request(FRAME_MERKLE, self._pack_prefixes(prefixes))
+            if len(reply) != len(prefixes) * len(HEX_DIGITS) * MERKLE_NODE.size:
+                raise ProtocolError("Risposta MERKLE di lunghezza inattesa")
+            children = [prefix + digit for prefix in prefixes for digit in HEX_DIGITS]
+            prefixes = []
+            for i, child in enumerate(children):
+                node = bytes(reply[i * MERKLE_NODE.size : (i + 1) * MERKLE_NODE.size])
+                if node == self._merkle_node(local_tree, child):
+                    continue  # Ramo uguale
+                if len(child) == MERKLE_DEPTH or child not in local_tree:
+                    differing.append(child)  # Foglia, o ramo che il nodo non ha
+                elif not MERKLE_NODE.unpack(node)[0]:
+                    differing.append(child)  # Ramo che il peer non ha
+                else:
+                    prefixes.append(child)
+        self._inc_metric("merkle_branches_fetched", len(differing))
+
+        excluded = set(differing)
+        peer_files = {
+            name: entry
+            for name, entry in local_files.items()
+            if not any(
+                entry["leaf"][0][:depth] in excluded
+                for depth in range(1, MERKLE_DEPTH + 1)
+            )
+        }
+        for start in range(0, len(differing), MERKLE_MAX_PREFIXES):
+            batch = differing[start : start + MERKLE_MAX_PREFIXES]
+            stream_id = conn.new_stream()
+            conn.send(FRAME_LIST_BUCKETS, stream_id, self._pack_prefixes(batch))
+            for name, info in self._iter_list_records(conn, stream_id):
+                if info is not None:
+                    peer_files[name] = info
+        return peer_files
+
+    def _bloom_reconcile(
+        self, peer_ip: str, conn: FrameConnection, local_files: Dict[str, Dict]
+    ) -> Dict[str, Dict]:
+        """
+        Ricostruisce la lista dei file di un peer scambiando filtri di Bloom.
+
+        Il nodo invia il filtro delle sue voci e riceve quello del peer insieme
+        alle voci del peer che non sono nel filtro locale. La lista stimata è
+        formata dalle voci locali presenti nel filtro del peer più quelle
+        ricevute; gli errori dovuti ai falsi positivi, pochi, vengono poi
+        corretti confrontando gli alberi di Merkle (_merkle_diff). Se restano
+        troppi rami diversi si chiede la lista completa.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+            conn (FrameConnection): Connessione verso il peer.
+            local_files (Dict[str, Dict]): Registro locale.
+
+        Returns:
+            Dict[str, Dict]: Lista dei file del peer (nome -> hash e dimensione).
+        """
+        bloom = BloomFilter(len(local_files))
+        for entry in local_files.values():
+            bloom.add(entry["leaf"][1])
+        payload = bloom.to_bytes()
+        if len(payload) > BLOOM_MAX_SIZE:
+            # Il peer non accetterebbe il filtro: lista completa
+            return self._fetch_changes(peer_ip, conn, None, 0, 0)
+        stream_id = conn.new_stream()
+        conn.send(FRAME_BLOOM, stream_id, payload)
+        reply = conn.receive_data(stream_id)
+        epoch, generation = LIST_CURSOR.unpack_from(reply)
+        peer_bloom = BloomFilter.from_bytes(reply[LIST_CURSOR.size :])
+
+        estimate = {
+            name: entry
+            for name, entry in local_files.items()
+            if entry["leaf"][1] in peer_bloom
+        }
+        received = 0
+        for name, info in self._iter_list_records(conn, stream_id):
+            if info is not None:
+                info["leaf"] = self._merkle_leaf(name, info)
+                estimate[name] = info
+                received += 1
+        self._inc_metric("bloom_reconciliations")
+        self._inc_metric("list_entries_received", received)
+
+        tree: Dict[str, List[int]] = {}
+        for entry in estimate.values():
+            self._merkle_update(tree, entry["leaf"], 1)
+        peer_files = self._merkle_diff(conn, estimate, tree)
+        if peer_files is None:
+            return self._fetch_changes(peer_ip, conn, None, 0, 0)
+        with self.peer_lists_lock:
+            self.peer_lists[peer_ip] = peer_files
+            self.peer_cursors[peer_ip] = (epoch, generation)
+        return peer_files
+
+    def _merkle_snapshot(
+        self,
+    ) -> Tuple[Dict[str, Dict], Dict[str, Tuple[int, int]]]:
+        """
+        Restituisce una copia coerente del registro e del suo albero di Merkle.
+
+        La copia viene rifatta solo quando la generazione del registro cambia,
+        così i peer confrontati nello stesso momento la condividono: va usata
+        in sola lettura.
+
+        Returns:
+            Tuple[Dict[str, Dict], Dict[str, Tuple[int, int]]]: Registro locale e
+            nodi dell'albero (prefisso -> numero di file e somma dei digest).
+        """
+        self._refresh_registry()
+        with self.registry_lock:
+            cached = self.merkle_snapshot_cache
+            if cached is None or cached[0] != self.registry_generation:
+                cached = self.merkle_snapshot_cache = (
+                    self.registry_generation,
+                    dict(self.file_registry),
+                    {prefix: tuple(node) for prefix, node in self.merkle_tree.items()},
+                )
+            return cached[1], cached[2]
+
+    @staticmethod
+    def _iter_list_records(
+        conn: FrameConnection, stream_id: int
+    ) -> Iterator[Tuple[str, Optional[Dict]]]:
+        """
+        Legge le voci di una lista dei file, una pagina alla volta.
+
+        Args:
+            conn (FrameConnection): Connessione verso il peer.
+            stream_id (int): Id dello stream della richiesta LIST o LIST_SINCE.
+
+        Yields:
+            Tuple[str, Optional[Dict]]: Nome del file e relativi hash e
+            dimensione, o None se il file è stato cancellato.
+
+        Raises:
+            ProtocolError: Se una pagina contiene una voce troncata.
+        """
+        while True:
+            page = conn.receive_data(stream_id)
+            if not page:
+                return  # Pagina vuota: fine della lista
+            pos = 0
+            while pos < len(page):
+                if pos + LIST_RECORD.size > len(page):
+                    raise ProtocolError("Voce della lista troncata")
+                name_len, size, digest = LIST_RECORD.unpack_from(page, pos)
+                pos += LIST_RECORD.size + name_len
+                if pos > len(page):
+                    raise ProtocolError("Nome nella lista troncato")
+                name = str(page[pos - name_len : pos], "utf-8")
+                if size == LIST_DELETED:
+                    yield name, None
+                else:
+                    yield name, {"hash": digest.hex(), "size": size}
+
+    def _sync_with_peer(
+        self, peer_ip: str, peer_files: Optional[Dict[str, Dict]] = None
+    ) -> bool:
+        """
+        Sincronizza i file con un peer specifico.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+            peer_files (Optional[Dict[str, Dict]]): Lista dei file del peer, se già
+                ricevuta; altrimenti viene richiesta.
+
+        Returns:
+            bool: True se la lista del peer è stata ricevuta ed elaborata.
         """
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                s.connect(
-                    ("10.255.255.255", 1)
-                )  # Indirizzo non instradabile su Internet
-                return s.getsockname()[0]
-        except:
-            try:
-                return socket.gethostbyname(socket.gethostname())
-            except:
-                return "127.0.0.1"
+            if peer_files is None:
+                peer_files = self._retry_when_busy(self._fetch_peer_files, peer_ip)
+            if peer_files is None:
+                self.logger.debug(f"✅ {peer_ip} ha gli stessi file, round saltato")
+                return True
+            self._process_peer_files(
+                peer_ip, peer_files
+            )  # Elabora i file del peer ricevuti
+            return True
+        except Exception as e:
+            self.logger.warning(f"⚠️ Errore sync con {peer_ip}: {str(e)}")
+            return False
 
-    def _start_services(self) -> None:
-        """Avvia tutti i servizi di rete in thread separati."""
-        services = [
-            self._listen_for_peers,  # Ascolta i peer
-            self._start_tcp_server,  # Avvia il server TCP
-            self._broadcast_presence,  # Annuncia la propria presenza
-            self._sync_loop,  # Loop di sincronizzazione
-        ]
-        for service in services:
-            threading.Thread(
-                target=service, daemon=True
-            ).start()  # Avvia il servizio in un thread
+    def _process_peer_files(self, peer_ip: str, peer_files: Dict) -> None:
+        """
+        Elabora la lista dei file ricevuta da un peer.
+        """
+        local_files = self._get_local_file_list()  # Ottiene la lista dei file locali
 
-    def _listen_for_peers(self) -> None:
-        """Ascolta i pacchetti multicast per rilevare nuovi peer."""
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
-        sock.setsockopt(
-            socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
-        )  # Riutilizzo indirizzo
+        # Trova file mancanti o diversi confrontando gli hash del registro,
+        # senza rileggere i file dal disco
+        for filename, info in peer_files.items():
+            if self._is_internal_path(filename):
+                continue  # File di servizio del peer (store dei chunk, cache, ...)
+            local_info = local_files.get(filename)
+            if local_info is None or local_info["hash"] != info["hash"]:
+                if not self._is_synced(peer_ip, filename, info["hash"]):
+                    self._schedule_transfer(
+                        ("download", filename),
+                        filename,
+                        info["size"],
+                        self._transfer_download,
+                        peer_ip,
+                        filename,
+                        info["size"],
+                        info["hash"],
+                    )  # Scarica il file dal peer, appena c'è posto
+                else:
+                    self.logger.debug(f"✅ File già sincronizzato: {filename}")
+            else:
+                self.logger.debug(f"✅ File già sincronizzato: {filename}")
 
-        # Configurazione specifica per OS
-        if sys.platform.startswith("linux"):
-            sock.bind((self.multicast_group, self.multicast_port))  # Linux
-        else:
-            sock.bind(("", self.multicast_port))  # Windows
+        # Invia i nostri file mancanti al peer
+        with self.transfer_condition:
+            downloading = {
+                key[1] for key in self.transfer_pending if key[0] == "download"
+            }
+        for filename, info in local_files.items():
+            if (
+                filename not in peer_files
+                or peer_files[filename]["hash"] != info["hash"]
+            ):
+                if filename in downloading:
+                    continue  # La nostra copia sta per essere sostituita
+                if not self._is_synced(peer_ip, filename, info["hash"]):
+                    self._schedule_transfer(
+                        ("upload", peer_ip, filename),
+                        filename,
+                        info["size"],
+                        self._transfer_upload,
+                        peer_ip,
+                        filename,
+                    )  # Invia il file al peer, appena c'è posto
+                else:
+                    self.logger.debug(f"✅ File già sincronizzato: {filename}")
+            else:
+                self.logger.debug(f"✅ File già sincronizzato: {filename}")
 
-        # Configurazione gruppo multicast
-        mreq = socket.inet_aton(self.multicast_group) + socket.inet_aton(
-            self.local_ip
-        )  # Indirizzo
-        sock.setsockopt(
-            socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq
-        )  # Aggiungi gruppo
+    def _is_synced(self, peer_ip: str, filename: str, file_hash: str) -> bool:
+        """
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+            filename (str): Nome relativo del file.
+            file_hash (str): Hash del contenuto da confrontare.
 
-        self.logger.debug("🎧 In ascolto per nuovi peer...")
+        Returns:
+            bool: True se questo contenuto del file è già stato sincronizzato
+            con il peer.
+        """
+        with self.peer_lists_lock:
+            return self.synced_files.get((peer_ip, filename)) == file_hash
 
-        while self.active:
-            try:
-                data, addr = sock.recvfrom(1024)
-                self.logger.debug(f"📩 Ricevuto pacchetto da {addr}: {data.decode()}")
-                if data.decode() == "DISCOVER" and addr[0] != self.local_ip:
-                    self._add_peer(addr[0])  # Aggiungi il peer
-            except Exception as e:
-                if self.active:
-                    self.logger.error(f"❌ Errore multicast: {str(e)}")
+    def _mark_synced(self, peer_ip: str, filename: str, file_hash: str) -> None:
+        """
+        Ricorda che un contenuto del file è stato sincronizzato con il peer.
 
-    def _add_peer(self, peer_ip: str) -> None:
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+            filename (str): Nome relativo del file.
+            file_hash (str): Hash del contenuto trasferito.
         """
-        Aggiunge un nuovo peer alla lista e avvia la sincronizzazione.
+        with self.peer_lists_lock:
+            self.synced_files[(peer_ip, filename)] = file_hash
+
+    def _transfer_deadline(self, filename: str, size: int) -> float:
+        """
+        Calcola la scadenza di un trasferimento, usata come priorità nella coda.
 
         Args:
-            peer_ip (str): Indirizzo IP del peer da aggiungere.
+            filename (str): Nome relativo del file.
+            size (int): Dimensione del file in byte.
+
+        Returns:
+            float: Istante (time.monotonic) entro cui il trasferimento dovrebbe
+            partire: prima scade, prima parte.
         """
-        if peer_ip not in self.peers:
-            self.peers.add(peer_ip)  # Aggiungi il peer
-            self.logger.info(f"🆕 Nuovo peer rilevato: {peer_ip}")
-            self._sync_with_peer(peer_ip)  # Sincronizza i file con il peer
+        deadline = TRANSFER_DEFAULT_DEADLINE
+        for pattern, class_deadline in self.transfer_classes.items():
+            if fnmatch.fnmatchcase(filename, pattern):
+                deadline = class_deadline
+                break
+        return time.monotonic() + deadline + size / TRANSFER_SIZE_RATE
 
-    def _start_tcp_server(self) -> None:
-        """Avvia il server TCP per gestire le connessioni in entrata."""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            sock.bind(("0.0.0.0", self.peer_port))
-            sock.listen(5)
-            self.logger.debug(f"🔌 Server TCP in ascolto sulla porta {self.peer_port}")
+    def _schedule_transfer(
+        self, key: Tuple, filename: str, size: int, operation: Callable, *args
+    ) -> None:
+        """
+        Mette in coda un trasferimento, se uno uguale non è già in coda o in corso.
 
-            while self.active:
-                try:
-                    conn, addr = sock.accept()
-                    self.logger.debug(f"🔗 Connessione TCP da {addr}")
-                    threading.Thread(
-                        target=self._handle_request, args=(conn, addr)
-                    ).start()  # Gestisce la richiesta in un thread
-                except Exception as e:
-                    if self.active:
-                        self.logger.error(f"❌ Errore server TCP: {str(e)}")
+        Args:
+            key (Tuple): Chiave del trasferimento, es. ("download", nome).
+            filename (str): Nome relativo del file, per la classe di priorità.
+            size (int): Dimensione del file in byte.
+            operation (Callable): Operazione che esegue il trasferimento.
+            *args: Argomenti dell'operazione.
+        """
+        with self.transfer_condition:
+            if key in self.transfer_pending:
+                return
+            self.transfer_pending.add(key)
+            heapq.heappush(
+                self.transfer_queue,
+                (
+                    self._transfer_deadline(filename, size),
+                    next(self.transfer_sequence),
+                    key,
+                    operation,
+                    args,
+                ),
+            )
+            self._set_metric("transfers_queued", len(self.transfer_queue))
+            self.transfer_condition.notify()
+        self.logger.debug(f"🗂️ Trasferimento in coda: {key}")
+
+    def _transfer_worker(self) -> None:
+        """Esegue i trasferimenti in coda, dal più urgente, fino all'arresto."""
+        while self.active:
+            with self.transfer_condition:
+                while self.active and not self.transfer_queue:
+                    self.transfer_condition.wait()
+                if not self.active:
+                    return
+                _, _, key, operation, args = heapq.heappop(self.transfer_queue)
+                self._set_metric("transfers_queued", len(self.transfer_queue))
+            self._inc_metric("transfers_active")
+            try:
+                operation(*args)
+            except Exception as e:
+                self.logger.warning(f"⚠️ Trasferimento {key} non riuscito: {str(e)}")
+            finally:
+                self._inc_metric("transfers_active", -1)
+                self._inc_metric("transfers_done")
+                with self.transfer_condition:
+                    self.transfer_pending.discard(key)
+
+    def _transfer_download(
+        self, peer_ip: str, filename: str, file_size: int, file_hash: str
+    ) -> None:
+        """
+        Scarica un file dalla coda dei trasferimenti.
+
+        Args:
+            peer_ip (str): Indirizzo IP del peer.
+            filename (str): Nome del file da scaricare.
+            file_size (int): Dimensione del file annunciata nella lista.
+            file_hash (str): Hash del file annunciato nella lista.
+        """
+        self.logger.info(f"📥 File da sincronizzare: {filename}")
+        if self._retry_when_busy(
+            self._download_file, peer_ip, filename, file_size
+        ):  # Se fallisce si riprova al prossimo round
+            self._mark_synced(peer_ip, filename, file_hash)
 
-    def _handle_request(self, conn: socket.socket, addr: tuple) -> None:
+    def _transfer_upload(self, peer_ip: str, filename: str) -> None:
         """
-        Gestisce le richieste TCP in entrata.
+        Invia un file dalla coda dei trasferimenti. Il file risulta sincronizzato
+        solo se il peer lo ha ricevuto e verificato (vedi _send_file_to_peer):
+        un invio rifiutato o fallito viene ritentato al round successivo.
 
         Args:
-            conn (socket.socket): Socket della connessione.
-            addr (tuple): Indirizzo del peer (IP, porta).
+            peer_ip (str): Indirizzo IP del peer.
+            filename (str): Nome del file da inviare.
         """
-        try:
-            data = conn.recv(1024).decode()
-            self.logger.debug(f"📨 Richiesta da {addr}: {data}")
-
-            if data.startswith("LIST"):
-                self._send_file_list(conn, addr)  # Invia la lista dei file
-            elif data.startswith("PREPARE:"):
-                self._handle_prepare(conn, data)  # Gestisce la preparazione
-            elif data.startswith("CHUNK:"):
-                self._handle_chunk(conn, data)  # Gestisce l'invio del blocco
+        self.logger.info(f"📤 Invio file {filename} a {peer_ip}")
+        self._retry_when_busy(self._send_file_to_peer, peer_ip, filename)
 
-        except Exception as e:
-            self.logger.error(f"❌ Errore connessione con {addr[0]}: {str(e)}")
-        finally:
-            conn.close()
-
-    def _send_file_list(self, conn: socket.socket, addr: tuple) -> None:
+    def _send_file_to_peer(self, peer_ip: str, filename: str) -> None:
         """
-        Invia la lista dei file disponibili al peer.
+        Invia un file a un peer, trasferendo solo i blocchi che il peer non ha.
 
         Args:
-            conn (socket.socket): Socket della connessione.
-            addr (tuple): Indirizzo del peer (IP, porta).
+            peer_ip (str): Indirizzo IP del peer.
+            filename (str): Nome del file da inviare.
         """
         try:
-            file_list = self._get_local_file_list()  # Ottiene la lista dei file
-            conn.send(
-                json.dumps(file_list).encode()
-            )  # Invia la lista come JSON. La struttura è da ridefinire
-            self.logger.info(
-                f"📄 Inviata lista file a {addr[0]}: {len(file_list)} file"
-            )
-        except Exception as e:
-            self.logger.error(f"❌ Errore invio file list: {str(e)}")
+            filepath = self._local_path(filename)
+            entry = self._get_registry_entry(filename)
+            if entry is None or not os.path.exists(filepath):
+                self.logger.warning(f"⚠️ File {filename} non trovato")
+                return
 
-    def _get_local_file_list(self) -> Dict[str, Dict]:
-        """
-        Restituisce la lista dei file locali con hash e dimensione.
-        """
-        current_time = time.time()
-        if current_time - self.last_scan_time < self.scan_interval:
-            return self.file_registry  # ritorna il registro se la scansione è recente.
-        self.last_scan_time = current_time
-        file_list = {}
-        try:
-            self.logger.debug(f"🔍 Scansione della cartella: {self.shared_dir}")
-            for filename in os.listdir(self.shared_dir):
-                filepath = os.path.join(self.shared_dir, filename)  # Percorso del file
-                self.logger.debug(
-                    f"🔍 Rilevato: {filename} (is_file: {os.path.isfile(filepath)})"
+            manifest = {
+                "hash": entry["hash"],
+                "size": entry["size"],
+                "blocks": self._block_hashes(entry),
+            }
+
+            with self.connection_pool.connection(peer_ip) as conn, open(
+                filepath, "rb"
+            ) as f:
+                # Invia la richiesta PREPARE con dimensione e nome e attende conferma
+                stream_id, response = conn.request(
+                    FRAME_PREPARE, UINT64.pack(entry["size"]) + filename.encode()
                 )
-                if os.path.isfile(filepath) and not filename.startswith(".tmp."):
-                    file_list[filename] = {
-                        "hash": self._calculate_hash(filepath),
-                        "size": os.path.getsize(filepath),
-                    }  # Calcola hash e dimensione
-            self.logger.info(f"📄 Lista file locali: {len(file_list)} file")
+                if response == b"PULLING":
+                    # Il peer sta già scaricando il file da noi o da altri
+                    self.logger.info(f"⏭️ {peer_ip} sta già scaricando {filename}")
+                    return
+                if response != b"READY":
+                    raise Exception("Peer non pronto a ricevere")
+                self._send_json_pages(conn, stream_id, manifest)
+
+                # Invia solo i blocchi richiesti dal peer
+                sent = 0
+                while True:
+                    (block_num,) = UINT64.unpack(conn.receive_data(stream_id))
+                    if block_num == END_OF_BLOCKS:
+                        break
+                    length = self._block_length(f, block_num)
+                    self._throttle("upload", peer_ip, length)
+                    conn.send_file(
+                        FRAME_DATA,
+                        stream_id,
+                        f,
+                        block_num * self.block_size,
+                        length,
+                    )
+                    self.logger.debug(
+                        f"📤 Inviato blocco {block_num} di {filename} a {peer_ip}"
+                    )
+                    sent += 1
+
+                if conn.receive_data(stream_id) != b"OK":
+                    raise Exception("Il peer non ha verificato il file")
+                self.logger.info(
+                    f"🎉 File {filename} inviato correttamente a {peer_ip} "
+                    f"({sent}/{len(manifest['blocks'])} blocchi trasferiti)"
+                )
+            self._mark_synced(peer_ip, filename, entry["hash"])
+        except PeerBusyError:
+            raise  # Gestito da _retry_when_busy
         except Exception as e:
-            self.logger.error(f"❌ Errore lettura cartella condivisa: {str(e)}")
-        self.file_registry = file_list  # aggiorna il registro.
-        return file_list
+            self.logger.error(f"❌ Errore invio file {filename} a {peer_ip}: {str(e)}")
 
-    def _handle_prepare(self, conn: socket.socket, data: str) -> None:
+    def _download_file(self, peer_ip: str, filename: str, file_size: int) -> bool:
         """
-        Gestisce la preparazione per ricevere un file.
+        Scarica un file da un peer, trasferendo solo i blocchi diversi da quelli locali.
 
         Args:
-            conn (socket.socket): Socket della connessione.
-            data (str): Dati della richiesta PREPARE.
+            peer_ip (str): Indirizzo IP del peer.
+            filename (str): Nome del file da scaricare.
+            file_size (int): Dimensione del file annunciata nella lista.
+
+        Returns:
+            bool: True se il file è stato scaricato; se False il download viene
+            ritentato al round successivo, ripartendo dai blocchi già ricevuti.
         """
         try:
-            _, filename, file_size = data.split(":")  # Estrae nome e dimensione
-            file_size = int(file_size)
+            if self.chunker is not None and self._download_chunked(peer_ip, filename):
+                self.logger.info(f"🎉 File scaricato correttamente (chunk): {filename}")
+                return True
 
-            # Crea un file temporaneo
-            temp_file = os.path.join(self.shared_dir, f".tmp.{filename}")
-            open(temp_file, "wb").close()  # Crea file vuoto
+            # Chiede al peer gli hash dei blocchi del file
+            with self.connection_pool.connection(peer_ip) as conn:
+                _, payload = conn.request(FRAME_BLOCKS, filename.encode())
+                manifest = json.loads(str(payload, "utf-8"))
+            if manifest is None:
+                raise Exception("File non più disponibile sul peer")
+            if manifest["size"] != file_size:
+                self.logger.debug(f"🔄 {filename} è cambiato sul peer durante il sync")
 
-            # Conferma al mittente che siamo pronti
-            conn.send(b"READY")
-            self.logger.info(f"🛠️ Pronto a ricevere {filename} ({file_size} bytes)")
+            if self._should_use_delta(filename, manifest) and self._download_delta(
+                peer_ip, filename, manifest
+            ):
+                self.logger.info(f"🎉 File scaricato correttamente (delta): {filename}")
+                return True
 
-            # Ricevi i chunk. Chuck Norris non fa il debug del codice. Semplicemente lo fissa finché non si corregge da solo.
-            received_size = 0
-            with open(temp_file, "ab") as f:
-                while received_size < file_size:
-                    # Ricevi i dati del blocco (come byte)
-                    block = conn.recv(min(self.block_size, file_size - received_size))
-                    if not block:
-                        break
+            sources = self._find_sources(peer_ip, filename, manifest["hash"])
+            if len(sources) > 1:
+
+                def fetch_swarm(
+                    block_nums: List[int], out_fd: int
+                ) -> Iterator[Tuple[int, bytes]]:
+                    return self._download_swarm(
+                        filename, sources, block_nums, manifest["blocks"]
+                    )
+
+                if not self._assemble_file(filename, manifest, fetch_swarm):
+                    raise Exception("Download interrotto")
+                self.logger.info(
+                    f"🎉 File scaricato correttamente da {len(sources)} peer: {filename}"
+                )
+                return True
 
-                    f.write(block)
-                    received_size += len(block)
+            with self.connection_pool.connection(peer_ip) as conn:
 
-            # Rinomina il file temporaneo
-            final_path = os.path.join(self.shared_dir, filename)
-            os.rename(temp_file, final_path)
-            self.logger.info(f"🎉 File {filename} ricevuto correttamente")
+                def fetch_blocks(
+                    block_nums: List[int], out_fd: int
+                ) -> Iterator[Tuple[int, Optional[memoryview]]]:
+                    return self._download_blocks(conn, filename, block_nums, out_fd)
+
+                if not self._assemble_file(filename, manifest, fetch_blocks):
+                    # Possono esserci blocchi ancora in volo: la connessione va chiusa
+                    raise Exception("Download interrotto")
+            self.logger.info(f"🎉 File scaricato correttamente: {filename}")
+            return True
 
+        except PeerBusyError:
+            raise  # Gestito da _retry_when_busy
         except Exception as e:
-            self.logger.error(f"❌ Errore ricezione file: {str(e)}")
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+            self.logger.error(f"❌ Errore download {filename}: {str(e)}")
+            return False
 
-    def _handle_chunk(self, conn: socket.socket, data: str) -> None:
+    def _download_chunked(self, peer_ip: str, filename: str) -> bool:
         """
-        Gestisce l'invio di un blocco.
+        Scarica un file come lista di chunk content-defined, usando lo store locale.
+
+        Vengono richiesti al peer solo i chunk che non sono già nello store, una
+        sola volta anche se compaiono più volte nel file, con richieste GETCHUNK
+        in pipeline come per i blocchi. Se c'è un download a blocchi interrotto
+        da riprendere il file temporaneo è suo e il download a chunk non parte.
 
         Args:
-            conn (socket.socket): Socket della connessione.
-            data (str): Dati della richiesta CHUNK.
+            peer_ip (str): Indirizzo IP del peer.
+            filename (str): Percorso relativo del file.
+
+        Returns:
+            bool: True se il file è stato ricostruito e verificato; False se il peer
+            non ha lo store attivo o il download non è riuscito.
         """
+        final_path = self._local_path(filename)
+        temp_file = self._temp_path(filename)
+        if os.path.exists(self._resume_path(filename)):
+            return False  # Download a blocchi da riprendere
+        created = False  # Il file temporaneo va rimosso solo se creato qui
         try:
-            _, filename, block_num = data.split(":")
-            block_num = int(block_num)
-            filepath = os.path.join(self.shared_dir, filename)
+            with self.connection_pool.connection(peer_ip) as conn:
+                _, payload = conn.request(FRAME_CHUNKS, filename.encode())
+                manifest = json.loads(str(payload, "utf-8"))
+            if manifest is None:
+                return False  # Il peer non ha lo store dei chunk
+
+            # Scarica solo i chunk mancanti dallo store locale
+            missing = []
+            deduplicated = 0
+            for chunk_hash in dict.fromkeys(c[0] for c in manifest["chunks"]):
+                if os.path.exists(self._chunk_path(chunk_hash)):
+                    deduplicated += 1
+                else:
+                    missing.append(chunk_hash)
+            if missing:
+                with self.connection_pool.connection(peer_ip) as conn:
+
+                    def send_request(index: int) -> int:
+                        stream_id = conn.new_stream()
+                        conn.send(FRAME_GETCHUNK, stream_id, missing[index].encode())
+                        return stream_id
 
-            if os.path.exists(filepath):
-                with open(filepath, "rb") as f:
-                    f.seek(block_num * self.block_size)
-                    block_data = f.read(self.block_size)
-                    conn.send(block_data)  # Invia i dati binari
-                    self.logger.debug(f"📤 Inviato blocco {block_num} di {filename}")
+                    for index, chunk in self._pipeline_blocks(
+                        conn, range(len(missing)), send_request
+                    ):
+                        if self._store_chunk(chunk) != missing[index]:
+                            raise ValueError(f"Chunk {missing[index][:12]} non valido")
+            fetched = len(missing)
+
+            # Ricostruisce il file dallo store
+            os.makedirs(os.path.dirname(temp_file), exist_ok=True)
+            hasher = BlockHasher(self.block_size)
+            created = True
+            with open(temp_file, "wb") as out:
+                for chunk_hash, _ in manifest["chunks"]:
+                    chunk = self._load_chunk(chunk_hash)
+                    if chunk is None:
+                        raise ValueError(f"Chunk {chunk_hash[:12]} rimosso dallo store")
+                    out.write(chunk)
+                    hasher.update(chunk)
+            file_hash, block_hashes = hasher.result()
+            if file_hash != manifest["hash"]:
+                raise ValueError("Hash del file non corrispondente")
+            self._store_cached_hashes(
+                filename,
+                os.stat(temp_file),
+                file_hash,
+                block_hashes,
+                manifest["chunks"],
+            )
+            os.replace(temp_file, final_path)  # Rinomina il file temporaneo
         except Exception as e:
-            self.logger.error(f"❌ Errore invio blocco: {str(e)}")
+            self.logger.warning(f"⚠️ Download a chunk di {filename} non riuscito: {e}")
+            if created and os.path.exists(temp_file):
+                os.remove(temp_file)
+            return False
 
-    def _broadcast_presence(self) -> None:
-        """Annuncia la propria presenza agli altri peer."""
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        self._update_registry_entry(filename)
+        self._inc_metric("chunks_fetched", fetched)
+        self._inc_metric("chunks_deduplicated", deduplicated)
+        self.logger.debug(
+            f"🧩 {filename}: {fetched} chunk scaricati, {deduplicated} già presenti"
+        )
+        return True
 
-        self.logger.debug("📢 Annuncio la mia presenza...")
+    def _should_use_delta(self, filename: str, manifest: Dict) -> bool:
+        """
+        Decide se scaricare un file con il delta a checksum rotolante (DELTA).
 
-        while self.active:
-            try:
-                sock.sendto(
-                    b"DISCOVER", (self.multicast_group, self.multicast_port)
-                )  # Invia il pacchetto multicast per il discovery
-                time.sleep(5)
-            except Exception as e:
-                if self.active:
-                    self.logger.error(f"❌ Errore discovery: {str(e)}")
+        Conviene solo quando una modifica ha spostato dati già presenti nella copia
+        locale, cioè quando la dimensione cambia di un numero di byte non multiplo
+        del blocco e il primo blocco diverso non è in fondo al file (inserimenti o
+        cancellazioni nel mezzo). Se i blocchi restano allineati (modifiche sul
+        posto, file riscritti della stessa dimensione, aggiunte in coda) il
+        trasferimento a blocchi riusa già tutto il riusabile senza far scorrere
+        il checksum sul peer. I file nuovi si scaricano sempre a blocchi.
 
-    def _sync_loop(self) -> None:
-        """Esegue la sincronizzazione periodica con tutti i peer."""
-        while self.active:
-            try:
-                for peer in list(self.peers):
-                    self._sync_with_peer(peer)  # Sincronizza con il peer corrente
-                time.sleep(self.sync_interval)
-            except Exception as e:
-                self.logger.error(f"❌ Errore durante la sincronizzazione: {str(e)}")
+        Args:
+            filename (str): Percorso relativo del file.
+            manifest (Dict): Manifest dei blocchi del peer.
 
-    def _sync_with_peer(self, peer_ip: str) -> None:
+        Returns:
+            bool: True se conviene il delta.
         """
-        Sincronizza i file con un peer specifico.
+        local_entry = self._get_registry_entry(filename)
+        remote_blocks = manifest["blocks"]
+        if local_entry is None or local_entry["size"] == 0 or len(remote_blocks) < 2:
+            return False
+        if self._load_resume_state(filename, manifest):
+            return False  # Download a blocchi interrotto: si riprende quello
+        if (manifest["size"] - local_entry["size"]) % self.block_size == 0:
+            return False  # Blocchi ancora allineati
+        if len(self._block_hashes(local_entry)) > DELTA_MAX_BLOCKS:
+            return False  # Firma troppo grande per il peer
+        local_blocks = set(self._block_hashes(local_entry))
+        first_missing = next(
+            (i for i, h in enumerate(remote_blocks) if h not in local_blocks), None
+        )
+        if first_missing is None:
+            return False
+        return first_missing < local_entry["size"] // self.block_size
+
+    def _download_delta(self, peer_ip: str, filename: str, manifest: Dict) -> bool:
+        """
+        Scarica un file come delta rispetto alla copia locale, in stile rsync.
+
+        Invia al peer la firma della copia locale (Adler-32 e SHA256 di ogni
+        blocco) e ricostruisce il file dai riferimenti ai blocchi locali e dai
+        dati letterali ricevuti.
 
         Args:
             peer_ip (str): Indirizzo IP del peer.
+            filename (str): Percorso relativo del file.
+            manifest (Dict): Manifest dei blocchi del peer.
+
+        Returns:
+            bool: True se il file è stato ricostruito e verificato; False se il
+            delta non è riuscito o non era conveniente.
         """
+        final_path = self._local_path(filename)
+        temp_file = self._temp_path(filename)
+        local_entry = self._get_registry_entry(filename)
+        if local_entry is None:
+            return False
         try:
-            with socket.create_connection((peer_ip, self.peer_port), timeout=5) as sock:
-                sock.settimeout(10)
-                sock.send(
-                    b"LIST"
-                )  # Invia il comando LIST per ottenere la lista dei file
-                peer_files = json.loads(
-                    sock.recv(65536).decode()
-                )  # Riceve la lista dei file come JSON
-                self._process_peer_files(
-                    peer_ip, peer_files
-                )  # Elabora i file del peer ricevuti
+            with open(final_path, "rb") as local:
+                # Firma: checksum debole letto dal disco, hash forte dal registro
+                strong_hashes = self._block_hashes(local_entry)
+                signature = {
+                    "block_size": self.block_size,
+                    "size": local_entry["size"],
+                    "blocks": [
+                        [zlib.adler32(local.read(self.block_size)), strong]
+                        for strong in strong_hashes
+                    ],
+                }
+
+                encoded = json.dumps(signature).encode()
+                if len(encoded) > self.block_size + DATA_MAX_SLACK:
+                    raise EOFError("firma più grande di un frame DATA")
+
+                with self.connection_pool.connection(peer_ip) as conn, open(
+                    temp_file, "wb"
+                ) as out:
+                    conn.settimeout(60)  # Il peer deve scorrere tutto il file
+                    stream_id, response = conn.request(FRAME_DELTA, filename.encode())
+                    if response != b"READY":
+                        raise Exception("Peer non pronto a inviare il delta")
+                    conn.send(FRAME_DATA, stream_id, encoded)
+
+                    hasher = BlockHasher(self.block_size)
+                    literal_bytes = matched = 0
+                    result = None  # Resta None se il peer rinuncia al delta
+                    while True:
+                        message = conn.receive_data(stream_id)
+                        instruction, payload = bytes(message[:1]), message[1:]
+                        if instruction == DELTA_LITERAL:
+                            data = payload
+                            literal_bytes += len(data)
+                            self._throttle("download", peer_ip, len(data))
+                        elif instruction == DELTA_BLOCK:
+                            (index,) = UINT64.unpack(payload)
+                            local.seek(index * self.block_size)
+                            data = local.read(self.block_size)
+                            matched += 1
+                        elif instruction == DELTA_END:
+                            result = json.loads(str(payload, "utf-8"))
+                            break
+                        elif instruction == DELTA_FALLBACK:
+                            break
+                        else:
+                            raise ValueError(
+                                f"Istruzione delta sconosciuta: {instruction!r}"
+                            )
+                        out.write(data)
+                        hasher.update(data)
+
+            if result is None:
+                raise EOFError("delta non conveniente")
+            file_hash, block_hashes = hasher.result()
+            if file_hash != result["hash"] or file_hash != manifest["hash"]:
+                raise ValueError("Hash del file non corrispondente")
+            self._store_cached_hashes(
+                filename, os.stat(temp_file), file_hash, block_hashes
+            )
+            os.replace(temp_file, final_path)  # Rinomina il file temporaneo
         except Exception as e:
-            self.logger.warning(f"⚠️ Errore sync con {peer_ip}: {str(e)}")
+            level = logging.DEBUG if isinstance(e, EOFError) else logging.WARNING
+            self.logger.log(
+                level, f"⚠️ Delta di {filename} non riuscito, uso i blocchi: {e}"
+            )
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            return False
 
-    def _process_peer_files(self, peer_ip: str, peer_files: Dict) -> None:
+        self._update_registry_entry(filename)
+        self._inc_metric("delta_literal_bytes", literal_bytes)
+        self._inc_metric("delta_matched_blocks", matched)
+        self.logger.debug(
+            f"🧩 {filename}: {literal_bytes} byte letterali, {matched} blocchi riusati"
+        )
+        return True
+
+    def _download_blocks(
+        self,
+        conn: FrameConnection,
+        filename: str,
+        block_nums: List[int],
+        out_fd: Optional[int] = None,
+    ) -> Iterator[Tuple[int, Optional[memoryview]]]:
         """
-        Elabora la lista dei file ricevuta da un peer.
+        Scarica dei blocchi da un peer con richieste CHUNK in pipeline.
+
+        Args:
+            conn (FrameConnection): Connessione verso il peer.
+            filename (str): Nome del file.
+            block_nums (List[int]): Numeri dei blocchi da scaricare.
+            out_fd (Optional[int]): File in cui scrivere direttamente i blocchi
+                grandi (vedi _pipeline_blocks).
+
+        Yields:
+            Tuple[int, Optional[memoryview]]: Numero e dati di ogni blocco,
+            nell'ordine di arrivo; i dati sono validi fino al blocco successivo e
+            sono None se il blocco è già stato scritto in out_fd.
         """
-        local_files = self._get_local_file_list()  # Ottiene la lista dei file locali
+        name = filename.encode()
 
-        # Trova file mancanti o diversi
-        for filename, info in peer_files.items():
-            local_file = os.path.join(
-                self.shared_dir, filename
-            )  # Percorso del file locale
-            if (
-                not os.path.exists(local_file)
-                or self._calculate_hash(local_file) != info["hash"]
-            ):
-                if (peer_ip, filename) not in self.synced_files:  # aggiunto controllo
-                    self.logger.info(f"📥 File da sincronizzare: {filename}")
-                    self._download_file(
-                        peer_ip, filename, info["size"]
-                    )  # Scarica il file dal peer
-                    self.synced_files.add((peer_ip, filename))  # aggiunto
-                else:
-                    self.logger.debug(f"✅ File già sincronizzato: {filename}")
-            else:
-                self.logger.debug(f"✅ File già sincronizzato: {filename}")
+        def send_request(block_num: int) -> int:
+            stream_id = conn.new_stream()
+            conn.send(FRAME_CHUNK, stream_id, UINT64.pack(block_num) + name)
+            return stream_id
 
-        # Invia i nostri file mancanti al peer
-        for filename, info in local_files.items():
-            if (
-                filename not in peer_files
-                or peer_files[filename]["hash"] != info["hash"]
-            ):
-                if (peer_ip, filename) not in self.synced_files:  # aggiunto controllo
-                    self.logger.info(f"📤 Invio file {filename} a {peer_ip}")
-                    self._send_file_to_peer(peer_ip, filename)  # Invia il file al peer
-                    self.synced_files.add((peer_ip, filename))  # aggiunto
-                else:
-                    self.logger.debug(f"✅ File già sincronizzato: {filename}")
-            else:
-                self.logger.debug(f"✅ File già sincronizzato: {filename}")
+        return self._pipeline_blocks(conn, block_nums, send_request, out_fd=out_fd)
 
-    def _send_file_to_peer(self, peer_ip: str, filename: str) -> None:
+    def _find_sources(self, peer_ip: str, filename: str, file_hash: str) -> List[str]:
         """
-        Invia un file completo a un peer.
+        Trova i peer che hanno annunciato la stessa versione di un file.
 
         Args:
-            peer_ip (str): Indirizzo IP del peer.
-            filename (str): Nome del file da inviare.
+            peer_ip (str): Peer da cui è partito il download, sempre incluso.
+            filename (str): Percorso relativo del file.
+            file_hash (str): Hash SHA256 della versione da scaricare.
+
+        Returns:
+            List[str]: Peer da cui scaricare i blocchi.
         """
-        try:
-            filepath = os.path.join(self.shared_dir, filename)
-            if not os.path.exists(filepath):
-                self.logger.warning(f"⚠️ File {filename} non trovato")
-                return
+        with self.peer_lists_lock:
+            return [peer_ip] + [
+                peer
+                for peer, files in self.peer_lists.items()
+                if peer != peer_ip
+                and peer in self.peers
+                and files.get(filename, {}).get("hash") == file_hash
+            ]
 
-            file_size = os.path.getsize(filepath)
+    def _download_swarm(
+        self,
+        filename: str,
+        sources: List[str],
+        block_nums: List[int],
+        block_hashes: List[str],
+    ) -> Iterator[Tuple[int, bytes]]:
+        """
+        Scarica dei blocchi da più peer contemporaneamente.
 
-            with socket.create_connection(
-                (peer_ip, self.peer_port), timeout=10
-            ) as sock:
-                sock.settimeout(15)
+        Ogni peer ha un thread con una propria connessione e una finestra di
+        richieste proporzionale al suo throughput misurato (vedi SwarmDownload).
 
-                # Invia comando di preparazione
-                sock.send(
-                    f"PREPARE:{filename}:{file_size}".encode()
-                )  # Invia il comando PREPARE con nome e dimensione
+        Args:
+            filename (str): Percorso relativo del file.
+            sources (List[str]): Peer che hanno il file.
+            block_nums (List[int]): Numeri dei blocchi da scaricare.
+            block_hashes (List[str]): Hash SHA256 di tutti i blocchi del file.
 
-                # Attendi conferma
-                response = sock.recv(1024).decode()
-                if response != "READY":
-                    raise Exception("Peer non pronto a ricevere")
+        Yields:
+            Tuple[int, bytes]: Numero e dati di ogni blocco, nell'ordine di arrivo.
+        """
+        swarm = SwarmDownload(sources, block_nums, block_hashes)
+        for peer_ip in sources:
+            threading.Thread(
+                target=self._swarm_worker,
+                args=(swarm, peer_ip, filename),
+                daemon=True,
+            ).start()
+        self._inc_metric("swarm_downloads")
 
-                # Invia i blocchi
-                with open(filepath, "rb") as f:
-                    block_num = 0
-                    while True:
-                        block = f.read(self.block_size)
-                        if not block:
-                            break
+        active = len(sources)
+        received = 0
+        try:
+            while received < len(block_nums) and active:
+                block_num, data = swarm.results.get()
+                if data is None:
+                    active -= 1  # Un peer ha terminato
+                    continue
+                received += 1
+                yield block_num, data
+        finally:
+            swarm.stop()
 
-                        # Invia il comando CHUNK
-                        sock.send(
-                            f"CHUNK:{filename}:{block_num}".encode()
-                        )  # Invia il comando CHUNK con nome e numero blocco. Non evoca Chuck Norris.
+    def _swarm_worker(self, swarm: SwarmDownload, peer_ip: str, filename: str) -> None:
+        """
+        Scarica da un peer i blocchi di uno swarm finché il download non finisce.
 
-                        # Invia i dati del blocco
-                        sock.send(block)
+        Un peer che fallisce o invia un blocco non valido viene escluso e i suoi
+        blocchi tornano in coda per gli altri.
 
-                        self.logger.debug(
-                            f"📤 Inviato blocco {block_num} di {filename} a {peer_ip}"
-                        )
-                        block_num += 1
+        Args:
+            swarm (SwarmDownload): Download condiviso.
+            peer_ip (str): Peer da cui scaricare.
+            filename (str): Percorso relativo del file.
+        """
+        name = filename.encode()
+        fetched = 0
+        try:
+            with self.connection_pool.connection(peer_ip) as conn:
 
-                self.logger.info(
-                    f"🎉 File {filename} inviato correttamente a {peer_ip}"
-                )
-            self.synced_files.add((peer_ip, filename))
+                def send_request(block_num: int) -> int:
+                    stream_id = conn.new_stream()
+                    conn.send(FRAME_CHUNK, stream_id, UINT64.pack(block_num) + name)
+                    return stream_id
+
+                while not swarm.finished():
+                    last = time.monotonic()
+                    for block_num, data in self._pipeline_blocks(
+                        conn,
+                        iter(lambda: swarm.claim(peer_ip), None),
+                        send_request,
+                        lambda: self._swarm_window(swarm, peer_ip),
+                    ):
+                        now = time.monotonic()
+                        self._update_throughput(peer_ip, len(data), now - last)
+                        last = now
+                        if (
+                            hashlib.sha256(data).hexdigest()
+                            != swarm.block_hashes[block_num]
+                        ):
+                            raise ValueError(f"Blocco {block_num} non valido")
+                        if swarm.complete(peer_ip, block_num, data):
+                            fetched += 1
+                        else:
+                            self._inc_metric("swarm_duplicate_blocks")
+                    swarm.wait_for_work()
         except Exception as e:
-            self.logger.error(f"❌ Errore invio file {filename} a {peer_ip}: {str(e)}")
+            swarm.release(peer_ip)
+            self.logger.warning(f"⚠️ Peer {peer_ip} escluso dallo swarm: {str(e)}")
+        finally:
+            swarm.results.put((None, None))
+            self.logger.debug(f"🐝 {filename}: {fetched} blocchi da {peer_ip}")
+
+    def _swarm_window(self, swarm: SwarmDownload, peer_ip: str) -> int:
+        """
+        Calcola la finestra di richieste di un peer in proporzione al suo throughput.
 
-    def _download_file(self, peer_ip: str, filename: str, file_size: int) -> None:
+        Il peer più veloce dello swarm usa request_window; gli altri una finestra
+        ridotta, così i blocchi finiscono soprattutto verso le fonti più veloci.
+
+        Args:
+            swarm (SwarmDownload): Download condiviso.
+            peer_ip (str): Peer di cui calcolare la finestra.
+
+        Returns:
+            int: Numero massimo di richieste in volo verso il peer.
         """
-        Scarica un file completo da un peer.
+        with self.peer_lists_lock:
+            rate = self.peer_throughput.get(peer_ip)
+            best = max(
+                (self.peer_throughput.get(peer, 0) for peer in swarm.sources),
+                default=0,
+            )
+        if not rate or not best:
+            return self.request_window  # Peer non ancora misurato
+        return max(1, round(self.request_window * rate / best))
+
+    def _update_throughput(self, peer_ip: str, size: int, elapsed: float) -> None:
+        """
+        Aggiorna la media mobile esponenziale del throughput di un peer.
 
         Args:
             peer_ip (str): Indirizzo IP del peer.
-            filename (str): Nome del file da scaricare.
-            file_size (int): Dimensione del file.
-        """
-        try:
-            temp_file = os.path.join(self.shared_dir, f".tmp.{filename}")
-            blocks = (
-                file_size + self.block_size - 1
-            ) // self.block_size  # Calcola il numero di blocchi
-
-            # Prepara il peer
-            with socket.create_connection(
-                (peer_ip, self.peer_port), timeout=10
-            ) as sock:
-                sock.settimeout(15)
-                sock.send(
-                    f"PREPARE:{filename}:{file_size}".encode()
-                )  # Invia il comando PREPARE con nome e dimensione
-                if sock.recv(1024).decode() != "READY":
-                    raise Exception("Peer non pronto a ricevere")
+            size (int): Byte ricevuti.
+            elapsed (float): Secondi trascorsi dalla ricezione precedente.
+        """
+        sample = size / max(elapsed, 1e-6)
+        with self.peer_lists_lock:
+            rate = self.peer_throughput.get(peer_ip)
+            self.peer_throughput[peer_ip] = (
+                sample
+                if rate is None
+                else rate + THROUGHPUT_SMOOTHING * (sample - rate)
+            )
 
-            # Scarica i blocchi
-            with open(temp_file, "wb") as f:
-                for block in range(blocks):
-                    if not self._download_block(peer_ip, filename, block, f):
-                        self.logger.error(f"❌ Download interrotto: {filename}")
-                        os.remove(
-                            temp_file
-                        )  # Rimuove il file temporaneo in caso di errore
-                        return
+    def _pipeline_blocks(
+        self,
+        conn: BaseFrameConnection,
+        block_nums: Iterable[int],
+        send_request: Callable[[int], int],
+        window: Optional[Callable[[], int]] = None,
+        out_fd: Optional[int] = None,
+    ) -> Iterator[Tuple[int, Optional[memoryview]]]:
+        """
+        Richiede dei blocchi tenendo fino a request_window richieste in volo.
 
-            final_path = os.path.join(self.shared_dir, filename)
-            os.rename(
-                temp_file, final_path
-            )  # Rinomina il file temporaneo in quello definitivo
-            self.logger.info(f"🎉 File scaricato correttamente: {filename}")
+        Invece di attendere un round trip per ogni blocco, le richieste successive
+        partono mentre le risposte sono ancora in viaggio; ogni risposta viene
+        associata alla sua richiesta tramite l'id dello stream (in ordine di invio
+        per le richieste che condividono lo stesso stream).
 
-        except Exception as e:
-            self.logger.error(f"❌ Errore download {filename}: {str(e)}")
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+        Con out_fd, dove splice(2) è disponibile, i blocchi grandi passano dal
+        socket al file senza entrare in userspace: vengono scritti nella loro
+        posizione e restituiti senza dati, e chi li riceve li verifica rileggendo
+        il file.
+
+        Args:
+            conn (BaseFrameConnection): Connessione verso il peer.
+            block_nums (Iterable[int]): Numeri dei blocchi da richiedere, letti
+                solo quando c'è spazio nella finestra.
+            send_request (Callable[[int], int]): Invia la richiesta di un blocco e
+                restituisce l'id dello stream su cui arriverà la risposta.
+            window (Optional[Callable[[], int]]): Restituisce la dimensione
+                corrente della finestra. Default: request_window.
+            out_fd (Optional[int]): File di destinazione dei blocchi (il blocco
+                n va all'offset n * block_size). Default: nessuno.
+
+        Yields:
+            Tuple[int, Optional[memoryview]]: Numero e dati di ogni blocco,
+            nell'ordine di arrivo; i dati sono validi fino al blocco successivo e
+            sono None se il blocco è già stato scritto in out_fd.
+
+        Raises:
+            PeerBusyError: Se il peer è saturo e chiede di riprovare.
+            ProtocolError: Se il peer risponde con un errore o con un frame inatteso.
+        """
+        pending = iter(block_nums)
+        in_flight: Dict[int, deque] = defaultdict(deque)  # stream -> blocchi
+        waiting = 0
+        while True:
+            while waiting < (window() if window else self.request_window):
+                block_num = next(pending, None)
+                if block_num is None:
+                    break
+                in_flight[send_request(block_num)].append(block_num)
+                waiting += 1
+            if not waiting:
+                return
+
+            splice = out_fd is not None and conn.can_splice
+            frame_type, stream_id, length = conn.receive_header(exact=splice)
+            if frame_type == FRAME_BUSY:
+                raise PeerBusyError(conn.receive_payload(length))
+            requested = in_flight.get(stream_id)
+            if not requested:
+                raise ProtocolError(f"Frame dello stream {stream_id} inatteso")
+            block_num = requested.popleft()
+            if not requested:
+                del in_flight[stream_id]
+            waiting -= 1
+            # Attendere prima di leggere il payload rallenta anche il mittente (TCP)
+            self._throttle("download", conn.peer_ip, length)
+            if splice and frame_type == FRAME_DATA and length >= SPLICE_MIN_SIZE:
+                if length > self.block_size:
+                    raise ProtocolError(f"Blocco {block_num} troppo grande")
+                conn.receive_to_file(length, out_fd, block_num * self.block_size)
+                yield block_num, None
+                continue
+            payload = conn.receive_payload(length)
+            if frame_type == FRAME_ERROR:
+                raise ProtocolError(str(payload, "utf-8", "replace"))
+            if frame_type != FRAME_DATA:
+                raise ProtocolError(f"Frame di tipo {frame_type:#x} inatteso")
+            yield block_num, payload
 
-    def _download_block(
-        self, peer_ip: str, filename: str, block_num: int, file_handle
+    def _assemble_file(
+        self,
+        filename: str,
+        manifest: Dict,
+        fetch_blocks: Callable[[List[int], int], Iterator[Tuple[int, Optional[bytes]]]],
     ) -> bool:
         """
-        Scarica un singolo blocco da un peer.
+        Ricostruisce un file a partire dal manifest dei blocchi del peer.
+
+        I blocchi già presenti nella copia locale (in qualunque posizione) vengono
+        copiati dal disco; gli altri vengono richiesti tutti insieme a fetch_blocks
+        e scritti con os.pwrite nella loro posizione, in qualunque ordine arrivino.
+        Ogni blocco e l'intero file sono verificati con SHA256 prima del rename
+        finale; i blocchi scritti direttamente da fetch_blocks (splice) vengono
+        verificati rileggendo il file.
+
+        I blocchi scritti vengono annotati in una mappa accanto al file
+        temporaneo: se il download si interrompe il file temporaneo resta, e il
+        tentativo successivo per la stessa versione riparte dai blocchi mancanti.
 
         Args:
-            peer_ip (str): Indirizzo IP del peer.
-            filename (str): Nome del file.
-            block_num (int): Numero del blocco.
-            file_handle: File handle per scrivere i dati.
+            filename (str): Percorso relativo del file.
+            manifest (Dict): Manifest del peer con 'hash', 'size' e 'blocks'.
+            fetch_blocks (Callable[[List[int], int], Iterator[Tuple[int,
+                Optional[bytes]]]]): Funzione che riceve i numeri dei blocchi
+                mancanti e il descrittore del file temporaneo e restituisce le
+                coppie (numero, dati) man mano che arrivano; dati None indica un
+                blocco già scritto nel file.
 
         Returns:
-            bool: True se il blocco è stato scaricato correttamente, False altrimenti.
+            bool: True se il file è stato ricostruito e verificato.
         """
+        final_path = self._local_path(filename)
+        temp_file = self._temp_path(filename)
+        file_size = manifest["size"]
+        remote_blocks = manifest["blocks"]
+        if len(remote_blocks) != (file_size + self.block_size - 1) // self.block_size:
+            raise ValueError(f"Manifest di {filename} non coerente con block_size")
+
+        # Indice hash -> posizione dei blocchi della copia locale, dal registro
+        local_entry = self._get_registry_entry(filename)
+        local_index: Dict[str, int] = {}
+        if local_entry is not None and os.path.exists(final_path):
+            for i, block_hash in enumerate(self._block_hashes(local_entry)):
+                local_index.setdefault(block_hash, i)
+
+        os.makedirs(os.path.dirname(temp_file), exist_ok=True)
+        done = self._load_resume_state(filename, manifest)  # Download interrotto
+        resumed = 0
+        interrupted = False  # Se True il file temporaneo resta per la ripresa
         try:
-            with socket.create_connection(
-                (peer_ip, self.peer_port), timeout=10
-            ) as sock:
-                sock.settimeout(15)
-                request = f"CHUNK:{filename}:{block_num}"  # Comando CHUNK con nome e numero blocco
-                sock.send(request.encode())
+            with open(temp_file, "r+b" if done else "wb") as out, (
+                open(final_path, "rb") if local_index else nullcontext()
+            ) as local:
+                # I blocchi vengono scritti nella loro posizione
+                out.truncate(file_size)
+                missing = []
+                for block_num, block_hash in enumerate(remote_blocks):
+                    if block_num in done:
+                        out.seek(block_num * self.block_size)
+                        data = out.read(self.block_size)
+                        if hashlib.sha256(data).hexdigest() == block_hash:
+                            resumed += 1
+                            continue  # Già ricevuto in un tentativo precedente
+                        done.discard(block_num)
+                    data = None
+                    if block_hash in local_index:
+                        local.seek(local_index[block_hash] * self.block_size)
+                        data = local.read(self.block_size)
+                        if hashlib.sha256(data).hexdigest() != block_hash:
+                            data = None  # Copia locale cambiata nel frattempo
+                    if data is None:
+                        missing.append(block_num)
+                    else:
+                        self._write_at(out, data, block_num * self.block_size)
+                        done.add(block_num)
 
-                received = 0
-                while received < self.block_size:
-                    data = sock.recv(
-                        min(self.block_size - received, 4096)
-                    )  # Riceve i dati del blocco
-                    if not data:
-                        break
-                    file_handle.write(data)  # Scrive i dati nel file temporaneo
-                    received += len(data)
+                remaining = set(missing)
+                unverified = set()  # Blocchi scritti senza passare da userspace
+                last_save = time.monotonic()
+                try:
+                    for block_num, data in fetch_blocks(missing, out.fileno()):
+                        if block_num not in remaining:
+                            raise ValueError(f"Blocco {block_num} non valido")
+                        if data is None:
+                            unverified.add(block_num)
+                        elif (
+                            hashlib.sha256(data).hexdigest() != remote_blocks[block_num]
+                        ):
+                            raise ValueError(f"Blocco {block_num} non valido")
+                        else:
+                            self._write_at(out, data, block_num * self.block_size)
+                        remaining.discard(block_num)
+                        done.add(block_num)
+                        if time.monotonic() - last_save >= RESUME_SAVE_INTERVAL:
+                            self._save_resume_state(filename, manifest, done)
+                            last_save = time.monotonic()
+                    if remaining:
+                        raise ValueError(f"{len(remaining)} blocchi non ricevuti")
+                except BaseException:
+                    # I blocchi scritti restano validi: si riprende da quelli mancanti
+                    interrupted = bool(done)
+                    if interrupted:
+                        self._save_resume_state(filename, manifest, done)
+                    raise
 
-                return received > 0
+            # I blocchi arrivano fuori ordine: l'hash del file si verifica rileggendolo
+            file_hasher = hashlib.sha256()
+            with open(temp_file, "rb") as f:
+                for block_num in range(len(remote_blocks)):
+                    data = f.read(self.block_size)
+                    file_hasher.update(data)
+                    if (
+                        block_num in unverified
+                        and hashlib.sha256(data).hexdigest() != remote_blocks[block_num]
+                    ):
+                        raise ValueError(f"Blocco {block_num} non valido")
+            if file_hasher.hexdigest() != manifest["hash"]:
+                raise ValueError("Hash del file non corrispondente")
+            # Gli hash sono già noti: li salva in cache prima del rename (che non
+            # cambia inode né mtime), così nessuno deve rileggere il file
+            self._store_cached_hashes(
+                filename, os.stat(temp_file), manifest["hash"], remote_blocks
+            )
+            os.replace(temp_file, final_path)  # Rinomina il file temporaneo
         except Exception as e:
-            self.logger.warning(f"⚠️ Errore blocco {block_num} di {filename}: {str(e)}")
+            if interrupted:
+                self.logger.warning(
+                    f"⏸️ Download di {filename} interrotto ({len(done)}/"
+                    f"{len(remote_blocks)} blocchi), riprenderà dal punto raggiunto: "
+                    f"{str(e)}"
+                )
+                return False
+            self.logger.error(f"❌ Errore ricostruzione {filename}: {str(e)}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)  # Rimuove il file temporaneo in caso di errore
+            self._discard_resume_state(filename)
             return False
 
-    def _calculate_hash(self, filepath: str) -> str:
+        self._discard_resume_state(filename)
+        fetched = len(missing)
+        self._update_registry_entry(filename)
+        self._inc_metric("blocks_fetched", fetched)
+        self._inc_metric("blocks_resumed", resumed)
+        self._inc_metric("blocks_reused", len(remote_blocks) - fetched - resumed)
+        self.logger.debug(
+            f"🧩 {filename}: {fetched} blocchi scaricati, "
+            f"{len(remote_blocks) - fetched} riusati"
+        )
+        return True
+
+    @staticmethod
+    def _write_at(f, data: bytes, offset: int) -> None:
+        """
+        Scrive dei dati in una posizione del file senza spostarne il cursore.
+
+        Args:
+            f: File aperto in scrittura binaria.
+            data (bytes): Dati da scrivere.
+            offset (int): Posizione nel file.
+        """
+        if not hasattr(os, "pwrite"):  # Windows
+            f.seek(offset)
+            f.write(data)
+            return
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(f.fileno(), view, offset)
+            view, offset = view[written:], offset + written
+
+    def _calculate_hashes(
+        self, filepath: str
+    ) -> Tuple[str, List[str], Optional[List[List]]]:
         """
-        Calcola l'hash SHA256 di un file.
+        Calcola in una sola lettura l'hash SHA256 di un file e dei suoi blocchi.
+
+        Con lo store dei chunk attivo, nella stessa lettura il file viene diviso
+        in chunk content-defined e i chunk nuovi vengono salvati nello store.
 
         Args:
             filepath (str): Percorso del file.
 
         Returns:
-            str: Hash SHA256 del file.
+            Tuple[str, List[str], Optional[List[List]]]: Hash SHA256 del file, di ogni
+            blocco di block_size byte e, se lo store è attivo, lista dei chunk
+            ([hash, lunghezza]).
         """
         if not os.path.exists(filepath):
-            return ""
-        hasher = hashlib.sha256()
+            return "", [], None
+        self._inc_metric("hashes_computed")
+        hasher = BlockHasher(self.block_size)
         with open(filepath, "rb") as f:
+            if self.chunker is not None:
+                chunks = []
+                for chunk in self.chunker.split(f):
+                    hasher.update(chunk)
+                    chunks.append([self._store_chunk(chunk), len(chunk)])
+                return (*hasher.result(), chunks)
             while True:
                 data = f.read(self.block_size)
                 if not data:
                     break
                 hasher.update(data)  # Aggiorna l'hash con i dati del blocco
-        return hasher.hexdigest()
+        return (*hasher.result(), None)
+
+    def set_rate_limits(
+        self,
+        upload_limit: Optional[int] = None,
+        download_limit: Optional[int] = None,
+        peer_upload_limit: Optional[int] = None,
+        peer_download_limit: Optional[int] = None,
+        peer_ip: Optional[str] = None,
+    ) -> None:
+        """
+        Cambia i limiti di banda, anche mentre i trasferimenti sono in corso.
+
+        Args:
+            upload_limit (Optional[int]): Limite globale di invio in byte al
+                secondo (0: nessun limite; None: invariato).
+            download_limit (Optional[int]): Limite globale di ricezione.
+            peer_upload_limit (Optional[int]): Limite di invio per peer.
+            peer_download_limit (Optional[int]): Limite di ricezione per peer.
+            peer_ip (Optional[str]): Se indicato, i limiti per peer valgono solo
+                per questo peer; i limiti globali vengono ignorati.
+        """
+        with self.rate_lock:
+            for direction, limit, peer_limit in (
+                ("upload", upload_limit, peer_upload_limit),
+                ("download", download_limit, peer_download_limit),
+            ):
+                if limit is not None and peer_ip is None:
+                    self.rate_buckets[direction].set_rate(limit)
+                    self._set_metric(f"{direction}_limit", limit)
+                if peer_limit is None:
+                    continue
+                if peer_ip is not None:
+                    self.peer_rate_overrides[(direction, peer_ip)] = peer_limit
+                    bucket = self.peer_rate_buckets.get((direction, peer_ip))
+                    if bucket is not None:
+                        bucket.set_rate(peer_limit)
+                    continue
+                self.peer_rate_limits[direction] = peer_limit
+                self._set_metric(f"peer_{direction}_limit", peer_limit)
+                for (bucket_direction, ip), bucket in self.peer_rate_buckets.items():
+                    if bucket_direction == direction:
+                        bucket.set_rate(
+                            self.peer_rate_overrides.get((direction, ip), peer_limit)
+                        )
+
+    def _throttle(self, direction: str, peer_ip: str, amount: int) -> None:
+        """
+        Attende finché i limiti di banda consentono di trasferire dei dati.
+
+        Args:
+            direction (str): "upload" o "download".
+            peer_ip (str): Indirizzo IP del peer.
+            amount (int): Byte da trasferire.
+        """
+        key = (direction, peer_ip)
+        with self.rate_lock:
+            bucket = self.peer_rate_buckets.get(key)
+            if bucket is None:
+                bucket = self.peer_rate_buckets[key] = TokenBucket(
+                    self.peer_rate_overrides.get(key, self.peer_rate_limits[direction])
+                )
+        wait = max(self.rate_buckets[direction].reserve(amount), bucket.reserve(amount))
+        self._inc_metric(f"{direction}_bytes", amount)
+        if wait > 0:
+            self._inc_metric(f"{direction}_throttled_ms", int(wait * 1000))
+            time.sleep(wait)
+
+    def _inc_metric(self, name: str, amount: int = 1) -> None:
+        """
+        Incrementa un contatore delle metriche.
+
+        Args:
+            name (str): Nome della metrica.
+            amount (int): Valore da aggiungere. Default: 1.
+        """
+        with self.metrics_lock:
+            self.metrics[name] += amount
+
+    def _set_metric(self, name: str, value: int) -> None:
+        """
+        Imposta il valore di una metrica.
+
+        Args:
+            name (str): Nome della metrica.
+            value (int): Nuovo valore.
+        """
+        with self.metrics_lock:
+            self.metrics[name] = value
+
+    def get_metrics(self) -> Dict[str, int]:
+        """
+        Restituisce una copia delle metriche correnti del nodo.
+
+        Returns:
+            Dict[str, int]: Contatori, ad esempio 'hashes_computed' (hash calcolati
+            dall'avvio) e 'last_round_hashes' (hash calcolati nell'ultimo round).
+        """
+        with self.metrics_lock:
+            return dict(self.metrics)
 
     def stop(self) -> None:
         """Arresta il servizio in modo pulito."""
         self.active = False
+        with self.transfer_condition:
+            self.transfer_condition.notify_all()  # Sveglia i thread dei trasferimenti
+        if self.loop is not None and self.loop_stopped is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.loop_stopped.set)
+            except RuntimeError:
+                pass  # Loop già chiuso
+        if self.loop_thread is not None:
+            self.loop_thread.join(timeout=5)
+        if self.server_executor is not None:
+            self.server_executor.shutdown(wait=False, cancel_futures=True)
+        self.peer_sync_executor.shutdown(wait=False, cancel_futures=True)
+        self.connection_pool.close_all()
+        self._save_hash_cache()  # Conserva gli hash per il prossimo avvio
         self.logger.info("🛑 Servizio arrestato")
         logging.shutdown()  # Arresta il logger correttamente prima di esposioni nucleari
 
@@ -0,0 +1,143 @@
+"""
+Test di integrazione: due nodi sulla stessa macchina si sincronizzano via loopback.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import p2p_file_sync  # noqa: E402
+
+PEER = "127.0.0.1"
+TIMEOUT = 30  # Secondi di attesa massima per ogni sincronizzazione
+
+
+def _free_port(kind: int) -> int:
+    """
+    Args:
+        kind (int): socket.SOCK_STREAM o socket.SOCK_DGRAM.
+
+    Returns:
+        int: Una porta libera su localhost per il tipo di socket richiesto.
+    """
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def setUpModule() -> None:
+    logging.disable(logging.CRITICAL)  # Ogni nodo aggiunge un handler sulla console
+
+
+def tearDownModule() -> None:
+    logging.disable(logging.NOTSET)
+
+
+class LoopbackTest(unittest.TestCase):
+    engine = "threads"
+    block_size = 4096
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.nodes = []
+        tcp = [_free_port(socket.SOCK_STREAM) for _ in range(2)]
+        for name, port, peer_port in (("a", tcp[0], tcp[1]), ("b", tcp[1], tcp[0])):
+            node = p2p_file_sync.P2PFileSync(
+                os.path.join(self.root, name),
+                block_size=self.block_size,
+                peer_port=port,
+                multicast_port=_free_port(socket.SOCK_DGRAM),
+                sync_interval=3600,  # Le sincronizzazioni le avvia il test
+                engine=self.engine,
+            )
+            node.connection_pool.port = peer_port  # Stessa macchina, porte diverse
+            self.nodes.append(node)
+        self.a, self.b = self.nodes
+        time.sleep(0.3)  # Server in ascolto
+
+    def tearDown(self) -> None:
+        for node in self.nodes:
+            node.stop()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _write(self, node: p2p_file_sync.P2PFileSync, name: str, data: bytes) -> None:
+        """Scrive un file nella cartella del nodo e attende che entri nel registro."""
+        with open(os.path.join(node.shared_dir, name), "wb") as f:
+            f.write(data)
+        digest = hashlib.sha256(data).hexdigest()
+        self._wait(
+            lambda: (node._get_registry_entry(name) or {}).get("hash") == digest,
+            f"{name} non indicizzato",
+        )
+
+    def _read(self, node: p2p_file_sync.P2PFileSync, name: str) -> bytes:
+        try:
+            with open(os.path.join(node.shared_dir, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return b""
+
+    def _wait(self, condition, message: str) -> None:
+        deadline = time.monotonic() + TIMEOUT
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail(message)
+            time.sleep(0.05)
+
+    def _sync(self, name: str, data: bytes) -> None:
+        """Sincronizza a con b e attende che entrambi abbiano `data` in `name`."""
+        self.assertTrue(self.a._sync_with_peer(PEER))
+        self._wait(
+            lambda: self._read(self.a, name) == data
+            and self._read(self.b, name) == data,
+            f"{name} non sincronizzato",
+        )
+
+    def test_pull(self) -> None:
+        data = os.urandom(300_000)
+        self._write(self.b, "pull.bin", data)
+        self._sync("pull.bin", data)
+
+    def test_push(self) -> None:
+        data = os.urandom(300_000)
+        self._write(self.a, "push.bin", data)
+        self._sync("push.bin", data)
+
+    def test_delta(self) -> None:
+        data = os.urandom(1_000_000)
+        self._write(self.b, "delta.bin", data)
+        self._sync("delta.bin", data)
+        # Byte inseriti all'inizio: quasi tutti i blocchi cambiano posizione
+        changed = data[:100] + b"inserted" + data[100:]
+        self._write(self.b, "delta.bin", changed)
+        self._sync("delta.bin", changed)
+        metrics = self.a.get_metrics()
+        self.assertGreater(metrics.get("delta_matched_blocks", 0), 0)
+        self.assertLess(metrics.get("delta_literal_bytes", 0), len(changed) // 10)
+
+    def test_push_large_manifest(self) -> None:
+        # Con blocchi da 4KB il manifest di un file da 20MB supera un frame DATA
+        data = os.urandom(20_000_000)
+        self._write(self.a, "big.bin", data)
+        blocks = self.a._block_hashes(self.a._get_registry_entry("big.bin"))
+        manifest_size = len(json.dumps(blocks))
+        frame_limit = self.block_size + p2p_file_sync.DATA_MAX_SLACK
+        self.assertGreater(manifest_size, frame_limit)
+        self._sync("big.bin", data)
+
+
+class AsyncLoopbackTest(LoopbackTest):
+    engine = "asyncio"
+
+
+if __name__ == "__main__":
+    unittest.main()